@@ -31,6 +31,13 @@ CDSP_CFG = {
             False,
             False,
             ),
+        'capture_rate_variants': True,
+        # loop0: LMS, loop1: pipewire/jacktrip, loop2: bluetooth
+        'configs_source_priority': (
+            0,
+            1,
+            2,
+            ),
         'update_interval': 4,
         }
 
@@ -22,6 +22,8 @@ if __name__ == '__main__':
         ))
 
     display.t_wait_events.start()
+    display.t_meter_loop.start()
+    display.t_wait_action.start()
 
     try:
         display.t_wait_events.join()
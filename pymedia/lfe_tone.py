@@ -4,74 +4,90 @@
 # pylint: disable=missing-class-docstring
 # pylint: disable=missing-function-docstring
 
+import functools
+import re
+import threading
 import time
-import subprocess
-import os
+import redis
 
 import pymedia_redis
 import pymedia_logger
-from pymedia_utils import SimpleThreads
+from pymedia_pcm import PcmPlayback, to_pcm_bytes
+from pymedia_utils import SimpleThreads, lazy_import
 from pymedia_cdsp import redis_cdsp_ping
 
 from pymedia_const import REDIS_SERVER, REDIS_PORT, REDIS_DB
 
+np = lazy_import("numpy")
+
 # ---------------------
 
-# inaudible tones used to "wake up" the subwoofer
-#
-# Keep sample rate / format in sync with /etc/asound.conf and CamillaDSP
-# configuration !
-#
-# Alternatively we could use the same tone file and use alsa's "plug" plugin to
-# play with the right rate/format; a potential issue is that aplay could open
-# the device with different sample rate/format/channels params if camilladsp
-# isn't running yet.
-# 'plug' also fixes IPC permission issues if they aren't set properly
-# Note: CPU usage is the same when using hw: or plug: device, despite alsa
-# re-sampling stuff.
+# inaudible tone used to "wake up" the subwoofer
 #
-# Generating tones:
-# - audacity (generate / tone / ...)
-# - or sox (see ~/sounds/gen_tone)
-
-LFE_TONE_DEFS = [
-        # confix index 0
-        {
-            'file' : (os.environ.get('HOME')
-                      + "/sounds/tone_mono_6Hz_10s_44100_signed16.wav"),
-            'device' : "Loopback0_0_c2",
-            },
-        # confix index 1
-        {
-            'file' : (os.environ.get('HOME')
-                      + "/sounds/tone_mono_6Hz_10s_24000_float32.wav"),
-            'device' : "Loopback1_0_c2",
-            },
-        # confix index 2
-        {
-            'file' : (os.environ.get('HOME')
-                      + "/sounds/tone_mono_6Hz_10s_44100_signed16.wav"),
-            'device' : "Loopback2_0_c2",
-            },
-
-        ]
+# The tone is synthesized for the capture rate/format of the active CamillaDSP
+# config (see CDSP:capture), and played on the loopback dshare device feeding
+# the LFE tone capture channel (eg. Loopback0_1_snoop -> Loopback0_0_c2 - see
+# /etc/asound.conf): there are no tone files to keep in sync with the configs.
+LFE_TONE_FREQ = 6           # Hz
+LFE_TONE_DURATION = 10      # seconds
+LFE_TONE_LEVEL = -1         # dBFS (the configs apply a -24dB gain filter)
+LFE_TONE_FADE = 0.5         # seconds - fade in/out
+LFE_TONE_CHANNEL = 2        # capture channel of the tone in the configs
+LFE_TONE_PERIOD = 0.1       # seconds - also the cancellation latency
+
+# capture (dsnoop) device -> tone playback (dshare) device
+LFE_TONE_DEVICE_RE = re.compile(r'^(Loopback\d+)_1_snoop$')
+LFE_TONE_DEVICE = "{loopback}_0_c2"
 
 # how often the tone should be played (in seconds) when conditions are met
 LFE_TONE_PLAY_INTERVAL = 240
 
-LFE_TONE_PLAY_LOOP_INTERVAL = 10 # seconds
+# retry delay when a keepalive tone couldn't be played (eg. device error)
+LFE_TONE_RETRY_INTERVAL = 30 # seconds
+
+# events after which the conditions to play the tone are re-evaluated (eg.
+# player play/unpause, cdsp unmute / config change / connection); a tone is
+# played immediately when they become true
+LFE_TONE_PUBSUBS = ('CDSP:EVENT', 'PLAYER:EVENT')
 
 # ---------------------
+
+@functools.lru_cache(maxsize=4)
+def tone_data(rate, sample_format):
+    """Return the tone as (mono) PCM data - cached per rate/format."""
+    times = np.arange(int(LFE_TONE_DURATION * rate)) / rate
+    tone = 10**(LFE_TONE_LEVEL / 20) * np.sin(2 * np.pi * LFE_TONE_FREQ * times)
+    fade = int(LFE_TONE_FADE * rate)
+    ramp = 0.5 - 0.5 * np.cos(np.pi * np.arange(fade) / fade)
+    tone[:fade] *= ramp
+    tone[-fade:] *= ramp[::-1]
+    return to_pcm_bytes(tone, sample_format)
+
+def tone_device(capture_device):
+    """Return the tone playback device for a CamillaDSP capture device."""
+    match = LFE_TONE_DEVICE_RE.match(capture_device or "")
+    if not match:
+        return None
+    return LFE_TONE_DEVICE.format(loopback=match.group(1))
+
+
 class LfeTone():
     def __init__(self, _redis):
         self._log = pymedia_logger.get_logger(__class__.__name__)
         self._redis = _redis
         self._playing_lfe_tone = False
+        self._cancel = threading.Event()
         self._last_played_lfe_tone = self._redis.get("last_played")
         if self._last_played_lfe_tone is None:
             self._last_played_lfe_tone = 0
+        # keepalive scheduling - see keepalive_loop()
+        self._schedule = threading.Condition()
+        self._active = False
+        self._active_config = None
+        self._retry_at = 0
         self.threads = SimpleThreads()
-        self.threads.add_target(self.loop_play)
+        self.threads.add_target(self.wait_events)
+        self.threads.add_target(self.keepalive_loop)
         self.threads.add_thread(self._redis.t_wait_action(self.action))
 
     def action(self, action=""):
@@ -84,18 +100,108 @@ class LfeTone():
             self.play()
         elif action == "play_skip_tests":
             self.play(skip_tests = True)
+        elif action == "stop":
+            self.stop()
         else:
             self._log.warning("action '%s' isn't defined", action)
 
-    def loop_play(self):
-        """Regularly run self.play() to play a lfe tone."""
+    def conditions(self):
+        """Return True if the sub should be kept awake.
+
+        Avoid keeping the subwoofer on when not needed: cdsp must be on and
+        unmuted, and the player playing if cdsp controls it.
+        """
+        if not redis_cdsp_ping(self._redis, max_age=10):
+            self._log.debug("cdsp isn't on")
+            return False
+
+        if self._redis.get_s("CDSP:mute"):
+            self._log.debug("cdsp is muted")
+            return False
+
+        if self._redis.get_s("CDSP:standby"):
+            self._log.debug("cdsp is in standby")
+            return False
+
+        if (self._redis.get_s("CDSP:control_player")
+            and not self._redis.get_s("PLAYER:isplaying")):
+            self._log.debug("cdsp controls player and player is paused")
+            return False
+
+        return True
+
+    def update_state(self):
+        """Re-evaluate the conditions (after an event).
+
+        Play a tone right away when they become true (eg. play/unpause,
+        unmute, cdsp connection) or when the config changes while they're
+        true, and (re)schedule the keepalive tones.
+        """
+        active = self.conditions()
+        config = self._redis.get_s("CDSP:capture") if active else None
+        with self._schedule:
+            trigger = active and (not self._active
+                                  or config != self._active_config)
+            if active != self._active:
+                self._log.info("keepalive tones %s",
+                               "scheduled" if active else "stopped")
+            self._active = active
+            self._active_config = config
+            self._schedule.notify_all()
+        if trigger:
+            threading.Thread(target=self.play, args=(True,)).start()
+
+    def wait_events(self):
+        """Wait for redis events and re-evaluate the conditions on each event
+        (blocking - no timeout/polling)."""
+        pubsub = self._redis.redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(LFE_TONE_PUBSUBS)
+        except redis.exceptions.RedisError as ex:
+            self._log.error(ex)
+            raise SystemExit from ex
+        self.update_state()
+        try:
+            for message in pubsub.listen():
+                if message['type'] != 'message':
+                    continue
+                self._log.debug("received message %s", message)
+                self.update_state()
+        except redis.exceptions.RedisError as ex:
+            self._log.error(ex)
+            raise SystemExit from ex
+
+    def keepalive_loop(self):
+        """Play a tone every LFE_TONE_PLAY_INTERVAL while the conditions are
+        true.
+
+        Sleep until the next tone is due (exact timer, re-armed when a tone
+        is played), or indefinitely while the conditions aren't true; woken
+        up by update_state().
+        """
         while True:
-            reltime_last_played = time.time() - self._last_played_lfe_tone
-            self._log.debug("last tone played %ds ago ; interval: %ds",
-                           reltime_last_played, LFE_TONE_PLAY_INTERVAL)
-            if reltime_last_played > LFE_TONE_PLAY_INTERVAL:
-                self.play()
-            time.sleep(LFE_TONE_PLAY_LOOP_INTERVAL)
+            with self._schedule:
+                if not self._active:
+                    self._schedule.wait()
+                    continue
+                delay = (max(self._last_played_lfe_tone
+                             + LFE_TONE_PLAY_INTERVAL, self._retry_at)
+                         - time.time())
+                if delay > 0:
+                    self._log.debug("next keepalive tone in %.1fs", delay)
+                    self._schedule.wait(delay)
+                    continue
+            if not self.conditions():
+                # changed without an event (eg. cdsp stopped) - wait for
+                # the next event
+                with self._schedule:
+                    self._active = False
+                continue
+            played_at = self._last_played_lfe_tone
+            self.play(skip_tests = True)
+            with self._schedule:
+                if self._last_played_lfe_tone == played_at:
+                    self._retry_at = time.time() + LFE_TONE_RETRY_INTERVAL
 
     def play(self, skip_tests = False):
         """Play a lfe tone."""
@@ -112,57 +218,69 @@ class LfeTone():
             self._log.info("already playing lfe tones - noop")
             return
 
-        # avoid keeping the subwoofer on when not needed
-        if not skip_tests:
-
-            if not redis_cdsp_ping(self._redis, max_age=10):
-                self._log.debug("cdsp isn't on - noop")
-                return
-
-            if self._redis.get_s("CDSP:mute"):
-                self._log.debug("cdsp is muted - noop")
-                return
-
-            if (self._redis.get_s("CDSP:control_player")
-                and not self._redis.get_s("PLAYER:isplaying")):
-                self._log.debug("cdsp controls player and player is paused - noop")
-                return
-
-        # get current config index
-        cdsp_config_index = self._redis.get_s("CDSP:config_index")
-        if cdsp_config_index == "":
-            self._log.error("Couldn't get cdsp config index")
+        if not skip_tests and not self.conditions():
+            self._log.debug("conditions aren't met - noop")
             return
 
-        # get corresponding tone
+        # get the capture parameters of the current config
+        capture = self._redis.get_s("CDSP:capture")
+        if not capture:
+            self._log.error("Couldn't get cdsp capture parameters")
+            return
+        device = tone_device(capture.get('device'))
+        if not device:
+            self._log.error("No tone device for capture device '%s'",
+                            capture.get('device'))
+            return
+        if capture['channels'] <= LFE_TONE_CHANNEL:
+            self._log.error("capture has no channel %d for the tone (%d"
+                            " channels)", LFE_TONE_CHANNEL,
+                            capture['channels'])
+            return
         try:
-            lfe = LFE_TONE_DEFS[int(cdsp_config_index)]
-        except KeyError as ex:
-            self._log.error("No index %s found in LFE_TONE_DEFS: %s",
-                           cdsp_config_index, ex)
+            data = tone_data(capture['samplerate'], capture['format'])
+        except KeyError:
+            self._log.error("unsupported capture format '%s'",
+                            capture['format'])
             return
 
         # finally, try to play the tone
-        self._log.info("start playing lfe tone %s for config index %s on %s",
-                       lfe['file'], cdsp_config_index, lfe['device'])
+        with self._schedule:
+            if self._playing_lfe_tone:
+                self._log.info("already playing lfe tones - noop")
+                return
+            self._playing_lfe_tone = True
+        self._log.info("start playing lfe tone (%dHz, %s) on %s",
+                       capture['samplerate'], capture['format'], device)
+        self._cancel.clear()
+        played = False
+        # the dshare device only exposes the tone channel
+        playback = PcmPlayback(device, 1, capture['samplerate'],
+                               capture['format'],
+                               int(capture['samplerate'] * LFE_TONE_PERIOD))
+        if playback.open():
+            if playback.write(data, self._cancel):
+                playback.drain()
+                played = True
+                self._log.info("stopped playing tone")
+            else:
+                self._log.info("tone playback was interrupted")
+            playback.close()
 
-        self._playing_lfe_tone = True
-        try:
-            sub = subprocess.run(['aplay', '-D', lfe['device'], lfe['file'] ],
-                            check=True, capture_output=True, text=True)
-        except subprocess.CalledProcessError as ex:
-            self._log.error("Error: %s / cmd: %s / stderr: %s", ex, ex.cmd,
-                           ex.stderr)
-        except FileNotFoundError as ex:
-            self._log.error(ex)
-        else:
-            self._last_played_lfe_tone = time.time()
-            self._log.debug("command stdout: %s", sub.stdout)
-            self._log.debug("command stderr: %s", sub.stderr)
+        self._playing_lfe_tone = False
+
+        if played:
+            # re-arm the keepalive timer
+            with self._schedule:
+                self._last_played_lfe_tone = time.time()
+                self._schedule.notify_all()
             self._redis.set("last_played", self._last_played_lfe_tone)
-            self._log.info("stopped playing tone")
 
-        self._playing_lfe_tone = False
+    def stop(self):
+        """Stop playing the tone (within LFE_TONE_PERIOD)."""
+        if self._playing_lfe_tone:
+            self._log.info("stopping lfe tone")
+            self._cancel.set()
 
 
 # ----------------
@@ -4,52 +4,37 @@
 # pylint: disable=missing-class-docstring
 # pylint: disable=missing-function-docstring
 
-from pyalsa import alsamixer
-
 import pymedia_alsa
 import pymedia_redis
-import pymedia_buffer_event
+from pymedia_volsync import VolumeSync
 
 from pymedia_const import REDIS_SERVER, REDIS_PORT, REDIS_DB
 
 # ---------------------
 
-ALSA_PCM_CARD = "hw:CARD=Dummy" # get names with `aplay -L`
-ALSA_PCM_NAME = "Master"        # find out with alsamixer -c ...
-
-# get limits with `amixer -c... sget "Master"`
-ALSA_MIN_VOL = -50
-ALSA_MAX_VOL = 100
+# (card, mixer element) - get names with `aplay -L` / `amixer -c...`; volume
+# ranges are read from ALSA
+ALSA_MIXERS = (
+        ("hw:CARD=Dummy", "Master"),
+        )
 
 VOL_CHANGE_DISCARD_TIME_WINDOW = 1
 VOL_CHANGE_MAX_AGE = 0.8
 
 # ---------------------
 
-def get_volume(mixer_element, buffer_event):
-    """Get volume from the alsa mixer, buffer/discard events."""
-    vol_perc = ((mixer_element.get_volume() - ALSA_MIN_VOL)
-            / (ALSA_MAX_VOL - ALSA_MIN_VOL) * 100)
-    print(f"buffer event {vol_perc}")
-    buffer_event.event(int(vol_perc))
-
-
-def cdsp_set_volume(vol, _direction, _incr, _redis):
-    """Set CamillaDSP volume via redis action.
+def cdsp_set_volume(vol, element, _redis, volsync):
+    """Set CamillaDSP volume via redis action - tagged with the 'alsa'
+    origin (see pymedia_volsync), and only if it's not the current volume.
 
-    _direction and _incr aren't used - those are passed by default by
-    pymedia_buffer_event.ProcessEvent.event()
-
-    only set CamillaDSP volume if CamillaDSP isn't muted to avoid "feedback
-    loop": when cdsp is muted the lms player is paused (see pymedia_cdsp);
-    however LMS and/or squeezelite set the mixer's volume to 0%, which trigger
-    alsa mixer events, setting cdsp volume to 0%. Then, on "un-mute",
-    LMS/squeezelite restores the mixer to its previous level, triggering another
-    set of alsa mixer events and messing again with cdsp's volume.
+    Not when CamillaDSP is muted: the lms player is then paused (see
+    pymedia_cdsp) and LMS and/or squeezelite set the mixer's volume to 0%
+    (and restore it on "un-mute") - those aren't user changes.
     """
-    if not _redis.get_s("CDSP:mute"):
-        print(f"set {vol}")
-        _redis.send_action('CDSP', f"volume_perc:{vol}")
+    if _redis.get_s("CDSP:mute") or volsync.is_current(vol):
+        return
+    print(f"{element}: set {int(vol)}")
+    _redis.send_action('CDSP', f"volume_perc:{int(vol)}:alsa")
 
 # ---------------------
 
@@ -57,15 +42,11 @@ if __name__ == '__main__':
 
     # logic:
     #
-    # pymedia_alsa.poll(): wait for a mixer event
-    #  -> on event, call get_volume()
-    #
-    # get_volume(): calculate the volume %
-    #  -> instead of immediately sending the volume change instructions, buffer
-    #     events with pymedia_buffer_event.ProcessEvent.event()
-    #
-    # pymedia_buffer_event.ProcessEvent.event()
-    #  -> calls cdsp_set_volume()
+    # pymedia_alsa.MixerWatcher.run(): wait for mixer events on all the
+    # ALSA_MIXERS elements (single poll() loop)
+    #  -> instead of immediately sending the volume change instructions,
+    #     coalesce bursts of events (see MixerWatcher)
+    #  -> calls cdsp_set_volume() with the volume %
     #
     # cdsp_set_volume()
     #  -> send volume change "action" via redis
@@ -78,13 +59,13 @@ if __name__ == '__main__':
     redis = pymedia_redis.RedisHelper(REDIS_SERVER, REDIS_PORT, REDIS_DB,
                                       'ALSA_VOL')
 
-    buffer_vol_event = pymedia_buffer_event.ProcessEvent(cdsp_set_volume,
-                                    VOL_CHANGE_DISCARD_TIME_WINDOW,
-                                    VOL_CHANGE_MAX_AGE,
-                                    cb_args=(redis,))
+    volume_sync = VolumeSync(redis, 'alsa')
+    watcher = pymedia_alsa.MixerWatcher(
+            [(card, name, cdsp_set_volume, (redis, volume_sync))
+             for card, name in ALSA_MIXERS],
+            VOL_CHANGE_DISCARD_TIME_WINDOW, VOL_CHANGE_MAX_AGE)
 
     try:
-        pymedia_alsa.poll(ALSA_PCM_CARD, ALSA_PCM_NAME, get_volume,
-                          threaded_callback=True, cb_args=(buffer_vol_event,))
+        watcher.run()
     except KeyboardInterrupt:
         print("Received KeyboardInterrupt, shutting down...")
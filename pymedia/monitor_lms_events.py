@@ -4,7 +4,6 @@
 # pylint: disable=missing-class-docstring
 # pylint: disable=missing-function-docstring
 
-import socket
 import re
 from urllib.parse import unquote
 
@@ -14,7 +13,10 @@ import time
 import pymedia_redis
 import pymedia_logger
 
-from pymedia_utils import SimpleThreads
+from pymedia_utils import SimpleThreads, sd_notify
+from pymedia_volsync import VolumeSync
+from pymedia_lms import LMS_STATS_NO_EVENT, LMS_STATS_UPDATED_KEY
+from pymedia_lms_cli import CliConnection
 
 from pymedia_const import REDIS_SERVER, REDIS_PORT, REDIS_DB
 
@@ -25,132 +27,200 @@ logger = pymedia_logger.get_logger(__name__)
 LMS_SERVER = "juke"
 LMS_SERVER_PORT = 9090
 LMS_PLAYERID = "13:89:0e:c8:1d:a5"
-LMS_SUBSCRIBE = "mixer,playlist,play,pause,stop"
+LMS_SUBSCRIBE = ("mixer,playlist,play,pause,stop,power,alarm,prefset,"
+                 "playerpref")
 
 LMS_PING_INTERVAL = 4    # MUST be less than LMS_SOCKET_TIMEOUT
-LMS_SOCKET_TIMEOUT = 10
-
-VOL_EVENT_KEYS = (
-        'ROTARY_ENCODER:last_volume_event',
-        )
-VOL_EVENT_MAX_AGE = 2
+LMS_SOCKET_TIMEOUT = 10  # no data received: reconnect
 
 # ---------------------
 
-def cdsp_set_volume(_redis, vol):
-    """Set CamillaDSP volume via redis action."""
-    # don't update player volume if volume was changed by other means
-    # within the last VOL_EVENT_MAX_AGE seconds
-    for key in VOL_EVENT_KEYS:
-        if _redis.check_timestamp(key, max_age=VOL_EVENT_MAX_AGE):
-            logger.debug("Ignoring vol change: %s < %ss", key, VOL_EVENT_MAX_AGE)
-            return
-
-    # Pass 'NO_PLAYER_VOL_UPDATE' to avoid potential "feedback loops";
-    # otherwise pymedia_cdsp would update LMS' volume when receiving a volume
-    # change action - if volumes aren't identical (eg. because of different
-    # implementations of volume change in LMS and pymedia_cdsp) then there would
-    # be an infinite back-and-forth.
+def cdsp_set_volume(_redis, volsync, vol):
+    """Set CamillaDSP volume via redis action.
+
+    Volume changes made by the player itself (ie. synced from CDSP - see
+    pymedia_volsync) are echoed by LMS: they're dropped. Other changes are
+    tagged with the 'lms' origin, so CDSP doesn't send them back to LMS.
+    """
+    relative = vol[0] in "+-"
+    if volsync.is_echo(None if relative else float(vol)):
+        logger.debug("Ignoring vol change to %s (echo)", vol)
+        return
     logger.info("Action - set CDSP volume to %s", vol)
-    _redis.send_action('CDSP', f"volume_perc:{vol}:NO_PLAYER_VOL_UPDATE")
+    _redis.send_action('CDSP', f"volume_perc:{vol}:lms")
+
+def player_stats_delta(player, delta):
+    """Apply a player stats delta (parsed from an LMS event) to the PLAYER
+    keys, and send a 'stats' event if a stat has changed - no LMS query.
+
+    player is a RedisHelper registered as PLAYER (like lms.py).
+    """
+    vol = delta.get('volume')
+    if isinstance(vol, str):
+        # 'mixer volume' events may be relative
+        delta['volume'] = min(max(round(
+            (player.get('volume') or 0) + float(vol) if vol[0] in "+-"
+            else float(vol)), 0), 100)
+    changed = {key: value for key, value in delta.items()
+               if player.get(key) != value}
+    if not changed:
+        return
+    logger.debug("Player stats changed: %s", changed)
+    # before the stats: a concurrent status query result doesn't overwrite
+    # them (see pymedia_lms.Lms._write_stats())
+    now = time.time()
+    player.redis.hset(LMS_STATS_UPDATED_KEY,
+                      mapping={key: now for key in changed})
+    player.update_stats(changed, any(key not in LMS_STATS_NO_EVENT
+                                     for key in changed))
 
 def player_update_action(_redis):
     """Send a redis action to trigger a player stats update."""
     _redis.send_action('PLAYER', "update")
 
+def player_alarms_action(_redis):
+    """Send a redis action to refresh the player alarms (cached)."""
+    _redis.send_action('PLAYER', "refresh_alarms")
+
 class LmsCliVol():
     def __init__(self, server, port, playerid,
                  cb_vol, cb_vol_args,
+                 cb_stats, cb_stats_args,
                  cb_default, cb_default_args,
+                 cb_alarms, cb_alarms_args,
                  ping_interval=LMS_PING_INTERVAL,
                  socket_timeout=LMS_SOCKET_TIMEOUT):
 
         self._log = pymedia_logger.get_logger(__class__.__name__)
         self.playerid = playerid
-        self._redis = _redis
+        self._prefix = f"{playerid} "
 
         self.cb_vol = cb_vol
         self.cb_vol_args = cb_vol_args
 
+        self.cb_stats = cb_stats
+        self.cb_stats_args = cb_stats_args
+
         self.cb_default = cb_default
         self.cb_default_args = cb_default_args
 
+        self.cb_alarms = cb_alarms
+        self.cb_alarms_args = cb_alarms_args
+
+        # sample (we use unquote() to convert %3A to ':'):
+        # 13%3A89%3A0e%3Ac8%3A1d%3Aa5 mixer volume 50
+        # 13%3A89%3A0e%3Ac8%3A1d%3Aa5 mixer volume -5
+        # ->
+        # 13:89:0e:c8:1d:a5 mixer volume 50
+        # 13:89:0e:c8:1d:a5 mixer volume -5
+        self._re_vol = re.compile("^" + re.escape(playerid)
+                                  + r" mixer volume ([+\-]?\d+(\.\d+)?)$")
+        # alarm added/changed/fired, alarm prefs (eg. alarmsEnabled) changed:
+        # 13:89:0e:c8:1d:a5 alarm update id:3b4c time:25200
+        # 13:89:0e:c8:1d:a5 playerpref alarmsEnabled 0
+        # 13:89:0e:c8:1d:a5 prefset server alarms ...
+        self._re_alarms = re.compile(
+                "^(" + re.escape(playerid) + " )?"
+                r"(alarm |(prefset \S+|playerpref) alarm)")
+        # player state (see parse_stats()):
+        # 13:89:0e:c8:1d:a5 playlist newsong So What 3
+        # 13:89:0e:c8:1d:a5 playlist pause 1
+        # 13:89:0e:c8:1d:a5 playlist stop
+        # 13:89:0e:c8:1d:a5 power 0
+        self._re_newsong = re.compile("^" + re.escape(playerid)
+                                      + r" playlist newsong (.*?)( \d+)?$")
+        self._re_playing = re.compile("^" + re.escape(playerid)
+                                      + r" (playlist )?(play|stop|pause)"
+                                      r"( [01])?$")
+        self._re_power = re.compile("^" + re.escape(playerid)
+                                    + r" power ([01])$")
+
         self.th_ev_stop = threading.Event()
 
+        # (re)connected with backoff - no need to wait for a systemd restart
+        # when LMS is restarted
+        self._cli = CliConnection(server, port, on_connect=self.subscribe,
+                                  timeout=socket_timeout)
+
         self.threads = SimpleThreads()
         self.threads.add_target(self.ping, ping_interval)
         self.threads.add_target(self.parse_rcv)
-        #self.threads.add_target(self.connect, server, port)
-
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._sock.settimeout(socket_timeout)
-
-        self._log.info("Connecting to %s:%s", server, port)
-        try:
-            self._sock.connect((server, port))
-        except Exception as ex:
-            self._log.error(ex)
-            self.cleanup()
-            raise SystemExit from ex
+        self.threads.start()
+        sd_notify()
 
+    def subscribe(self, cli):
+        """Subscribe to events (after each connection)."""
         self._log.info("Subscribing")
-        self._sock.send(f"subscribe {LMS_SUBSCRIBE}\r".encode("UTF-8"))
-
-        self.threads.start()
+        cli.send(f"subscribe {LMS_SUBSCRIBE}")
+        # events may have been missed while disconnected
+        self.cb_default(*self.cb_default_args)
 
     def ping(self, ping_interval):
         """Ping (query version) at regular intervals."""
         while not self.th_ev_stop.is_set():
             self._log.debug("ping")
-            self._sock.send("version ?\r".encode("UTF-8"))
+            self._cli.send("version ?")
             time.sleep(ping_interval)
 
+    def parse_stats(self, line):
+        """Return the player stats delta of an event line, or None if it
+        can't be derived from the event (-> full update)."""
+        match = self._re_newsong.match(line)
+        if match:
+            # artist/album aren't part of the event
+            return {'title': match.group(1), 'isplaying': True}
+        match = self._re_playing.match(line)
+        if match:
+            command, arg = match.group(2), match.group(3)
+            if command == "pause":
+                if arg is None:     # toggle
+                    return None
+                return {'isplaying': arg.strip() == "0"}
+            return {'isplaying': command == "play"}
+        match = self._re_power.match(line)
+        if match:
+            if match.group(1) == "1":
+                return {'power': True}
+            return {'power': False, 'isplaying': False}
+        return None
+
     def parse_rcv(self):
-        """Receive / parse events and trigger actions."""
+        """Receive events (lines) until cleanup() - blocking."""
+        for line in self._cli.lines():
+            self.parse_line(unquote(line))
 
-        # sample (we use unquote() to convert %3A to ':'):
-        # 13%3A89%3A0e%3Ac8%3A1d%3Aa5 mixer volume 50
-        # 13%3A89%3A0e%3Ac8%3A1d%3Aa5 mixer volume -5
-        # ->
-        # 13:89:0e:c8:1d:a5 mixer volume 50
-        # 13:89:0e:c8:1d:a5 mixer volume -5
-        re_vol = re.compile("^" + self.playerid
-                            + r" mixer volume ([+\-]?\d+(\.\d+)?)$")
+    def parse_line(self, line):
+        """Parse an event and trigger actions."""
+        self._log.debug("received '%s'", line)
 
-        while not self.th_ev_stop.is_set():
+        if line.startswith("subscribe") or line.startswith("version"):
+            return
 
-            try:
-                data = self._sock.recv(4096)
-            except Exception as ex:
-                self._log.error(ex)
-                self.cleanup()
-                raise SystemExit from ex
-
-            line = unquote(data.decode("UTF-8").strip())
-            self._log.debug("received '%s'", line)
-
-            if not line:
-                self._log.error("Empty line received - connection closed ?")
-                self.cleanup()
-                raise SystemExit
-
-            if line.startswith("subscribe") or line.startswith("version"):
-                continue
-
-            re_vol_match = re_vol.match(line)
-            if re_vol_match:
-                vol = re_vol_match.group(1)
-                self._log.info("Volume changed to %s for player %s", vol,
-                        LMS_PLAYERID)
-                self.cb_vol(*self.cb_vol_args, vol)
-            else:
+        re_vol_match = self._re_vol.match(line)
+        if re_vol_match:
+            vol = re_vol_match.group(1)
+            self._log.info("Volume changed to %s for player %s", vol,
+                    self.playerid)
+            self.cb_vol(*self.cb_vol_args, vol)
+            self.cb_stats(*self.cb_stats_args, {'volume': vol})
+        elif self._re_alarms.match(line):
+            self._log.info("Action - PLAYER:refresh_alarms (received '%s')",
+                           line)
+            self.cb_alarms(*self.cb_alarms_args)
+        elif not line.startswith(self._prefix):
+            self._log.debug("Ignoring event of another player")
+        else:
+            delta = self.parse_stats(line)
+            if delta:
+                self._log.info("Stats delta %s (received '%s')", delta, line)
+                self.cb_stats(*self.cb_stats_args, delta)
+            if delta is None or 'title' in delta:
                 self._log.info("Action - PLAYER:update (received '%s')", line)
                 self.cb_default(*self.cb_default_args)
 
     def cleanup(self):
         self.th_ev_stop.set()
-        time.sleep(2)
-        self._sock.close()
+        self._cli.close()
 
 
 
@@ -161,9 +231,16 @@ if __name__ == '__main__':
     _redis = pymedia_redis.RedisHelper(REDIS_SERVER, REDIS_PORT, REDIS_DB,
                                       'PLAYER_CHANNEL')
 
+    # player stats deltas are written to the PLAYER keys (like lms.py)
+    player = pymedia_redis.RedisHelper(REDIS_SERVER, REDIS_PORT, REDIS_DB,
+                                       'PLAYER')
+
     lms_cli_vol = LmsCliVol(LMS_SERVER, LMS_SERVER_PORT, LMS_PLAYERID,
-                            cdsp_set_volume, (_redis,),
-                            player_update_action, (_redis,)
+                            cdsp_set_volume,
+                            (_redis, VolumeSync(_redis, 'lms')),
+                            player_stats_delta, (player,),
+                            player_update_action, (_redis,),
+                            player_alarms_action, (_redis,)
                             )
 
     try:
@@ -0,0 +1,201 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+import pymedia_logger
+from pymedia_measure import deconvolve, read_wav, replace_filters
+from pymedia_utils import lazy_import
+
+np = lazy_import("numpy")
+
+logger = pymedia_logger.get_logger(__name__)
+
+# ---------------------
+
+ALIGN_CROSSOVER = 100           # Hz - default, if not found in the config
+ALIGN_BAND = (0.5, 2)           # crossover band, relative to the crossover
+ALIGN_BAND_POINTS = 32
+ALIGN_PRE = 0.02                # seconds kept before the earliest IR peak
+ALIGN_LENGTH = 0.5              # seconds of IR analysed
+ALIGN_REF_POSITION = 0.01       # seconds - reference IR peak position
+ALIGN_DELAY_STEP = 0.01         # ms - delay search resolution
+ALIGN_FILTER = "align_delay"    # name of the proposed Delay filter
+ALIGN_POLARITY_FILTER = "align_polarity"    # sub polarity inversion (Gain)
+
+# ---------------------
+
+def crossover_freq(config, default=ALIGN_CROSSOVER):
+    """Frequency of the first Linkwitz-Riley / Butterworth filter of config."""
+    for filt in (config.get('filters') or {}).values():
+        if filt['type'] == 'BiquadCombo' and 'freq' in filt.get(
+                'parameters', {}):
+            return filt['parameters']['freq']
+    return default
+
+def load_irs(paths, sweep=None, channel=0, ref_channel=None):
+    """Load impulse responses from wav files; return (list of IRs, rate).
+
+    Files are IRs, or recordings of sweep (deconvolved). With ref_channel (eg.
+    an electrical loopback of the sweep recorded with the mic), IRs are
+    shifted so that the reference IR peak is at ALIGN_REF_POSITION: sub and
+    mains recordings then share the same time reference even if playback /
+    recording latencies vary from one recording to the other.
+    """
+    irs = []
+    rate = None
+    for path in paths:
+        samples, file_rate = read_wav(path)
+        if rate not in (None, file_rate):
+            raise ValueError(f"{path}: sample rate {file_rate} != {rate}")
+        rate = file_rate
+        impulse = deconvolve(samples, sweep) if sweep is not None else samples
+        if ref_channel is not None:
+            shift = (int(ALIGN_REF_POSITION * rate)
+                     - int(np.argmax(np.abs(impulse[:, ref_channel]))))
+            impulse = np.roll(impulse, shift, axis=0)
+            if shift > 0:
+                impulse[:shift] = 0
+        irs.append(np.asarray(impulse[:, channel], dtype=np.float64))
+    return irs, rate
+
+def _stack_pairs(sub_irs, mains_irs, rate):
+    """(positions, samples) arrays of sub and mains IRs, cut with the same
+    start for both IRs of a position (relative timing is preserved)."""
+    length = int(ALIGN_LENGTH * rate)
+    pre = int(ALIGN_PRE * rate)
+    subs = np.zeros((len(sub_irs), length))
+    mains = np.zeros((len(sub_irs), length))
+    for index, (sub, main) in enumerate(zip(sub_irs, mains_irs)):
+        start = max(min(int(np.argmax(np.abs(sub))),
+                        int(np.argmax(np.abs(main)))) - pre, 0)
+        sub, main = sub[start:start + length], main[start:start + length]
+        subs[index, :len(sub)] = sub
+        mains[index, :len(main)] = main
+    return subs, mains
+
+def xcorr_lags(subs, mains, rate, crossover):
+    """Arrival time offsets (ms, > 0: sub arrives later) of each position.
+
+    Cross-correlation of the IRs weighted around the crossover (log gaussian,
+    1 octave), computed with FFTs for all positions at once; the lag is the
+    peak of the cross-correlation envelope (analytic signal), which isn't
+    fooled by the correlation oscillating at the crossover frequency.
+    """
+    size = 2 * subs.shape[1]
+    freqs = np.fft.rfftfreq(size, 1 / rate)
+    with np.errstate(divide='ignore'):
+        weight = np.exp(-0.5 * np.log2(freqs / crossover)**2)
+    cross = (np.fft.rfft(subs, size) * np.conj(np.fft.rfft(mains, size))
+             * weight)
+    # analytic signal: positive frequencies only
+    full = np.zeros((len(subs), size), dtype=complex)
+    full[:, :cross.shape[1]] = 2 * cross
+    envelope = np.abs(np.fft.ifft(full, axis=1))
+    peaks = np.argmax(envelope, axis=1)
+    # parabolic interpolation of the envelope peak
+    rows = np.arange(len(subs))
+    prev_v = envelope[rows, peaks - 1]
+    peak_v = envelope[rows, peaks]
+    next_v = envelope[rows, (peaks + 1) % size]
+    denom = prev_v - 2 * peak_v + next_v
+    frac = np.where(denom != 0, 0.5 * (prev_v - next_v) / np.where(
+        denom != 0, denom, 1), 0)
+    lags = np.where(peaks > size // 2, peaks - size, peaks) + frac
+    return 1000 * lags / rate
+
+def band_responses(subs, mains, rate, crossover):
+    """Complex responses (positions, freqs) around the crossover."""
+    freqs = np.geomspace(crossover * ALIGN_BAND[0], crossover * ALIGN_BAND[1],
+                         ALIGN_BAND_POINTS)
+    size = 1 << 18
+    bins = np.round(freqs * size / rate).astype(int)
+    return (freqs, np.fft.rfft(subs, size)[:, bins],
+            np.fft.rfft(mains, size)[:, bins])
+
+def summation(sub, main, freqs, delays, polarity=1):
+    """Summation efficiency |S + M| / (|S| + |M|) (1: perfectly coherent)
+    with the mains delayed by delays (ms, < 0: sub delayed).
+
+    sub/main are (positions, freqs) arrays; the result has shape
+    delays.shape + (positions,).
+    """
+    delays = np.asarray(delays, dtype=float)[..., np.newaxis, np.newaxis]
+    shifted = polarity * main * np.exp(-2j * np.pi * freqs * delays / 1000)
+    return (np.abs(sub + shifted).sum(axis=-1)
+            / (np.abs(sub) + np.abs(main)).sum(axis=-1))
+
+def align(sub_irs, mains_irs, rate, crossover=ALIGN_CROSSOVER):
+    """Analyze sub/mains IR pairs (one per measurement position) and propose
+    a delay (ms, > 0: delay the mains, < 0: delay the sub) and polarity.
+
+    The delay is searched within half a crossover period of the median
+    cross-correlation lag, maximizing the mean summation efficiency of all
+    positions in the crossover band - all (polarity, delay, position,
+    frequency) combinations are evaluated at once.
+    """
+    subs, mains = _stack_pairs(sub_irs, mains_irs, rate)
+    lags = xcorr_lags(subs, mains, rate, crossover)
+    freqs, sub, main = band_responses(subs, mains, rate, crossover)
+
+    half_period = 1000 / crossover / 2
+    delays = np.arange(-half_period, half_period + ALIGN_DELAY_STEP,
+                       ALIGN_DELAY_STEP) + np.median(lags)
+    scores = np.stack([summation(sub, main, freqs, delays, polarity)
+                       for polarity in (1, -1)])
+    mean_scores = scores.mean(axis=-1)
+    pol_index, delay_index = np.unravel_index(np.argmax(mean_scores),
+                                              mean_scores.shape)
+    delay = float(delays[delay_index])
+    polarity = (1, -1)[pol_index]
+
+    fc_index = np.argmin(np.abs(freqs - crossover))
+    phase_before = np.degrees(np.angle(sub[:, fc_index] / main[:, fc_index]))
+    aligned = polarity * main[:, fc_index] * np.exp(
+            -2j * np.pi * crossover * delay / 1000)
+    phase_after = np.degrees(np.angle(sub[:, fc_index] / aligned))
+    result = {
+            'crossover': crossover,
+            'delay': delay,
+            'polarity': polarity,
+            'lags': lags,
+            'phase_before': phase_before,
+            'phase_after': phase_after,
+            'efficiency_before': summation(sub, main, freqs, 0.0),
+            'efficiency_after': scores[pol_index, delay_index],
+            }
+    logger.debug("delay %.2fms, polarity %d, efficiency %.3f -> %.3f",
+                 delay, polarity, result['efficiency_before'].mean(),
+                 result['efficiency_after'].mean())
+    return result
+
+def delay_config(config, delay, mains_channels, sub_channels,
+                 name=ALIGN_FILTER, polarity=1,
+                 polarity_name=ALIGN_POLARITY_FILTER):
+    """Return a copy of config with a Delay filter (name) on the mains
+    (delay > 0) or sub (delay < 0) pipeline channels, and an inverted Gain
+    filter (polarity_name) on the sub channels if polarity < 0."""
+    channels = mains_channels if delay > 0 else sub_channels
+    all_channels = list(mains_channels) + list(sub_channels)
+    # remove previous delay/polarity filters from all channels first
+    config = replace_filters(config, name, all_channels, {})
+    config = replace_filters(config, polarity_name, all_channels, {})
+    config = replace_filters(config, name, channels, {
+        name: {
+            'type': 'Delay',
+            'parameters': {
+                'delay': round(abs(delay), 3),
+                'unit': 'ms',
+                },
+            },
+        })
+    if polarity < 0:
+        config = replace_filters(config, polarity_name, sub_channels, {
+            polarity_name: {
+                'type': 'Gain',
+                'parameters': {
+                    'gain': 0,
+                    'inverted': True,
+                    },
+                },
+            })
+    return config
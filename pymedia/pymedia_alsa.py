@@ -3,11 +3,18 @@
 # pylint: disable=missing-function-docstring
 
 import select
-import threading
+import time
 from pyalsa import alsamixer
 import pymedia_logger
+from pymedia_utils import sd_notify
 
-logger = pymedia_logger.get_logger(__name__)
+# ---------------------
+
+MIXER_DISCARD_TIME_WINDOW = 0.1     # seconds - see MixerWatcher
+MIXER_MAX_AGE = 0.15                # seconds
+MIXER_STATS_INTERVAL = 300          # seconds - log event rates
+
+# ---------------------
 
 # https://www.alsa-project.org/alsa-doc/alsa-lib/
 
@@ -17,26 +24,122 @@ logger = pymedia_logger.get_logger(__name__)
 # amixer -c1 sset "Master" 80
 # ...
 
-def poll(pcm, pcm_name, callback, threaded_callback=False, cb_args=()):
+class MixerElement():
+    """A watched mixer element; the volume range (raw and dB) is read from
+    ALSA."""
+    def __init__(self, mixer, card, name, callback, cb_args=()):
+        self.card = card
+        self.name = name
+        self.element = alsamixer.Element(mixer, name)
+        self.callback = callback
+        self.cb_args = cb_args
+        self.vol_min, self.vol_max = self.element.get_volume_range()
+        try:
+            # 1/100 dB
+            self.db_min = self.element.ask_vol_dB(self.vol_min) / 100
+            self.db_max = self.element.ask_vol_dB(self.vol_max) / 100
+        except (AttributeError, RuntimeError):
+            self.db_min = self.db_max = None
+        self.volume = self.element.get_volume()
+        # coalescing: time of the last callback, deadline of a pending one
+        self.last_callback = 0
+        self.pending = None
+        self.events = 0
+        self.callbacks = 0
+
+    def __str__(self):
+        return f"{self.card}/{self.name}"
+
+    def percent(self):
+        if self.vol_max == self.vol_min:
+            return 0
+        return ((self.volume - self.vol_min)
+                / (self.vol_max - self.vol_min) * 100)
+
+
+class MixerWatcher():
+    """Watch any number of mixer elements, on any number of cards, in a
+    single poll() loop - no thread per event.
+
+    watches: (card, element name, callback, cb_args) tuples; callback is run
+    with (volume %, MixerElement, *cb_args) when the element volume changes.
+
+    Bursts are coalesced per element: the callback runs right away if its
+    previous run is older than max_age, otherwise once no new event has
+    arrived for discard_time_window (the poll() timeout) - the latest volume
+    is sent, so nothing is lost. Event/callback rates are logged every
+    MIXER_STATS_INTERVAL seconds.
+    """
+    def __init__(self, watches, discard_time_window=MIXER_DISCARD_TIME_WINDOW,
+                 max_age=MIXER_MAX_AGE):
+        self._log = pymedia_logger.get_logger(__class__.__name__)
+        self._discard_time_window = discard_time_window
+        self._max_age = max_age
+        self._poller = select.poll()
+        self._mixers = {}
+        self.elements = []
+        for card, name, callback, cb_args in watches:
+            if card not in self._mixers:
+                mixer = alsamixer.Mixer()
+                mixer.attach(card)
+                mixer.load()
+                mixer.register_poll(self._poller)
+                self._mixers[card] = mixer
+            element = MixerElement(self._mixers[card], card, name, callback,
+                                   cb_args)
+            self._log.info("watching %s - range %d..%d (%s..%sdB)", element,
+                           element.vol_min, element.vol_max, element.db_min,
+                           element.db_max)
+            self.elements.append(element)
+
+    def _run_callback(self, element, now):
+        element.pending = None
+        element.last_callback = now
+        element.callbacks += 1
+        element.callback(element.percent(), element, *element.cb_args)
+
+    def _log_stats(self, elapsed):
+        for element in self.elements:
+            self._log.info("%s: %d events (%.2f/s), %d callbacks", element,
+                           element.events, element.events / elapsed,
+                           element.callbacks)
+            element.events = element.callbacks = 0
 
-    mixer = alsamixer.Mixer()
-    mixer.attach(pcm)
-    mixer.load()
+    def run(self):
+        """Loop - wait for mixer events, run callbacks.
 
-    alsa = alsamixer.Element(mixer, pcm_name)
+        Blocking.
+        """
+        for mixer in self._mixers.values():
+            mixer.handle_events()
+        sd_notify()
+        stats_start = time.monotonic()
 
-    mixer.handle_events()
+        while True:
+            pending = [element.pending for element in self.elements
+                       if element.pending is not None]
+            timeout = None
+            if pending:
+                timeout = max(min(pending) - time.monotonic(), 0) * 1000
+            if self._poller.poll(timeout):
+                for mixer in self._mixers.values():
+                    mixer.handle_events()
 
-    poller = select.poll()
-    mixer.register_poll(poller)
+            now = time.monotonic()
+            for element in self.elements:
+                volume = element.element.get_volume()
+                if volume != element.volume:
+                    element.volume = volume
+                    element.events += 1
+                    self._log.debug("%s: volume %d", element, volume)
+                    if now - element.last_callback > self._max_age:
+                        self._run_callback(element, now)
+                    else:
+                        # (re)start the discard time window
+                        element.pending = now + self._discard_time_window
+                elif element.pending is not None and now >= element.pending:
+                    self._run_callback(element, now)
 
-    while True:
-        poller.poll()
-        mixer.handle_events()
-        logger.debug("Event")
-        if threaded_callback:
-            thread = threading.Thread(target=callback, args=(alsa, *cb_args))
-            thread.daemon = True
-            thread.start()
-        else:
-            callback(alsa, *cb_args)
+            if now - stats_start >= MIXER_STATS_INTERVAL:
+                self._log_stats(now - stats_start)
+                stats_start = now
@@ -2,64 +2,140 @@
 # pylint: disable=missing-class-docstring
 # pylint: disable=missing-function-docstring
 
+import heapq
+import itertools
+import threading
 import time
 import pymedia_logger
 
+# ---------------------
+
+class Scheduler():
+    """Run functions at given (monotonic) times from a single thread.
+
+    Timers are kept in a heap; the thread sleeps until the earliest one (or
+    until a new earlier one is added) - there's no polling. Functions should
+    be short: they're run one after the other.
+    """
+    def __init__(self):
+        self._log = pymedia_logger.get_logger(__class__.__name__)
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def call_at(self, when, func, *args):
+        """Schedule func(*args) at when; return a handle for cancel()."""
+        entry = [when, next(self._counter), func, args]
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._cond.notify()
+        return entry
+
+    def call_later(self, delay, func, *args):
+        """Schedule func(*args) in delay seconds."""
+        return self.call_at(time.monotonic() + delay, func, *args)
+
+    def cancel(self, entry):
+        """Cancel a scheduled call (no-op if it has already run)."""
+        with self._cond:
+            entry[2] = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    while self._heap and self._heap[0][2] is None:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    remaining = self._heap[0][0] - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                _, _, func, args = heapq.heappop(self._heap)
+            try:
+                func(*args)
+            except Exception as ex:     # pylint: disable=broad-except
+                self._log.exception("%s: %s", func, ex)
+
+
+# shared by ProcessEvent instances, GPIO held timers, ...
+SCHEDULER = Scheduler()
+
+
 class ProcessEvent():
     def __init__(self, callback, discard_time_window=0.1, max_age=0.15,
-                 cb_args=()):
+                 cb_args=(), max_wait=None, leading=True, scheduler=None):
+        """Debounce/throttle events (like volume changes).
+
+        We're trying to avoid flooding the "receiver" (eg. camilladsp with
+        volume change requests and/or the display with many refreshes) while
+        still providing adequate feedback to the user; so:
+        - leading edge: run callback right away if the previous callback is
+          older than max_age (and leading is True)
+        - trailing edge: otherwise, run callback once no new event has arrived
+          for discard_time_window seconds
+        - max wait: during a continuous burst, run callback at least every
+          max_wait seconds (None: no limit)
+        -> events are coalesced, but callback receives the latest value and
+        the net increment since its previous run, so we don't loose data.
+
+        callback is run as callback(value, direction, incr, *cb_args) from
+        the scheduler thread (shared by all instances by default).
+        """
         self._log = pymedia_logger.get_logger(__class__.__name__)
         self._discard_time_window = discard_time_window
         self._max_age = max_age
-        self._cur_event_id = 0
-        self._last_event_time = 0
-        self._last_event_value = None
+        self._max_wait = max_wait
+        self._leading = leading
+        self._scheduler = scheduler or SCHEDULER
         self._callback = callback
         self._callback_args = cb_args
+        self._lock = threading.Lock()
+        self._value = None
+        self._direction = 0
+        self._last_event_time = 0
+        self._last_event_value = None
+        self._burst_start = None
+        self._timer = None
 
     def event(self, value, direction=0):
-        """Process an event (like setting the volume).
-
-        We're trying to avoid flooding the "receiver" (eg. camilladsp with
-        volume change requests and/or the display with many refreshes) while
-        still providing adequate feedback to the user; so:
-        - run callback if the previous event is older than self._max_age
-        - otherwise, wait for self._discard_time_window seconds then
-          run callback if no new event has arrived meanwhile
-        -> this means we may discard events, but we send the relative value, not
-        just +1/-1 increments, so we don't loose data.
-
-        Note: blocking (time.sleep()) so should be executed as a thread
-        """
-        self._cur_event_id += 1
-        event_id = self._cur_event_id
-        run_callback = False
-        if time.time() - self._last_event_time > self._max_age:
-            self._log.debug("thread id # %s: last event time was more than"
-                          " %fs ago - running",
-                          event_id, self._max_age)
-            run_callback = True
-        else:
-            self._log.debug("thread id # %s: an event happened less than %fs"
-                          " ago - waiting %fs to proceed", event_id,
-                          self._max_age,
-                          self._discard_time_window)
-            time.sleep(self._discard_time_window)
-            if event_id == self._cur_event_id:
-                self._log.debug("thread id # %s: no new event - running",
-                              event_id)
-                run_callback = True
+        """Process an event - thread safe and non-blocking."""
+        with self._lock:
+            now = time.monotonic()
+            self._value = value
+            self._direction = direction
+            if self._timer is not None:
+                self._scheduler.cancel(self._timer)
+            if (self._leading and self._burst_start is None
+                    and now - self._last_event_time > self._max_age):
+                self._log.debug("last callback was more than %fs ago -"
+                                " running", self._max_age)
+                when = now
             else:
-                self._log.debug("thread id # %s: event id %s took over",
-                              event_id, self._cur_event_id)
-
-        if run_callback:
+                if self._burst_start is None:
+                    self._burst_start = now
+                when = now + self._discard_time_window
+                if self._max_wait is not None:
+                    when = min(when, self._burst_start + self._max_wait)
+            self._timer = self._scheduler.call_at(when, self._run_callback)
 
-            if self._last_event_value:
+    def _run_callback(self):
+        with self._lock:
+            value, direction = self._value, self._direction
+            if self._last_event_value is not None:
                 incr = value - self._last_event_value
             else:
                 incr = direction
-
-            self._callback(value, direction, incr, *self._callback_args)
             self._last_event_value = value
-            self._last_event_time = time.time()
+            self._last_event_time = time.monotonic()
+            self._burst_start = None
+            self._timer = None
+        self._callback(value, direction, incr, *self._callback_args)
@@ -2,18 +2,132 @@
 # pylint: disable=missing-class-docstring
 # pylint: disable=missing-function-docstring
 
+import math
 import os
+import threading
 import time
 
-from camilladsp import CamillaConnection, CamillaError, ProcessingState
-
+import pymedia_freqresp
 import pymedia_logger
-from pymedia_utils import SimpleThreads
+from pymedia_utils import SimpleThreads, lazy_import
+from pymedia_volsync import VolumeSync, parse_origin
+
+camilladsp = lazy_import("camilladsp")
+# only for automatic config selection / loudness normalization (require
+# alsaaudio)
+pymedia_source = lazy_import("pymedia_source")
+pymedia_pcm = lazy_import("pymedia_pcm")
+pymedia_meter = lazy_import("pymedia_meter")
 
 logger = pymedia_logger.get_logger(__name__)
 
 # ---------------------
 
+STANDBY_THRESHOLD = -70         # dBFS - capture RMS level considered silence
+STANDBY_HYSTERESIS = 3          # dB above the threshold to wake up
+STANDBY_TIMEOUT = 600           # seconds of silence before standby
+STANDBY_METER_INTERVAL = 1      # seconds - capture level polling
+STANDBY_UPDATE_INTERVAL = 30    # seconds - stats update interval in standby
+LOUDNESS_TRIM_FILTER = "loudness_trim"  # Gain filter (see the configs)
+LOUDNESS_TRIM_RANGE = (-12, 6)  # dB
+LOUDNESS_PEAK_MARGIN = 1        # dB - kept below 0dBFS by a positive trim
+                                # (sample peak: margin for inter-sample peaks)
+LOUDNESS_TRIM_INTERVAL = 5      # seconds - trim update interval
+LOUDNESS_TRIM_TIME = 30         # seconds - loudness averaging time constant
+LOUDNESS_TRIM_STEP = 0.5        # dB - smaller trim changes aren't applied
+LOUDNESS_TRIM_MAX_STEP = 1      # dB - max trim change per interval
+LOUDNESS_GATE = -50             # LUFS - short-term loudness below is ignored
+LOUDNESS_CHECK_INTERVAL = 1     # seconds - check cdsp status/capture
+RATE_LOAD_DELAY = 10            # seconds - processing load measured after a
+                                # capture rate change ...
+RATE_LOAD_WINDOW = 10           # seconds - ... over this window
+CDSP_PROCESS_NAME = "camilladsp"
+
+# ---------------------
+
+class SilenceDetector():
+    """Track signal levels over time.
+
+    process() returns 'standby' once all levels have been below threshold
+    for timeout seconds, and 'wake' as soon as a level is back above
+    threshold + hysteresis; None otherwise.
+    """
+    def __init__(self, threshold=STANDBY_THRESHOLD, timeout=STANDBY_TIMEOUT,
+                 hysteresis=STANDBY_HYSTERESIS):
+        self._threshold = threshold
+        self._timeout = timeout
+        self._hysteresis = hysteresis
+        self.standby = False
+        self._last_signal = time.monotonic()
+
+    def reset(self, now=None):
+        """Leave standby (without 'wake') and re-arm the silence timeout."""
+        self.standby = False
+        self._last_signal = time.monotonic() if now is None else now
+
+    def process(self, levels, now=None):
+        if now is None:
+            now = time.monotonic()
+        level = max(levels, default=float('-inf'))
+        if self.standby:
+            if level >= self._threshold + self._hysteresis:
+                self.reset(now)
+                return 'wake'
+            return None
+        if level >= self._threshold:
+            self._last_signal = now
+        elif now - self._last_signal >= self._timeout:
+            self.standby = True
+            return 'standby'
+        return None
+
+
+class ProcessLoad():
+    """CPU load of a process (by name), from its /proc/PID/stat CPU time."""
+    def __init__(self, name=CDSP_PROCESS_NAME):
+        self._name = name
+        self._pid = None
+        self._ticks = os.sysconf('SC_CLK_TCK')
+
+    def _find_pid(self):
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/comm", encoding="utf-8") as comm:
+                    if comm.read().strip() == self._name:
+                        return int(entry)
+            except OSError:
+                pass
+        return None
+
+    def sample(self):
+        """Return (pid, time, cpu time) - None if the process isn't running."""
+        for _ in range(2):
+            if self._pid is None:
+                self._pid = self._find_pid()
+                if self._pid is None:
+                    return None
+            try:
+                with open(f"/proc/{self._pid}/stat", encoding="utf-8") as stat:
+                    fields = stat.read().rsplit(')', 1)[1].split()
+            except OSError:
+                # restarted
+                self._pid = None
+                continue
+            # utime and stime (fields 14 and 15)
+            return (self._pid, time.monotonic(),
+                    (int(fields[11]) + int(fields[12])) / self._ticks)
+        return None
+
+    @staticmethod
+    def load(start, end):
+        """CPU load (%) between two samples, None if unknown."""
+        if not start or not end or start[0] != end[0] or end[1] <= start[1]:
+            return None
+        return round(100 * (end[2] - start[2]) / (end[1] - start[1]), 1)
+
+
 class CDsp():
     """ Helper class to manage a CamillaDSP instance.
 
@@ -27,6 +141,11 @@ class CDsp():
         'volume_step': 1,
         # the following are optional
         'update_interval': 4,
+        # standby after standby_timeout seconds of silence (capture RMS below
+        # standby_threshold dBFS): mute, slow down updates; wake-up (unmute)
+        # when the signal is back
+        'standby_timeout': 600,
+        'standby_threshold': -70,
         'config_path': os.environ.get('HOME') + "/camilladsp/configs",
         'config_mute_on_change': True,
         'configs': (
@@ -37,6 +156,19 @@ class CDsp():
                 True,
                 False,
                 ),
+        # loudness normalization: measure the capture loudness (LUFS) and
+        # trim the gain slowly (LOUDNESS_TRIM_FILTER filter) towards target
+        'loudness_target': -18,
+        # load a variant of the active config capturing at the rate the
+        # player opened the loopback with (see check_rate())
+        'capture_rate_variants': True,
+        # automatic config selection: switch to the config of a loopback
+        # source that starts playing, unless the current config's source is
+        # playing with a higher priority (None: not monitored)
+        'configs_source_priority': (
+                2,
+                1,
+                ),
         }
     """
 
@@ -45,16 +177,41 @@ class CDsp():
         self._cfg = cfg
         self._redis = _redis
         self._setting_volume = False
+        self._volsync = VolumeSync(_redis, 'cdsp') if _redis else None
         self._switching_config = False
         self._cdsp = None
         self._config_index = 0
+        self._config_path = None
         self._stats = {}
+        self._silence = SilenceDetector(
+                self._cfg.get('standby_threshold', STANDBY_THRESHOLD),
+                self._cfg.get('standby_timeout'))
+        self._standby_muted = False
+        # capture rate variants of the configs (path, rate) -> config
+        self._rate_variants = {}
+        self._capture_rate_changed = False
+        self._cdsp_load = ProcessLoad()
+        self._load_sample = None    # taken on each update (see check_rate())
+        self._loudness_trim = 0.0
+        self._loudness_power = None
+        # serialize the config writes (config switch, rate variant, loudness
+        # trim): each one is based on the active config
+        self._config_lock = threading.Lock()
 
         self._check_cfg()
         self.threads = SimpleThreads()
         self.threads.add_target(self.connect_loop)
         if self._cfg.get('update_interval'):
             self.threads.add_target(self.update_loop)
+        if self._cfg.get('standby_timeout'):
+            self.threads.add_target(self.standby_loop)
+        if self._cfg.get('loudness_target') is not None:
+            self.threads.add_target(self.loudness_loop)
+        self._sources = None
+        if self._cfg.get('configs_source_priority'):
+            self._sources = self._source_detector()
+            for source in self._sources.sources:
+                self.threads.add_target(self._sources.source_loop, source)
         if self._redis:
             self.threads.add_thread(self._redis.t_wait_action(self.action))
 
@@ -79,7 +236,7 @@ class CDsp():
 
         Blocking, executed from within a thread (self.t_connect_loop)
         """
-        self._cdsp = CamillaConnection(self._cfg['server'],
+        self._cdsp = camilladsp.CamillaConnection(self._cfg['server'],
                                        self._cfg['port'])
         connect_attempts = 0
         connected = False
@@ -87,7 +244,8 @@ class CDsp():
             if not self._cdsp.is_connected():
                 try:
                     self._cdsp.connect()
-                except (ConnectionRefusedError, CamillaError, IOError) as ex:
+                except (ConnectionRefusedError, camilladsp.CamillaError,
+                        IOError) as ex:
                     # log (debug) every time, but log (info) once
                     self._log.debug("Couldn't connect to CamillaDSP: %s", ex)
                     if connect_attempts == 0:
@@ -95,6 +253,9 @@ class CDsp():
                     connect_attempts += 1
                     if self._redis:
                         self._redis.set("is_on", False)
+                        if connected:
+                            # let consumers (eg. status leds) know right away
+                            self._redis.publish_event("stats")
                         # turn off player if we're not connected
                         if (self._redis.check_alive('PLAYER')
                             and self._redis.get_s("PLAYER:power")
@@ -125,10 +286,12 @@ class CDsp():
         """
         try:
             if (self._cdsp and self._cdsp.is_connected()
-                and self._cdsp_wp("get_state") in [ ProcessingState.RUNNING,
-                                             ProcessingState.PAUSED ]):
+                and self._cdsp_wp("get_state") in [
+                    camilladsp.ProcessingState.RUNNING,
+                    camilladsp.ProcessingState.PAUSED ]):
                 return True
-        except (ConnectionRefusedError, CamillaError, IOError) as ex:
+        except (ConnectionRefusedError, camilladsp.CamillaError,
+                IOError) as ex:
             self._log.warning("Exception: %s", ex)
 
         return False
@@ -143,15 +306,23 @@ class CDsp():
         if not self.is_on():
             return
 
+        # user activity: leave standby - mute actions apply to the standby
+        # mute themselves (eg. toggle_mute unmutes)
+        self.leave_standby(unmute=action not in ("toggle_mute", "mute",
+                                                 "unmute"))
+
+        # optional origin of volume changes (see pymedia_volsync):
         # 'volume_incr:4'
-        # 'volume_incr:-2'
+        # 'volume_incr:-2:encoder'
         if action.startswith("volume_incr:"):
+            a_split = action.split(':')
             func_action = self.set_volume_incr
-            func_action_args = (float(action.split(':')[1]),)
+            func_action_args = (float(a_split[1]),
+                                parse_origin((a_split + [None])[2]))
 
         # 'volume_perc:50'
         # 'volume_perc:+4'
-        # 'volume_perc:-4:NO_PLAYER_VOL_UPDATE'
+        # 'volume_perc:-4:lms'
         elif action.startswith("volume_perc:"):
             a_split = action.split(':')
             s_val = a_split[1]
@@ -159,13 +330,8 @@ class CDsp():
                 func_action = self.set_volume_percent_incr
             else:
                 func_action = self.set_volume_percent
-            player_vol_update = True
-            try:
-                if a_split[2] == "NO_PLAYER_VOL_UPDATE":
-                    player_vol_update = False
-            except IndexError:
-                pass
-            func_action_args = (float(s_val), player_vol_update)
+            func_action_args = (float(s_val),
+                                parse_origin((a_split + [None])[2]))
 
         else:
             func_action, func_action_args = {
@@ -176,6 +342,8 @@ class CDsp():
 
                     "unmute": [self.mute, ("unmute",)],
 
+                    "warm_up": [self.warm_up, ()],
+
                     "first_config": [self.load_config, (0,)],
 
                     "next_config": [self.load_next_config, ()],
@@ -191,11 +359,13 @@ class CDsp():
         func_action(*func_action_args)
 
 
-    def mute(self, mode="toggle"):
+    def mute(self, mode="toggle", control_player=True, publish=True):
         """Mute/unmute/toggle mute.
 
         Also publish status in redis, wake-up sub on unmute, and publish an
-        event to notify consumers (eg. display.py).
+        event to notify consumers (eg. display.py). With control_player=False
+        the player isn't paused/unpaused; with publish=False no event is
+        published (the status is still set).
         """
         set_mute = True
         if mode == "toggle":
@@ -204,7 +374,7 @@ class CDsp():
         elif mode == "mute":
             pass
         elif mode == "unmute":
-            set_mute = True
+            set_mute = False
         else:
             self._log.warning("mode '%s' isn't defined", mode)
             return
@@ -213,8 +383,11 @@ class CDsp():
             self._cdsp_wp("set_mute", True)
             if self._redis:
                 self._redis.set("mute", True)
-                self._redis.send_action('PLAYER', "pause")
-                self._redis.publish_event("mute")
+                self._redis.send_action('LFE_TONE', "stop")
+                if control_player:
+                    self._redis.send_action('PLAYER', "pause")
+                if publish:
+                    self._redis.publish_event("mute")
         else:
             self._cdsp_wp("set_mute", False)
 
@@ -224,7 +397,7 @@ class CDsp():
             # wake up subwoofer
             self._redis.send_action('LFE_TONE', "play_skip_tests")
 
-            if self._cfg.get('configs_control_player'):
+            if control_player and self._cfg.get('configs_control_player'):
                 try:
                     if self._cfg['configs_control_player'][self._config_index]:
                         self._redis.send_action('PLAYER', "unpause")
@@ -234,7 +407,24 @@ class CDsp():
                                     self._config_index)
 
             self._redis.set("mute", False)
-            self._redis.publish_event("mute")
+            if publish:
+                self._redis.publish_event("mute")
+
+    def warm_up(self):
+        """Get ready to play before the player starts (eg. LMS alarm).
+
+        Load the first config controlling the player and unmute - which also
+        wakes up the sub - without unpausing the player.
+        """
+        index = 0
+        for i, control_player in enumerate(
+                self._cfg.get('configs_control_player') or ()):
+            if control_player:
+                index = i
+                break
+        if self._cfg.get('configs'):
+            self.load_config(index)
+        self.mute(mode="unmute", control_player=False)
 
     def db_vol_to_perc_vol(self, vol_db):
         """Convert CamillaDSP volume in dB to [0-100]."""
@@ -247,26 +437,30 @@ class CDsp():
                 * vol_perc / 100
                 + self._cfg['volume_min'] )
 
-    def set_volume_incr(self, vol_incr, player_vol_update=True):
+    def set_volume_incr(self, vol_incr, origin=None):
         """Increment volume."""
         self.set_volume_db(self._cdsp_wp("get_volume")
                            + round(vol_incr * self._cfg['volume_step']),
-                           player_vol_update)
+                           origin)
 
-    def set_volume_percent_incr(self, vol_perc_incr, player_vol_update=True):
+    def set_volume_percent_incr(self, vol_perc_incr, origin=None):
         """Increment volume as a percentage of the volume range."""
         vol_db_incr = vol_perc_incr / 100 * (self._cfg['volume_max'] -
                                                self._cfg['volume_min'])
         self._log.debug("Conversion %s%% = %sdB", vol_perc_incr, vol_db_incr)
-        self.set_volume_incr(vol_db_incr, player_vol_update)
+        self.set_volume_incr(vol_db_incr, origin)
 
-    def set_volume_percent(self, vol_perc, player_vol_update=True):
+    def set_volume_percent(self, vol_perc, origin=None):
         """Set volume as a percentage of the volume range."""
         vol_db = self.perc_vol_to_db_vol(vol_perc)
-        self.set_volume_db(vol_db, player_vol_update)
+        self.set_volume_db(vol_db, origin)
+
+    def set_volume_db(self, vol, origin=None):
+        """Set volume as a (CamillaDSP) dB value.
 
-    def set_volume_db(self, vol, player_vol_update=True):
-        """Set volume as a (CamillaDSP) dB value."""
+        The change is published with a new version and its origin (see
+        pymedia_volsync), and forwarded to the player unless it's the origin.
+        """
         # set vol to max/min if it's greater/lower than max/min
         if not (self._cfg['volume_min'] <= vol
                 <= self._cfg['volume_max']):
@@ -295,13 +489,14 @@ class CDsp():
 
         if self._redis:
             self._redis.set("volume", vol_i)
+            vol_perc = round(self.db_vol_to_perc_vol(vol_i), 2)
+            version = self._volsync.publish(vol_perc, origin or 'cdsp')
             # set/sync player volume
-            if player_vol_update and self._cfg.get('configs_control_player'):
-                vol_perc = round(self.db_vol_to_perc_vol(vol), 2)
+            if origin != 'lms' and self._cfg.get('configs_control_player'):
                 try:
                     if self._cfg['configs_control_player'][self._config_index]:
-                        self._redis.send_action('PLAYER',
-                                                f"volume_perc:{vol_perc}")
+                        self._redis.send_action(
+                                'PLAYER', f"volume_perc:{vol_perc}:v{version}")
                 except IndexError:
                     self._log.error("No configs_control_player index"
                                     "defined at index %d",
@@ -353,10 +548,11 @@ class CDsp():
                 config = self._cdsp.read_config_file(config_path)
                 self._cdsp.validate_config(config)
                 self._log.info("Loading config file in CamillaDSP")
-                self._cdsp.set_config(config)
-                self._cdsp.set_config_name(config_path)
-                cur_config_path = self._cdsp.get_config_name()
-            except CamillaError as ex:
+                with self._config_lock:
+                    self._cdsp.set_config(config)
+                    self._cdsp.set_config_name(config_path)
+                    cur_config_path = self._cdsp.get_config_name()
+            except camilladsp.CamillaError as ex:
                 self._log.error("Can't load config into CamillaDSP: %s", ex)
             else:
                 self._log.info("Current config is index %d, path '%s'",
@@ -378,7 +574,7 @@ class CDsp():
         except ConnectionRefusedError as ex:
             self._log.error(("Can't connect to CamillaDSP, is it running?"
                 " Error: %s") , ex)
-        except CamillaError as ex:
+        except camilladsp.CamillaError as ex:
             self._log.error("CamillaDSP replied with error: %s", ex)
         except IOError as ex:
             self._log.error("Websocket is not connected: %s", ex)
@@ -390,9 +586,113 @@ class CDsp():
         Blocking, executed from within a thread (self._t_update_loop)
         """
         while True:
-            time.sleep(self._cfg['update_interval'])
+            interval = self._cfg['update_interval']
+            if self._silence.standby:
+                interval = max(interval, STANDBY_UPDATE_INTERVAL)
+            time.sleep(interval)
             self.update()
 
+    def standby_loop(self):
+        """Loop - poll the capture RMS levels every STANDBY_METER_INTERVAL
+        seconds: enter standby after cfg['standby_timeout'] seconds of silence,
+        and wake up as soon as the signal is back.
+
+        Blocking, executed from within a thread.
+        """
+        while True:
+            time.sleep(STANDBY_METER_INTERVAL)
+            if not self.is_on():
+                self._silence.reset()
+                continue
+            levels = self._cdsp_wp("get_capture_signal_rms")
+            if levels is None:
+                continue
+            if self._silence.standby and self._redis:
+                # updates are slowed down: keep CDSP:last_alive fresh
+                self._redis.set_alive(wait_set=False)
+            state = self._silence.process(levels)
+            if state == 'standby':
+                self.enter_standby()
+            elif state == 'wake':
+                self.wake_from_standby()
+
+    def _source_detector(self):
+        """Create the loopback source detector - see pymedia_source."""
+        sources = []
+        for index, priority in enumerate(self._cfg['configs_source_priority']):
+            if priority is None:
+                continue
+            path = (self._cfg.get('config_path') + "/"
+                    + self._cfg['configs'][index])
+            try:
+                capture = pymedia_freqresp.capture_params(
+                        pymedia_freqresp.read_config(path))
+                sources.append(pymedia_source.Source(index, priority, capture))
+            except (OSError, KeyError, AttributeError) as ex:
+                self._log.error("Can't monitor the source of '%s': %s", path,
+                                ex)
+        return pymedia_source.SourceDetector(sources, self.source_active)
+
+    def source_active(self, source):
+        """Switch to the config of a source that has started playing, unless
+        the source of the current config is active with a higher priority."""
+        if source.index == self._config_index or not self.is_on():
+            return
+        current = self._sources.get(self._config_index)
+        if current and current.active and current.priority >= source.priority:
+            self._log.info("Source of config %d is active but config %d has"
+                           " priority", source.index, self._config_index)
+            return
+        self._log.info("Source of config %d is active - switching",
+                       source.index)
+        standby_muted = self._standby_muted
+        self.leave_standby(unmute=False)
+        was_muted = self._cdsp_wp("get_mute") and not standby_muted
+        self.load_config(source.index)
+        if not was_muted:
+            self.mute(mode="unmute", control_player=False)
+
+    def enter_standby(self):
+        """Mute (if not already muted) and notify consumers: the LFE tone
+        keepalives stop, the display is blanked, players poll less often."""
+        self._log.info("No signal for %ss - standby",
+                       self._cfg['standby_timeout'])
+        if not self._cdsp_wp("get_mute"):
+            # no mute event: it's a display wake event - the standby event
+            # notifies consumers
+            self.mute(mode="mute", control_player=False, publish=False)
+            self._standby_muted = True
+        self._set_standby(True)
+
+    def wake_from_standby(self):
+        """Unmute if muted by enter_standby() and notify consumers."""
+        self._log.info("Signal detected - waking up")
+        if self._standby_muted:
+            self._standby_muted = False
+            self.mute(mode="unmute", control_player=False)
+        self._set_standby(False)
+
+    def leave_standby(self, unmute=True):
+        """Leave standby on user activity (the silence timeout is re-armed).
+
+        Unmute if muted by enter_standby() - like wake_from_standby() - unless
+        unmute is False (the caller handles the mute state).
+        """
+        standby = self._silence.standby
+        self._silence.reset()
+        standby_muted = self._standby_muted
+        self._standby_muted = False
+        if standby_muted and unmute:
+            self.mute(mode="unmute", control_player=False)
+        if standby:
+            self._log.info("User activity - leaving standby")
+            self._set_standby(False)
+
+    def _set_standby(self, standby):
+        if self._redis:
+            self._redis.set("standby", standby)
+            self._redis.publish_event("standby")
+
     def update(self):
         """Update stats and update redis if they've changed."""
         is_on = self.is_on()
@@ -405,7 +705,8 @@ class CDsp():
             try:
                 # update/sync the current config index
                 cur_config_path = self._cdsp.get_config_name()
-            except (ConnectionRefusedError, CamillaError, IOError) as ex:
+            except (ConnectionRefusedError, camilladsp.CamillaError,
+                    IOError) as ex:
                 self._log.error(ex)
                 return
 
@@ -432,6 +733,35 @@ class CDsp():
                     self._log.warning("cfg['configs_control_player'] error: %s",
                                       ex)
 
+            # capture device parameters of the active config (used by
+            # consumers tapping the loopback capture, eg. the display meter);
+            # only fetched when the active config changes
+            # (or when a rate variant is loaded)
+            if (cur_config_path != self._config_path
+                    or self._capture_rate_changed):
+                config = self._cdsp_wp("get_config")
+                if config:
+                    self._stats['capture'] = (
+                            pymedia_freqresp.capture_params(config))
+                    self._capture_rate_changed = False
+                    if cur_config_path != self._config_path:
+                        self._loudness_trim = (config.get('filters', {}).get(
+                                LOUDNESS_TRIM_FILTER, {}).get(
+                                'parameters', {}).get('gain', 0.0))
+                    if self._redis and cur_config_path != self._config_path:
+                        self.update_response(config)
+                    self._config_path = cur_config_path
+
+            if self._cfg.get('capture_rate_variants'):
+                # CamillaDSP CPU load over the update interval
+                load_sample = self._cdsp_load.sample()
+                load = ProcessLoad.load(self._load_sample, load_sample)
+                self._load_sample = load_sample
+                if self.check_rate(cur_config_path, load):
+                    # a variant was loaded: the next update_loop() tick
+                    # fetches its capture parameters and the stats
+                    return
+
             if self._redis:
                 self._stats['volume'] = round(self._cdsp_wp("get_volume"))
                 self._stats['max_playback_signal_rms'] = (
@@ -449,6 +779,226 @@ class CDsp():
                     self._redis.update_stats(self._stats,
                                              send_data_changed_event = True)
 
+    def loudness_loop(self):
+        """Loop - measure the loudness (ITU-R BS.1770, see
+        pymedia_meter.LoudnessMeter) of the signal tapped from the capture
+        device, and update the loudness trim every LOUDNESS_TRIM_INTERVAL.
+
+        Paced by the capture device (one 100ms block per read); idle when
+        CamillaDSP is off or in standby.
+
+        Blocking, executed from within a thread.
+        """
+        capture = meter = None
+        next_check = next_trim = 0
+        while True:
+            now = time.monotonic()
+            if now >= next_check:
+                next_check = now + LOUDNESS_CHECK_INTERVAL
+                params = self._stats.get('capture')
+                if (not params or self._silence.standby
+                        or not self.is_on()):
+                    if capture:
+                        capture.close()
+                    time.sleep(LOUDNESS_CHECK_INTERVAL)
+                    continue
+                if not capture or (capture.device, capture.rate) != (
+                        params['device'], params['samplerate']):
+                    if capture:
+                        capture.close()
+                    meter = pymedia_meter.LoudnessMeter(params['samplerate'])
+                    capture = pymedia_pcm.PcmCapture(
+                            params['device'], params['channels'],
+                            params['samplerate'], params['format'],
+                            meter.block_size)
+
+            if not capture.is_open() and not capture.open():
+                time.sleep(LOUDNESS_CHECK_INTERVAL)
+                continue
+            block = capture.read()
+            if block is None:
+                continue
+            meter.process(block)
+            if now >= next_trim:
+                next_trim = now + LOUDNESS_TRIM_INTERVAL
+                self.update_loudness(meter)
+
+    def update_loudness(self, meter):
+        """Publish the loudness values (CDSP:loudness) and move the trim
+        towards cfg['loudness_target'] - short-term loudness exponentially
+        averaged over LOUDNESS_TRIM_TIME, ignoring silence/pauses.
+
+        A positive trim (boost) is limited by the headroom: the recent
+        capture peak (see LoudnessMeter.peak) stays LOUDNESS_PEAK_MARGIN
+        below 0dBFS - a boost above the headroom is reduced right away.
+        """
+        if self._redis:
+            self._redis.set("loudness", {
+                    'momentary': round(meter.momentary, 1),
+                    'short_term': round(meter.short_term, 1),
+                    'integrated': round(meter.integrated, 1),
+                    'peak': round(meter.peak, 1),
+                    'trim': self._loudness_trim,
+                    })
+        headroom = max(-meter.peak - LOUDNESS_PEAK_MARGIN, 0)
+        if self._loudness_trim > headroom:
+            self._log.info("Peak %.1fdBFS - limiting the loudness trim",
+                           meter.peak)
+            self.set_loudness_trim(math.floor(headroom * 10) / 10)
+            return
+        if meter.short_term < LOUDNESS_GATE:
+            return
+        # average in the power domain
+        power = 10**(meter.short_term / 10)
+        alpha = LOUDNESS_TRIM_INTERVAL / LOUDNESS_TRIM_TIME
+        self._loudness_power = (
+                power if self._loudness_power is None
+                else (1 - alpha) * self._loudness_power + alpha * power)
+        trim = min(max(self._cfg['loudness_target']
+                       - 10 * math.log10(self._loudness_power),
+                       LOUDNESS_TRIM_RANGE[0]), LOUDNESS_TRIM_RANGE[1],
+                   headroom)
+        change = trim - self._loudness_trim
+        if abs(change) < LOUDNESS_TRIM_STEP:
+            return
+        change = min(max(change, -LOUDNESS_TRIM_MAX_STEP),
+                     LOUDNESS_TRIM_MAX_STEP)
+        self.set_loudness_trim(min(round(self._loudness_trim + change, 1),
+                                   math.floor(headroom * 10) / 10))
+
+    def set_loudness_trim(self, trim):
+        """Set the gain of the LOUDNESS_TRIM_FILTER filter of the active
+        config (parameter change only: CamillaDSP applies it without
+        interrupting the processing)."""
+        with self._config_lock:
+            config = self._cdsp_wp("get_config")
+            if not config:
+                return
+            try:
+                config['filters'][LOUDNESS_TRIM_FILTER]['parameters'][
+                        'gain'] = trim
+            except (KeyError, TypeError):
+                self._log.debug("No '%s' filter in the config",
+                                LOUDNESS_TRIM_FILTER)
+                return
+            try:
+                self._cdsp.set_config(config)
+            except (ConnectionRefusedError, camilladsp.CamillaError,
+                    IOError) as ex:
+                self._log.error("Can't set the loudness trim: %s", ex)
+                return
+        self._log.info("Loudness trim %+.1fdB", trim)
+        self._loudness_trim = trim
+
+    def _processing_load(self):
+        """CamillaDSP processing load (%), None if it isn't available."""
+        if not hasattr(self._cdsp, "get_processing_load"):
+            return None
+        load = self._cdsp_wp("get_processing_load")
+        return None if load is None else round(load, 1)
+
+    def check_rate(self, config_path, load=None):
+        """Load a variant of the active config matching the rate the player
+        opened the loopback with: no resampling when the player rate is the
+        processing rate.
+
+        The loopback capture devices have a pinned rate (dsnoop, see
+        asound.conf): variants capture from the per-rate device of the
+        loopback if it's defined (eg. Loopback1_1_snoop_48000 - see
+        pymedia_source.rate_device()).
+
+        Variants are generated from the config file and validated once
+        (cached). There's no mute/unmute cycle - only CamillaDSP reopening
+        the capture device. load is the CamillaDSP CPU load before the
+        change: it's compared with the load after (see _measure_load()).
+        Return True if a variant was loaded: the stats are then refreshed by
+        the next update.
+        """
+        capture = self._stats.get('capture') or {}
+        card = pymedia_source.loopback_card(capture.get('device'))
+        rate = pymedia_source.pcm_rate(card) if card else None
+        if rate is None or rate == capture.get('samplerate'):
+            return False
+
+        variant = self._rate_variants.get((config_path, rate))
+        if variant is None:
+            try:
+                config = self._cdsp.read_config_file(config_path)
+                params = pymedia_freqresp.capture_params(config)
+                device = params['device']
+                if rate != params['samplerate']:
+                    device = pymedia_source.rate_device(device, rate)
+                variant = pymedia_freqresp.rate_variant(config, rate, device)
+                self._cdsp.validate_config(variant)
+            except (camilladsp.CamillaError, OSError, KeyError) as ex:
+                self._log.error("Can't create a %dHz variant of '%s': %s",
+                                rate, config_path, ex)
+                # don't retry
+                variant = False
+            self._rate_variants[(config_path, rate)] = variant
+        if not variant:
+            return False
+
+        before = {'capture': capture.get('samplerate'), 'cpu': load,
+                  'processing': self._processing_load()}
+        self._log.info("Player rate is %dHz - loading variant of '%s'"
+                       " (capture %sHz -> %dHz from %s, resampling %s)",
+                       rate, os.path.basename(config_path),
+                       capture.get('samplerate'), rate,
+                       variant['devices']['capture']['device'],
+                       variant['devices']['enable_resampling'])
+        with self._config_lock:
+            try:
+                if self._cdsp.get_config_name() != config_path:
+                    self._log.info("Config has changed - variant not loaded")
+                    return False
+                self._cdsp.set_config(variant)
+            except (ConnectionRefusedError, camilladsp.CamillaError,
+                    IOError) as ex:
+                self._log.error("Can't load config into CamillaDSP: %s", ex)
+                return False
+        self._capture_rate_changed = True
+        thread = threading.Thread(target=self._measure_load,
+                                  args=(rate, variant, before))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def _measure_load(self, rate, variant, before):
+        """Measure the CamillaDSP CPU load once a variant has settled, and
+        log/store (CDSP:capture_rate_load) the comparison with before."""
+        time.sleep(RATE_LOAD_DELAY)
+        start = self._cdsp_load.sample()
+        time.sleep(RATE_LOAD_WINDOW)
+        after = {'capture': rate,
+                 'cpu': ProcessLoad.load(start, self._cdsp_load.sample()),
+                 'processing': self._processing_load()}
+        self._log.info("CamillaDSP load at %sHz capture: cpu %s%%, processing"
+                       " %s%% (resampling %s) - at %sHz: cpu %s%%,"
+                       " processing %s%%", after['capture'], after['cpu'],
+                       after['processing'],
+                       variant['devices']['enable_resampling'],
+                       before['capture'], before['cpu'], before['processing'])
+        if self._redis:
+            self._redis.set("capture_rate_load",
+                            {'before': before, 'after': after,
+                             'resampling': variant['devices'][
+                                     'enable_resampling']})
+
+    def update_response(self, config):
+        """Compute the frequency response of config and store a summary in
+        redis (CDSP:response - eg. for the display 'response' screen)."""
+        start = time.monotonic()
+        try:
+            response = pymedia_freqresp.display_summary(config)
+        except (ImportError, KeyError, ValueError) as ex:
+            self._log.warning("Couldn't compute frequency response: %s", ex)
+            response = None
+        else:
+            self._log.debug("frequency response computed in %.3fs",
+                            time.monotonic() - start)
+        self._redis.set("response", response)
+
 
 def redis_cdsp_ping(redis_r, max_age=20):
     if not bool(redis_r.get_s("CDSP:is_on")):
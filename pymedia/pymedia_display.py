@@ -4,27 +4,61 @@
 
 import time
 import threading
+from functools import cached_property
 import redis
 
-# display
-import board
-import busio
-import adafruit_ssd1306
-from PIL import Image, ImageDraw, ImageFont
-
 import pymedia_logger
 from pymedia_cdsp import redis_cdsp_ping
+from pymedia_utils import IdleTimer, lazy_import, sd_notify
+from pymedia_i2c import (I2cBus, Ssd1306Panel, I2C_PRIORITY_HIGH,
+                         I2C_PRIORITY_NORMAL, I2C_PRIORITY_LOW)
+from pymedia_meter import LevelMeter, OctaveSpectrum
+from pymedia_pcm import PcmCapture
+
+# imported on first use - see lazy_import()
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+ImageFont = lazy_import("PIL.ImageFont")
 
 # ---------------------
 
 DISPLAY_WIDTH = 128
 DISPLAY_HEIGHT = 64
-DISPLAY_I2C_SCL = board.SCL
-DISPLAY_I2C_SDA = board.SDA
+DISPLAY_I2C_SCL = 'SCL'     # board pin names
+DISPLAY_I2C_SDA = 'SDA'
 DISPLAY_I2C_ADDRESS = 0x3C
+# panels sharing the i2c bus; the first one is the main display (volume,
+# meter, ... screens). Layouts: 'main', 'player' (player status, artist,
+# title), 'input' (active input label - see DISPLAY_INPUT_LABELS).
+# Transfers are scheduled by priority, so eg. a full refresh of a secondary
+# panel doesn't delay volume feedback on the main one.
+DISPLAY_PANELS = (
+        {
+            # 128x16 Yellow | 128x48 Sky Blue
+            'address': DISPLAY_I2C_ADDRESS,
+            'layout': 'main',
+            'priority': I2C_PRIORITY_HIGH,
+            },
+        # eg. rear status display
+        # {
+        #     'address': 0x3D,
+        #     'width': 128,
+        #     'height': 32,
+        #     'layout': 'input',
+        #     'priority': I2C_PRIORITY_LOW,
+        #     },
+        )
+# one label per CamillaDSP config index
+DISPLAY_INPUT_LABELS = ('LMS', 'Jacktrip', 'Bluetooth')
 DISPLAY_BG_COLOR = 0
 DISPLAY_FG_COLOR = 255
 DISPLAY_CONTRAST = 0
+# dimmed: contrast (only lower if DISPLAY_CONTRAST is raised) and VCOMH
+DISPLAY_CONTRAST_DIM = 0
+# ssd1306 VCOMH deselect level (0x00: 0.65*Vcc, 0x20: 0.77*Vcc, 0x30: 0.83*Vcc)
+# lowering it dims the panel further than contrast alone
+DISPLAY_VCOMH = 0x30
+DISPLAY_VCOMH_DIM = 0x00
 DISPLAY_FONT_SMALL = 'DejaVuSansMono.ttf'
 DISPLAY_FONT_MEDIUM = DISPLAY_FONT_SMALL
 DISPLAY_FONT_LARGE = DISPLAY_FONT_SMALL
@@ -39,7 +73,36 @@ DISPLAY_LINE_SPACING = 2
 DISPLAY_VOLUME_UNIT = "dB"
 DISPLAY_MAX_PLAYER_STATS_AGE = 10   # seconds
 DISPLAY_UPDATE_INTERVAL = 10    # seconds
+DISPLAY_TIMEOUT_DIM = 0         # 0 to disable (seconds)
 DISPLAY_TIMEOUT_AUTO_OFF = 0    # 0 to disable (seconds)
+# events (channel, data) that count as user activity and wake up the display;
+# display actions (eg. next_screen, wake) also wake it up
+DISPLAY_WAKE_EVENTS = (
+        ('CDSP:EVENT', 'volume'),
+        ('CDSP:EVENT', 'mute'),
+        ('CDSP:EVENT', 'change config'),
+        )
+# CamillaDSP standby (no signal, see CDSP:standby): the display is turned off,
+# and woken up when the signal is back - regardless of the idle timeouts
+DISPLAY_STANDBY_EVENT = ('CDSP:EVENT', 'standby')
+
+# screens, cycled with the 'next_screen' action
+# - volume: event driven, redrawn on redis events
+# - response: event driven, frequency response of the active CamillaDSP config
+#   (mono signal, per output - see CDSP:response)
+# - meter/spectrum: live, redrawn at DISPLAY_METER_FPS with samples tapped from
+#   the loopback capture CamillaDSP is using (see CDSP:capture)
+DISPLAY_SCREENS = ('volume', 'response', 'meter', 'spectrum')
+DISPLAY_LIVE_SCREENS = ('meter', 'spectrum')
+# a full frame is ~1KB: 25fps requires a 400kHz i2c bus (eg. on a rpi:
+# dtparam=i2c_arm_baudrate=400000)
+DISPLAY_METER_FPS = 25
+DISPLAY_METER_CHANNELS = (0, 1)     # capture channels to meter (L, R)
+DISPLAY_METER_RANGE = 60            # dB shown on bar graphs
+DISPLAY_METER_FFT_SIZE = 2048
+DISPLAY_METER_CHECK_INTERVAL = 1    # seconds - check cdsp status/capture
+DISPLAY_METER_STATS_INTERVAL = 30   # seconds - log fps/cpu usage
+DISPLAY_RESPONSE_RANGE = (-24, 12)  # dB shown on the response screen
 
 # ---------------------
 
@@ -48,54 +111,197 @@ class Display():
     def __init__(self, _redis, pubsubs):
         self._log = pymedia_logger.get_logger(__class__.__name__)
         self._redis = _redis
-        self._i2c = busio.I2C(board.SCL, board.SDA)
-        # 128x16 Yellow | 128x48 Sky Blue
-        self._disp = adafruit_ssd1306.SSD1306_I2C(
-                DISPLAY_WIDTH,
-                DISPLAY_HEIGHT,
-                busio.I2C(DISPLAY_I2C_SCL, DISPLAY_I2C_SDA),
-                addr=DISPLAY_I2C_ADDRESS,
-                )
-        self._disp.contrast(DISPLAY_CONTRAST)
+        self._ready = False
         self._timeout_auto_off = DISPLAY_TIMEOUT_AUTO_OFF
+        self._power = 'on'      # on, dim, off
+        self._standby = False   # CamillaDSP standby: display off
         self._update_id = 0
-        self._is_blank = False
         self._pubsubs = pubsubs
+        self._bus = I2cBus(DISPLAY_I2C_SCL, DISPLAY_I2C_SDA)
+        # panels are initialized on first transfer (see Ssd1306Panel)
+        self._panels = [
+                Ssd1306Panel(self._bus, cfg['address'],
+                             cfg.get('width', DISPLAY_WIDTH),
+                             cfg.get('height', DISPLAY_HEIGHT),
+                             cfg.get('priority', I2C_PRIORITY_LOW),
+                             DISPLAY_CONTRAST, cfg['layout'])
+                for cfg in DISPLAY_PANELS
+                ]
+        self._layouts = {
+                'main': self.draw_functions,
+                'player': self.draw_player_panel,
+                'input': self.draw_input_panel,
+                }
+        self._screen = DISPLAY_SCREENS[0]
+        self._state_changed = threading.Event()
+        self._status_bar_image = None
 
         self.t_wait_events = threading.Thread(target = self.wait_events)
         self.t_wait_events.daemon = True
-
+        self.t_meter_loop = threading.Thread(target = self.meter_loop)
+        self.t_meter_loop.daemon = True
+        # ready is notified once the first frame is sent
+        self.t_wait_action = self._redis.t_wait_action(self.action,
+                                                       notify_ready=False)
+        self._idle_timer = IdleTimer(
+                ((DISPLAY_TIMEOUT_DIM, self.dim),
+                 (self._timeout_auto_off, self.power_off)),
+                cb_wake=self.wake, label="[display]")
+
+    def _notify_ready(self, futures):
+        """Notify systemd once the first frame has been sent."""
+        if not self._ready:
+            for future in futures:
+                future.exception()  # wait, even if the transfer failed
+            self._ready = True
+            sd_notify()
+
+    def _load_font(self, name, size):
         try:
-            # Load default font.
-            #self._font_small = ImageFont.load_default()
-            self._font_small = ImageFont.truetype(DISPLAY_FONT_SMALL,
-                    DISPLAY_FONT_SMALL_SIZE)
-            self._font_medium = ImageFont.truetype(DISPLAY_FONT_MEDIUM,
-                    DISPLAY_FONT_MEDIUM_SIZE)
-            self._font_large = ImageFont.truetype(DISPLAY_FONT_LARGE,
-                    DISPLAY_FONT_LARGE_SIZE)
-            self._font_symbols = ImageFont.truetype(DISPLAY_FONT_SYMBOLS,
-                    DISPLAY_FONT_SYMBOLS_SIZE)
+            return ImageFont.truetype(name, size)
         except FileNotFoundError as ex:
-            self._log.error("missing font file in path (default: font5x8.bin)")
+            self._log.error("missing font file in path (%s)", name)
             raise SystemExit from ex
 
-        ( self._volume_unit_width, self._volume_unit_height ) = \
-                self._font_small.getsize(DISPLAY_VOLUME_UNIT)
+    # fonts are loaded on first use
+    @cached_property
+    def _font_small(self):
+        return self._load_font(DISPLAY_FONT_SMALL, DISPLAY_FONT_SMALL_SIZE)
+
+    @cached_property
+    def _font_medium(self):
+        return self._load_font(DISPLAY_FONT_MEDIUM, DISPLAY_FONT_MEDIUM_SIZE)
+
+    @cached_property
+    def _font_large(self):
+        return self._load_font(DISPLAY_FONT_LARGE, DISPLAY_FONT_LARGE_SIZE)
 
-        self.blank()    # clear display
+    @cached_property
+    def _font_symbols(self):
+        return self._load_font(DISPLAY_FONT_SYMBOLS, DISPLAY_FONT_SYMBOLS_SIZE)
+
+    @cached_property
+    def _volume_unit_size(self):
+        """(width, height) of the volume unit text."""
+        return self._font_small.getsize(DISPLAY_VOLUME_UNIT)
 
     def blank(self):
-        """Blank display (= fill with black)."""
-        if not self._is_blank:
-            self._disp.fill(0)
-            self._disp.show()
-            self._is_blank = True
+        """Blank displays (= fill with black).
+
+        Panels only send the pages that aren't already blank.
+        """
+        if self._power == 'off':
+            return
+        futures = []
+        for panel in self._panels:
+            futures += panel.blank()
+        self._notify_ready(futures)
+
+    def show(self, image, screen=None, panel=None, priority=None):
+        """Send image to a panel (default: main panel).
+
+        Skip if the display is powered off, or if screen is set and isn't the
+        current screen anymore (ie. a screen change happened while rendering).
+        Only the parts of the image that have changed since the last call are
+        sent (see Ssd1306Panel).
+        """
+        if self._power == 'off':
+            return
+        if screen is not None and screen != self._screen:
+            return
+        if panel is None:
+            panel = self._panels[0]
+        self._notify_ready(panel.show(image, priority))
+
+    def _set_power(self, power):
+        """Set display power: on, dim (lower contrast), or off (panel off)."""
+        if power == self._power:
+            return
+        self._log.info("display power: %s -> %s", self._power, power)
+        dim = power == 'dim'
+        for panel in self._panels:
+            panel.set_power(power != 'off',
+                            DISPLAY_CONTRAST_DIM if dim else DISPLAY_CONTRAST,
+                            DISPLAY_VCOMH_DIM if dim else DISPLAY_VCOMH)
+        self._power = power
+        self._state_changed.set()
+
+    def dim(self):
+        """Dim display (idle timer callback)."""
+        if self._idle_timer.stage():
+            self._set_power('dim')
+
+    def power_off(self):
+        """Turn the display panel off (idle timer callback).
+
+        No redraws nor i2c transfers happen until the display is woken up.
+        """
+        if self._idle_timer.stage():
+            self._set_power('off')
+
+    def wake(self):
+        """Restore full brightness and redraw (idle timer callback).
+
+        The display stays off during CamillaDSP standby.
+        """
+        if self._standby:
+            return
+        was_off = self._power == 'off'
+        self._set_power('on')
+        if was_off:
+            # the panel kept its RAM content but it may be stale
+            self._update_id += 1
+            self.update()
+
+    def set_standby(self, standby):
+        """Turn the display off on CamillaDSP standby, and back on (with the
+        idle timer re-armed) when it ends."""
+        if standby == self._standby:
+            return
+        self._log.info("CamillaDSP standby: %s", standby)
+        self._standby = standby
+        if standby:
+            self._set_power('off')
+        else:
+            self.wake()
+            self._idle_timer.activity()
+
+    def action(self, action=""):
+        """Run user actions.
+
+        This function is usually called by a loop waiting for user actions
+        published (sent) via redis.
+        """
+        if action == "wake":
+            self._idle_timer.activity()
+            return
+
+        if action == "next_screen":
+            index = DISPLAY_SCREENS.index(self._screen) + 1
+            screen = DISPLAY_SCREENS[index % len(DISPLAY_SCREENS)]
+        elif action.endswith("_screen") and (
+                action[:-len("_screen")] in DISPLAY_SCREENS):
+            screen = action[:-len("_screen")]
+        else:
+            self._log.warning("action '%s' isn't defined", action)
+            return
+
+        self._log.info("'%s' - screen is now '%s'", action, screen)
+        self._screen = screen
+        self._status_bar_image = None
+        self._state_changed.set()
+        self._update_id += 1
+        self.update()
+        self._idle_timer.activity()
 
     def draw_functions(self, draw):
-        """Default drawing functions: draw banner and CamillaDSP volume."""
+        """Default drawing functions: draw banner and CamillaDSP volume (or
+        frequency response)."""
         self.draw_status_bar(draw)
-        self.draw_cdsp_volume(draw)
+        if self._screen == 'response':
+            self.draw_cdsp_response(draw)
+        else:
+            self.draw_cdsp_volume(draw)
 
     # https://pillow.readthedocs.io/en/stable/handbook/text-anchors.html
     def draw_status_bar(self, draw):
@@ -145,7 +351,7 @@ class Display():
                 )
         self._log.debug("banner text is '%s'", text)
         draw.text(
-            (self._disp.width - DISPLAY_X_OFFSET, 16 - DISPLAY_LINE_SPACING),
+            (DISPLAY_WIDTH - DISPLAY_X_OFFSET, 16 - DISPLAY_LINE_SPACING),
             text, font=self._font_small, fill=DISPLAY_FG_COLOR, spacing=0,
             anchor='rb')
 
@@ -159,14 +365,14 @@ class Display():
 
         # draw unit
         draw.text(
-            (self._disp.width - DISPLAY_X_OFFSET, self._disp.height),
+            (DISPLAY_WIDTH - DISPLAY_X_OFFSET, DISPLAY_HEIGHT),
             DISPLAY_VOLUME_UNIT, font=self._font_small,
             fill=DISPLAY_FG_COLOR, spacing=0, anchor='rb')
 
         # draw text
         draw.text(
-            (self._disp.width - self._volume_unit_width - DISPLAY_X_OFFSET,
-             self._disp.height),
+            (DISPLAY_WIDTH - self._volume_unit_size[0] - DISPLAY_X_OFFSET,
+             DISPLAY_HEIGHT),
             vol,
             font=self._font_large, fill=DISPLAY_FG_COLOR,
             spacing=0, anchor='rb')
@@ -174,11 +380,70 @@ class Display():
         # draw mute
         if self._redis.get_s("CDSP:mute"):
             draw.text(
-                (self._disp.width - DISPLAY_X_OFFSET, self._disp.height -
-                 self._volume_unit_height - DISPLAY_LINE_SPACING), "M",
+                (DISPLAY_WIDTH - DISPLAY_X_OFFSET, DISPLAY_HEIGHT -
+                 self._volume_unit_size[1] - DISPLAY_LINE_SPACING), "M",
                 font=self._font_symbols, fill=DISPLAY_FG_COLOR, spacing=0,
                 anchor='rb')
 
+    def draw_cdsp_response(self, draw):
+        """Draw the magnitude response of each CamillaDSP output, with a dotted
+        0dB line."""
+        response = self._redis.get_s("CDSP:response")
+        if not response:
+            draw.text((DISPLAY_WIDTH // 2, DISPLAY_HEIGHT - 16), "no response",
+                      font=self._font_small, fill=DISPLAY_FG_COLOR,
+                      anchor='mm')
+            return
+        top = 16 + DISPLAY_LINE_SPACING
+        height = DISPLAY_HEIGHT - top - 1
+        db_min, db_max = DISPLAY_RESPONSE_RANGE
+
+        def y_pos(level):
+            level = min(max(level, db_min), db_max)
+            return top + round((db_max - level) / (db_max - db_min) * height)
+
+        y_zero = y_pos(0)
+        for x_pos in range(0, DISPLAY_WIDTH, 4):
+            draw.point((x_pos, y_zero), fill=DISPLAY_FG_COLOR)
+        for levels in response['outputs'].values():
+            x_scale = (DISPLAY_WIDTH - 1) / max(len(levels) - 1, 1)
+            draw.line([(round(index * x_scale), y_pos(level))
+                       for index, level in enumerate(levels)],
+                      fill=DISPLAY_FG_COLOR)
+
+    def draw_player_panel(self, draw):
+        """'player' layout: player status, artist and title."""
+        width = draw.im.size[0]
+        power = self._redis.get_s("PLAYER:power")
+        if not power:
+            lines = ("Player off",)
+        else:
+            lines = (
+                    ("Playing" if self._redis.get_s("PLAYER:isplaying")
+                     else "Stopped"),
+                    self._redis.get_s("PLAYER:artist", "string"),
+                    self._redis.get_s("PLAYER:title", "string"),
+                    )
+        y_pos = 0
+        for line in lines:
+            # truncate to the panel width
+            while line and self._font_small.getlength(line) > width:
+                line = line[:-1]
+            draw.text((0, y_pos), line, font=self._font_small,
+                      fill=DISPLAY_FG_COLOR, anchor='la')
+            y_pos += DISPLAY_FONT_SMALL_SIZE + DISPLAY_LINE_SPACING
+
+    def draw_input_panel(self, draw):
+        """'input' layout: label of the active input (CamillaDSP config)."""
+        (width, height) = draw.im.size
+        config_index = self._redis.get_s("CDSP:config_index")
+        try:
+            label = DISPLAY_INPUT_LABELS[config_index]
+        except (IndexError, TypeError):
+            label = chr(65 + config_index) if config_index is not None else ''
+        draw.text((width // 2, height // 2), label, font=self._font_symbols,
+                  fill=DISPLAY_FG_COLOR, anchor='mm')
+
     def update_condition(self):
         """Default update condition: refresh when CamillaDSP is active."""
         self._log.debug("Default condition: check Redis/CamillaDSP status")
@@ -196,9 +461,14 @@ class Display():
 
         # save the current thread id for later comparison
         update_id = self._update_id
+        screen = self._screen
 
         self._log.debug("refreshing display - thread ID is %d", update_id)
 
+        if self._power == 'off':
+            self._log.debug("display is off - won't refresh")
+            return
+
         if not self.update_condition():
             self._log.debug("Condition was False - display is off")
             self.blank()
@@ -206,40 +476,196 @@ class Display():
 
         start_render = time.monotonic()
 
-        # Create a blank image for drawing.
-        # Make sure to create image with mode '1' for 1-bit color.
-        image = Image.new("1", (self._disp.width, self._disp.height))
-        # Get a drawing object to draw the image on
-        draw = ImageDraw.Draw(image)
+        for index, panel in enumerate(self._panels):
+            if index == 0 and screen in DISPLAY_LIVE_SCREENS:
+                # live screens are redrawn by meter_loop(); only invalidate
+                # the (cached) status bar
+                self._status_bar_image = None
+                continue
+
+            # Create a blank image for drawing.
+            # Make sure to create image with mode '1' for 1-bit color.
+            image = Image.new("1", (panel.width, panel.height))
+            # Get a drawing object to draw the image on
+            draw = ImageDraw.Draw(image)
+
+            # Draw a black filled box to clear the image.
+            draw.rectangle((0, 0, panel.width, panel.height),
+                             outline=0, fill=DISPLAY_BG_COLOR)
+
+            # stop if another thread took over
+            if self._update_id != update_id:
+                self._log.debug("Won't redraw - new event available"
+                                " (s:%d|c:%d)", self._update_id, update_id)
+                return
 
-        # Draw a black filled box to clear the image.
-        draw.rectangle((0, 0, self._disp.width, self._disp.height),
-                         outline=0, fill=DISPLAY_BG_COLOR)
+            # draw
+            self._layouts[panel.name](draw)
 
-        # stop if another thread took over
-        if self._update_id != update_id:
-            self._log.debug("Won't redraw - new event available (s:%d|c:%d)",
-                           self._update_id, update_id)
-            return
+            # stop if another thread took over
+            if self._update_id != update_id:
+                self._log.debug("Won't redraw - new event available"
+                                " (s:%d|c:%d)", self._update_id, update_id)
+                return
 
-        # draw
-        self.draw_functions(draw)
+            # finally update display
+            self.show(image, screen if index == 0 else None, panel)
 
-        # stop if another thread took over
-        if self._update_id != update_id:
-            self._log.debug("Won't redraw - new event available (s:%d|c:%d)",
-                           self._update_id, update_id)
-            return
+        self._log.debug("render: %s", time.monotonic() - start_render)
 
-        # finally update display
-        self._is_blank = False
-        self._disp.image(image)
-        self._disp.show()
+    def _get_status_bar_image(self):
+        """Return a blank image with the status bar drawn (cached)."""
+        image = self._status_bar_image
+        if image is None:
+            image = Image.new("1", (DISPLAY_WIDTH, DISPLAY_HEIGHT))
+            self.draw_status_bar(ImageDraw.Draw(image))
+            self._status_bar_image = image
+        return image
+
+    def draw_meter(self, draw, meter):
+        """Draw horizontal per-channel RMS bars and peak hold markers."""
+        top = 16 + DISPLAY_LINE_SPACING
+        left = DISPLAY_X_OFFSET + 8
+        width = DISPLAY_WIDTH - DISPLAY_X_OFFSET - left
+        row_height = (DISPLAY_HEIGHT - top) // len(meter.channels)
+        bars = self._db_to_len(meter.bar, width)
+        peaks = self._db_to_len(meter.peak_hold, width)
+        for index, (bar, peak) in enumerate(zip(bars, peaks)):
+            y_top = top + index * row_height
+            y_bottom = y_top + row_height - 3
+            draw.text((DISPLAY_X_OFFSET, y_bottom + 1),
+                      "LR"[index] if len(meter.channels) == 2 else str(index),
+                      font=self._font_small, fill=DISPLAY_FG_COLOR, anchor='lb')
+            if bar:
+                draw.rectangle((left, y_top, left + bar - 1, y_bottom),
+                               fill=DISPLAY_FG_COLOR)
+            if peak:
+                draw.rectangle((left + peak - 2, y_top, left + peak - 1,
+                                y_bottom), fill=DISPLAY_FG_COLOR)
+
+    def draw_spectrum(self, draw, spectrum):
+        """Draw vertical 1/3 octave band bars."""
+        top = 16 + DISPLAY_LINE_SPACING
+        height = DISPLAY_HEIGHT - top
+        bar_width = DISPLAY_WIDTH // len(spectrum.centers)
+        left = (DISPLAY_WIDTH - bar_width * len(spectrum.centers)) // 2
+        for index, bar in enumerate(self._db_to_len(spectrum.bar, height)):
+            if bar:
+                x_left = left + index * bar_width
+                draw.rectangle((x_left, DISPLAY_HEIGHT - bar,
+                                x_left + bar_width - 2, DISPLAY_HEIGHT - 1),
+                               fill=DISPLAY_FG_COLOR)
+
+    @staticmethod
+    def _db_to_len(levels, length):
+        """Convert dBFS levels (numpy array) to bar lengths in pixels."""
+        ratio = (levels + DISPLAY_METER_RANGE) / DISPLAY_METER_RANGE
+        return (ratio.clip(0, 1) * length).astype(int).tolist()
+
+    def _open_capture(self, capture):
+        """Return a capture instance matching the current CamillaDSP config.
+
+        Re-use capture if it's still valid; return None if the parameters
+        aren't known (yet).
+        """
+        params = self._redis.get_s("CDSP:capture")
+        if not params or not params.get('device'):
+            self._log.debug("no CDSP:capture parameters")
+            return None
+        if capture and (capture.device, capture.channels, capture.rate,
+                        capture.sample_format) == (
+                                params['device'], params['channels'],
+                                params['samplerate'], params['format']):
+            return capture
+        if capture:
+            capture.close()
+        try:
+            return PcmCapture(params['device'], params['channels'],
+                              params['samplerate'], params['format'],
+                              period_size=(params['samplerate']
+                                           // DISPLAY_METER_FPS))
+        except ValueError as ex:
+            self._log.warning(ex)
+            return None
+
+    def meter_loop(self):
+        """Render the live (meter/spectrum) screens.
+
+        The loop is paced by the capture device: one block of rate /
+        DISPLAY_METER_FPS frames is read, processed and rendered per frame.
+        Idle (waiting for a screen change) when the current screen isn't live.
+
+        Blocking, executed from within a thread (self.t_meter_loop).
+        """
+        capture = None
+        meter = spectrum = None
+        next_check = 0
+        stats = {'frames': 0, 'cpu': 0.0, 'start': time.monotonic()}
 
-        self._log.debug("render: %s", time.monotonic() - start_render)
+        while True:
+            if (self._screen not in DISPLAY_LIVE_SCREENS
+                    or self._power == 'off'):
+                if capture:
+                    capture.close()
+                self._state_changed.wait()
+                self._state_changed.clear()
+                continue
+
+            now = time.monotonic()
+            if now >= next_check:
+                next_check = now + DISPLAY_METER_CHECK_INTERVAL
+                if not self.update_condition():
+                    if capture:
+                        capture.close()
+                    self.blank()
+                    self._state_changed.wait(DISPLAY_UPDATE_INTERVAL)
+                    self._state_changed.clear()
+                    continue
+                capture = self._open_capture(capture)
+                if capture and (not spectrum or spectrum.rate != capture.rate):
+                    meter = LevelMeter(DISPLAY_METER_CHANNELS)
+                    spectrum = OctaveSpectrum(capture.rate,
+                                              DISPLAY_METER_FFT_SIZE)
+
+            if not capture or (not capture.is_open() and not capture.open()):
+                self._state_changed.wait(DISPLAY_METER_CHECK_INTERVAL)
+                self._state_changed.clear()
+                continue
+
+            block = capture.read()
+            if block is None:
+                continue
+
+            cpu_start = time.thread_time()
+            screen = self._screen
+            image = self._get_status_bar_image().copy()
+            draw = ImageDraw.Draw(image)
+            if screen == 'meter':
+                meter.process(block)
+                self.draw_meter(draw, meter)
+            elif screen == 'spectrum':
+                spectrum.process(block, DISPLAY_METER_CHANNELS)
+                self.draw_spectrum(draw, spectrum)
+            self.show(image, screen, priority=I2C_PRIORITY_NORMAL)
+            stats['cpu'] += time.thread_time() - cpu_start
+            stats['frames'] += 1
+
+            elapsed = time.monotonic() - stats['start']
+            if elapsed >= DISPLAY_METER_STATS_INTERVAL:
+                self._log.info("'%s' screen: %.1f fps, cpu %.1f%%"
+                               " (%.2fms/frame)", screen,
+                               stats['frames'] / elapsed,
+                               100 * stats['cpu'] / elapsed,
+                               1000 * stats['cpu'] / max(stats['frames'], 1))
+                stats = {'frames': 0, 'cpu': 0.0, 'start': time.monotonic()}
 
     def wait_events(self):
-        """Wait for redis events / update display on each event."""
+        """Wait for redis events / update display on each event.
+
+        Also refresh every DISPLAY_UPDATE_INTERVAL seconds to catch stale
+        player/CamillaDSP status (the display is only refreshed if the image
+        has changed, see show()), except when the display is powered off.
+        """
 
         # bug: 'ignore_subscribe_messages' doesn't seem to work with
         # get_message(timeout=...) so we'll immediately get as many messages as
@@ -254,12 +680,24 @@ class Display():
 
         while True:
             try:
-                message = pubsub.get_message(timeout=DISPLAY_UPDATE_INTERVAL)
+                # no periodic refresh while the display is off: block until
+                # an event arrives
+                timeout = (None if self._power == 'off'
+                           else DISPLAY_UPDATE_INTERVAL)
+                message = pubsub.get_message(timeout=timeout)
                 if message:
                     self._log.debug("received message %s", message)
+                    event = (message['channel'].decode(),
+                             message['data'].decode())
+                    if event in DISPLAY_WAKE_EVENTS:
+                        self._idle_timer.activity()
+                    elif event == DISPLAY_STANDBY_EVENT:
+                        self.set_standby(bool(
+                                self._redis.get_s("CDSP:standby")))
                 else:
-                    self._log.debug("timeout (%s seconds)",
-                                   DISPLAY_UPDATE_INTERVAL)
+                    self._log.debug("timeout (%s seconds)", timeout)
+                if self._power == 'off':
+                    continue
                 thread = threading.Thread(target = self.update)
                 self._update_id += 1
                 thread.start()
@@ -0,0 +1,438 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+import copy
+import csv
+import json
+import math
+
+import pymedia_logger
+from pymedia_utils import lazy_import
+
+np = lazy_import("numpy")
+yaml = lazy_import("yaml")
+
+# ---------------------
+
+FREQRESP_POINTS = 512
+FREQRESP_MIN_FREQ = 10
+
+# CamillaDSP Loudness filter (see camilladsp's loudness.rs)
+LOUDNESS_LOW_FREQ = 70
+LOUDNESS_HIGH_FREQ = 3500
+LOUDNESS_SLOPE = 12
+
+# ---------------------
+
+def read_config(path):
+    """Read a CamillaDSP yaml config file."""
+    with open(path, encoding="utf-8") as config_file:
+        return yaml.safe_load(config_file)
+
+def capture_params(config):
+    """Return the capture device parameters of a CamillaDSP config (dict).
+
+    The capture sample rate is 'capture_samplerate' when resampling is
+    enabled, 'samplerate' otherwise.
+    """
+    devices = config['devices']
+    capture = devices['capture']
+    rate = devices['samplerate']
+    if devices.get('enable_resampling') and devices.get('capture_samplerate'):
+        rate = devices['capture_samplerate']
+    return {
+            'device': capture.get('device'),
+            'format': capture.get('format'),
+            'channels': capture.get('channels'),
+            'samplerate': rate,
+            }
+
+def rate_variant(config, rate, device=None):
+    """Return a copy of config capturing at rate (from device, if set):
+    resampling is disabled if rate is the processing sample rate (filters are
+    defined at that rate, so they're unchanged)."""
+    variant = copy.deepcopy(config)
+    devices = variant['devices']
+    if device:
+        devices['capture']['device'] = device
+    if rate == devices['samplerate']:
+        devices['enable_resampling'] = False
+        devices.pop('capture_samplerate', None)
+    else:
+        devices['enable_resampling'] = True
+        devices['capture_samplerate'] = rate
+    return variant
+
+def log_freqs(samplerate, points=FREQRESP_POINTS, fmin=FREQRESP_MIN_FREQ,
+              fmax=None):
+    """Log spaced frequency grid, up to fmax (default: ~nyquist)."""
+    if fmax is None:
+        fmax = min(20000, 0.95 * samplerate / 2)
+    return np.geomspace(fmin, fmax, points)
+
+# ---------------------
+# coefficients
+#
+# biquads are (b0, b1, b2, a1, a2) tuples, normalized (a0 = 1); formulas from
+# the RBJ audio EQ cookbook, as in CamillaDSP.
+
+def _biquad(b0, b1, b2, a0, a1, a2):
+    return (b0 / a0, b1 / a0, b2 / a0, a1 / a0, a2 / a0)
+
+def _first_order(b1s, b0s, a1s, a0s, freq, samplerate):
+    """Bilinear transform of H(s) = (b1s.s + b0s) / (a1s.s + a0s), with s
+    normalized to freq (prewarped)."""
+    k = math.tan(math.pi * freq / samplerate)
+    return _biquad(b1s / k + b0s, b0s - b1s / k, 0,
+                   a1s / k + a0s, a0s - a1s / k, 0)
+
+def _q_from_bandwidth(freq, bandwidth, samplerate):
+    omega = 2 * math.pi * freq / samplerate
+    return 1 / (2 * math.sinh(math.log(2) / 2 * bandwidth * omega
+                              / math.sin(omega)))
+
+def _shelf_alpha(params, gain_a, omega):
+    if 'q' in params:
+        return math.sin(omega) / (2 * params['q'])
+    slope = params.get('slope', 12) / 12
+    return math.sin(omega) / 2 * math.sqrt(
+            (gain_a + 1 / gain_a) * (1 / slope - 1) + 2)
+
+def biquad_coefs(params, samplerate):
+    """Return the (b0, b1, b2, a1, a2) coefficients of a Biquad filter."""
+    # pylint: disable=too-many-return-statements
+    ftype = params['type']
+    if ftype == 'Free':
+        return (params['b0'], params['b1'], params['b2'], params['a1'],
+                params['a2'])
+
+    freq = params['freq']
+    omega = 2 * math.pi * freq / samplerate
+    sn, cs = math.sin(omega), math.cos(omega)
+    gain = params.get('gain', 0)
+
+    if ftype == 'LowpassFO':
+        return _first_order(0, 1, 1, 1, freq, samplerate)
+    if ftype == 'HighpassFO':
+        return _first_order(1, 0, 1, 1, freq, samplerate)
+    if ftype == 'AllpassFO':
+        return _first_order(-1, 1, 1, 1, freq, samplerate)
+    if ftype == 'LowshelfFO':
+        ampl = 10**(gain / 40)
+        return _first_order(1, ampl, 1, 1 / ampl, freq, samplerate)
+    if ftype == 'HighshelfFO':
+        ampl = 10**(gain / 40)
+        return _first_order(ampl, 1, 1 / ampl, 1, freq, samplerate)
+
+    if ftype in ('Lowshelf', 'Highshelf'):
+        ampl = 10**(gain / 40)
+        alpha = _shelf_alpha(params, ampl, omega)
+        beta = 2 * math.sqrt(ampl) * alpha
+        sign = 1 if ftype == 'Lowshelf' else -1
+        return _biquad(
+                ampl * ((ampl + 1) - sign * (ampl - 1) * cs + beta),
+                sign * 2 * ampl * ((ampl - 1) - sign * (ampl + 1) * cs),
+                ampl * ((ampl + 1) - sign * (ampl - 1) * cs - beta),
+                (ampl + 1) + sign * (ampl - 1) * cs + beta,
+                -sign * 2 * ((ampl - 1) + sign * (ampl + 1) * cs),
+                (ampl + 1) + sign * (ampl - 1) * cs - beta)
+
+    if 'q' in params:
+        q_factor = params['q']
+    elif 'bandwidth' in params:
+        q_factor = _q_from_bandwidth(freq, params['bandwidth'], samplerate)
+    else:
+        raise ValueError(f"{ftype}: 'q' or 'bandwidth' is required")
+    alpha = sn / (2 * q_factor)
+
+    if ftype == 'Lowpass':
+        return _biquad((1 - cs) / 2, 1 - cs, (1 - cs) / 2,
+                       1 + alpha, -2 * cs, 1 - alpha)
+    if ftype == 'Highpass':
+        return _biquad((1 + cs) / 2, -(1 + cs), (1 + cs) / 2,
+                       1 + alpha, -2 * cs, 1 - alpha)
+    if ftype == 'Peaking':
+        ampl = 10**(gain / 40)
+        return _biquad(1 + alpha * ampl, -2 * cs, 1 - alpha * ampl,
+                       1 + alpha / ampl, -2 * cs, 1 - alpha / ampl)
+    if ftype == 'Notch':
+        return _biquad(1, -2 * cs, 1, 1 + alpha, -2 * cs, 1 - alpha)
+    if ftype == 'Bandpass':
+        return _biquad(alpha, 0, -alpha, 1 + alpha, -2 * cs, 1 - alpha)
+    if ftype == 'Allpass':
+        return _biquad(1 - alpha, -2 * cs, 1 + alpha,
+                       1 + alpha, -2 * cs, 1 - alpha)
+
+    raise ValueError(f"unsupported Biquad type '{ftype}'")
+
+def butterworth_coefs(ftype, freq, order, samplerate):
+    """Return the biquads of a Butterworth lowpass/highpass filter."""
+    sections = []
+    for index in range(order // 2):
+        q_factor = 1 / (2 * math.cos(math.pi * (2 * index + 1) / (2 * order)))
+        sections.append(biquad_coefs(
+            {'type': ftype, 'freq': freq, 'q': q_factor}, samplerate))
+    if order % 2:
+        sections.append(biquad_coefs(
+            {'type': ftype + 'FO', 'freq': freq}, samplerate))
+    return sections
+
+def biquad_combo_coefs(params, samplerate):
+    """Return the biquads of a BiquadCombo filter."""
+    ftype = params['type']
+    for prefix in ('LinkwitzRiley', 'Butterworth'):
+        if ftype.startswith(prefix):
+            pass_type = ftype[len(prefix):]
+            break
+    else:
+        raise ValueError(f"unsupported BiquadCombo type '{ftype}'")
+    if pass_type not in ('Lowpass', 'Highpass'):
+        raise ValueError(f"unsupported BiquadCombo type '{ftype}'")
+    if prefix == 'Butterworth':
+        return butterworth_coefs(pass_type, params['freq'], params['order'],
+                                 samplerate)
+    # Linkwitz-Riley: two cascaded Butterworth filters of half the order
+    if params['order'] % 2:
+        raise ValueError("Linkwitz-Riley filters must be of even order")
+    return 2 * butterworth_coefs(pass_type, params['freq'],
+                                 params['order'] // 2, samplerate)
+
+# ---------------------
+# responses
+
+def biquads_response(sections, freqs, samplerate):
+    """Complex response of cascaded biquads, computed for all frequencies at
+    once."""
+    z_1 = np.exp(-2j * np.pi * freqs / samplerate)
+    z_2 = z_1 * z_1
+    coefs = np.asarray(sections, dtype=float).reshape(-1, 5)
+    num = coefs[:, 0:1] + coefs[:, 1:2] * z_1 + coefs[:, 2:3] * z_2
+    den = 1 + coefs[:, 3:4] * z_1 + coefs[:, 4:5] * z_2
+    return np.prod(num / den, axis=0)
+
+def peaking_db(freqs, freq, gain, q_factor, samplerate):
+    """Magnitude (dB) of Peaking biquads, vectorized over the filter
+    parameters: freq, gain and q_factor are broadcast together (shape S), the
+    result has shape S + (len(freqs),)."""
+    freq, gain, q_factor = (np.asarray(value, dtype=float)[..., np.newaxis]
+                            for value in np.broadcast_arrays(freq, gain,
+                                                             q_factor))
+    omega = 2 * np.pi * freq / samplerate
+    alpha = np.sin(omega) / (2 * q_factor)
+    ampl = 10**(gain / 40)
+    cs_2 = -2 * np.cos(omega)
+    z_1 = np.exp(-2j * np.pi * np.asarray(freqs) / samplerate)
+    z_2 = z_1 * z_1
+    num = 1 + alpha * ampl + cs_2 * z_1 + (1 - alpha * ampl) * z_2
+    den = 1 + alpha / ampl + cs_2 * z_1 + (1 - alpha / ampl) * z_2
+    return 20 * np.log10(np.abs(num / den))
+
+def loudness_biquads(params, samplerate, volume):
+    """Shelving filters of a Loudness filter for the given volume (dB)."""
+    boost = min(max((params['reference_level'] - volume) / 20, 0), 1)
+    return [
+            biquad_coefs({'type': 'Lowshelf', 'freq': LOUDNESS_LOW_FREQ,
+                          'slope': LOUDNESS_SLOPE,
+                          'gain': boost * params['low_boost']}, samplerate),
+            biquad_coefs({'type': 'Highshelf', 'freq': LOUDNESS_HIGH_FREQ,
+                          'slope': LOUDNESS_SLOPE,
+                          'gain': boost * params['high_boost']}, samplerate),
+            ]
+
+def filter_response(filt, freqs, samplerate, volume=None):
+    """Complex response of a CamillaDSP filter definition.
+
+    volume (dB) is only used by Loudness filters, which are flat if it's None.
+    """
+    # pylint: disable=too-many-return-statements
+    ftype = filt['type']
+    params = filt.get('parameters', {})
+    if ftype == 'Biquad':
+        return biquads_response([biquad_coefs(params, samplerate)], freqs,
+                                samplerate)
+    if ftype == 'BiquadCombo':
+        return biquads_response(biquad_combo_coefs(params, samplerate), freqs,
+                                samplerate)
+    if ftype == 'Gain':
+        gain = 10**(params.get('gain', 0) / 20)
+        if params.get('inverted'):
+            gain = -gain
+        return np.full(len(freqs), gain, dtype=complex)
+    if ftype == 'Delay':
+        delay = params['delay']
+        unit = params.get('unit', 'ms')
+        if unit == 'samples':
+            delay /= samplerate
+        elif unit == 'mm':
+            delay /= 343e3  # speed of sound, mm/s
+        else:
+            delay /= 1000
+        return np.exp(-2j * np.pi * freqs * delay)
+    if ftype == 'DiffEq':
+        coefs_a = np.asarray(params.get('a', [1.0]), dtype=float)
+        coefs_b = np.asarray(params.get('b', [1.0]), dtype=float)
+        z_n = np.exp(-2j * np.pi * np.outer(
+            np.arange(max(len(coefs_a), len(coefs_b))), freqs / samplerate))
+        return ((coefs_b @ z_n[:len(coefs_b)])
+                / (coefs_a @ z_n[:len(coefs_a)]))
+    if ftype == 'Loudness':
+        if volume is None:
+            return np.ones(len(freqs), dtype=complex)
+        return biquads_response(loudness_biquads(params, samplerate, volume),
+                                freqs, samplerate)
+    if ftype in ('Volume', 'Dither'):
+        return np.ones(len(freqs), dtype=complex)
+    raise ValueError(f"unsupported filter type '{ftype}'")
+
+def mixer_matrix(mixer):
+    """(out, in) gain matrix of a CamillaDSP mixer."""
+    matrix = np.zeros((mixer['channels']['out'], mixer['channels']['in']))
+    for mapping in mixer.get('mapping', []):
+        if mapping.get('mute'):
+            continue
+        for source in mapping.get('sources', []):
+            if source.get('mute'):
+                continue
+            gain = 10**(source.get('gain', 0) / 20)
+            if source.get('inverted'):
+                gain = -gain
+            matrix[mapping['dest'], source['channel']] += gain
+    return matrix
+
+
+class FrequencyResponse():
+    """Compute the per output channel response of CamillaDSP configs.
+
+    The result of compute() is a (out, in, freqs) complex array: the transfer
+    function from each capture channel to each playback channel.
+
+    Filter responses are cached by filter name and parameters: when a config
+    is edited, only the filters that have changed are recomputed; the pipeline
+    itself is a handful of array multiplications.
+    """
+    def __init__(self, samplerate, freqs=None, volume=None):
+        self._log = pymedia_logger.get_logger(__class__.__name__)
+        self.samplerate = samplerate
+        self.freqs = log_freqs(samplerate) if freqs is None else freqs
+        self.volume = volume
+        self._cache = {}    # filter name -> (params key, response)
+        self.stats = {'computed': 0, 'cached': 0}
+
+    def filter_response(self, name, filt):
+        key = json.dumps(filt, sort_keys=True)
+        cached = self._cache.get(name)
+        if cached and cached[0] == key:
+            self.stats['cached'] += 1
+            return cached[1]
+        self._log.debug("computing response of filter '%s'", name)
+        response = filter_response(filt, self.freqs, self.samplerate,
+                                   self.volume)
+        self._cache[name] = (key, response)
+        self.stats['computed'] += 1
+        return response
+
+    def compute(self, config):
+        devices = config['devices']
+        if devices['samplerate'] != self.samplerate:
+            raise ValueError(f"config samplerate {devices['samplerate']} !="
+                             f" {self.samplerate}")
+        filters = config.get('filters') or {}
+        mixers = config.get('mixers') or {}
+        self.stats = {'computed': 0, 'cached': 0}
+
+        nb_channels = devices['capture']['channels']
+        response = np.broadcast_to(
+                np.eye(nb_channels)[:, :, np.newaxis],
+                (nb_channels, nb_channels, len(self.freqs))).astype(complex)
+
+        for step in config.get('pipeline') or []:
+            if step['type'] == 'Mixer':
+                response = np.einsum('oi,ijf->ojf',
+                                     mixer_matrix(mixers[step['name']]),
+                                     response)
+            elif step['type'] == 'Filter':
+                # 'channel' (CamillaDSP v1) or 'channels' (v2)
+                channels = step.get('channels', [step.get('channel')])
+                for name in step['names']:
+                    filt_response = self.filter_response(name, filters[name])
+                    for channel in channels:
+                        response[channel] *= filt_response
+            else:
+                raise ValueError(f"unsupported pipeline step '{step['type']}'")
+
+        self._log.debug("filter responses: %s", self.stats)
+        return response
+
+
+def magnitude_db(response, floor=-150):
+    """Magnitude in dB of complex responses, clipped to floor."""
+    with np.errstate(divide='ignore'):
+        return np.maximum(20 * np.log10(np.abs(response)), floor)
+
+def mono_response(response, inputs=(0, 1)):
+    """Response of each output to the same (mono) signal on inputs."""
+    return np.sum(response[:, list(inputs), :], axis=1)
+
+def active_outputs(response, floor=-150):
+    """Indexes of outputs that aren't silent."""
+    return [out for out in range(response.shape[0])
+            if np.max(magnitude_db(response[out], floor)) > floor]
+
+def export_csv(path, freqs, response, inputs=(0, 1)):
+    """Write freq / magnitude (dB) / phase (deg) of each active output (mono
+    input signal) to a CSV file."""
+    mono = mono_response(response, inputs)
+    outputs = active_outputs(mono)
+    with open(path, 'w', newline='', encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["freq"] + [f"{col}_out{out}" for out in outputs
+                                    for col in ("db", "deg")])
+        mag = magnitude_db(mono[outputs])
+        phase = np.degrees(np.angle(mono[outputs]))
+        for index, freq in enumerate(freqs):
+            row = [f"{freq:.2f}"]
+            for out in range(len(outputs)):
+                row += [f"{mag[out, index]:.3f}", f"{phase[out, index]:.2f}"]
+            writer.writerow(row)
+
+def export_png(path, freqs, response, inputs=(0, 1), title=""):
+    """Plot magnitude/phase of each active output (requires matplotlib)."""
+    # pylint: disable=import-outside-toplevel
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import pyplot
+
+    mono = mono_response(response, inputs)
+    fig, (ax_mag, ax_phase) = pyplot.subplots(2, 1, sharex=True,
+                                              figsize=(10, 7))
+    for out in active_outputs(mono):
+        ax_mag.semilogx(freqs, magnitude_db(mono[out]), label=f"out {out}")
+        ax_phase.semilogx(freqs, np.degrees(np.angle(mono[out])))
+    ax_mag.semilogx(freqs, magnitude_db(np.sum(mono, axis=0)), 'k--',
+                    label="sum")
+    ax_mag.set_ylim(-40, 15)
+    ax_mag.set_ylabel("dB")
+    ax_mag.legend()
+    ax_mag.grid(True, which='both')
+    ax_phase.set_ylabel("degrees")
+    ax_phase.set_xlabel("Hz")
+    ax_phase.grid(True, which='both')
+    ax_mag.set_title(title)
+    fig.savefig(path)
+    pyplot.close(fig)
+
+def display_summary(config, points=128, inputs=(0, 1)):
+    """Magnitude (dB, rounded) of each active output on a coarse grid, plus
+    their sum - small enough to be stored in redis and drawn on the display.
+    """
+    samplerate = config['devices']['samplerate']
+    freqs = log_freqs(samplerate, points, fmin=20)
+    mono = mono_response(FrequencyResponse(samplerate, freqs).compute(config),
+                         inputs)
+    return {
+            'freqs': np.round(freqs).tolist(),
+            'outputs': {str(out): np.round(magnitude_db(mono[out]), 1).tolist()
+                        for out in active_outputs(mono)},
+            'sum': np.round(magnitude_db(np.sum(mono, axis=0)), 1).tolist(),
+            }
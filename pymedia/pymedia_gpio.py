@@ -4,65 +4,139 @@
 # pylint: disable=missing-class-docstring
 # pylint: disable=missing-function-docstring
 
-import time
+import os
+import select
 import threading
-import gpiod
+import time
+from datetime import timedelta
+
 import pymedia_logger
+from pymedia_buffer_event import SCHEDULER
+from pymedia_utils import sd_notify
 
 # ---------------------
 
-DEBOUNCE_DELAY = 0.02
+DEBOUNCE_DELAY = 0.02       # seconds - kernel debounce period of buttons
 HELD_TIME = 2
+GPIO_EVENT_BUFFER = 64      # edge events buffered by the kernel/read at once
+# edge event timestamps clock; "HTE" (hardware timestamp engine) if supported
+# by the SoC/kernel
+GPIO_EVENT_CLOCK = "MONOTONIC"
+# use the simulated backend (see pymedia_gpio_sim) if set
+GPIO_SIM = bool(os.environ.get("PYMEDIA_GPIO_SIM"))
+
+# ---------------------
+
+# pylint: disable=wrong-import-position,wrong-import-order
+if GPIO_SIM:
+    import pymedia_gpio_sim as gpiod
+    from pymedia_gpio_sim import Clock, Direction, Edge, Value
+else:
+    import gpiod
+    from gpiod.line import Clock, Direction, Edge, Value
 
 # ----------------
 
+def open_chip(path):
+    """Open a gpio chip (eg. /dev/gpiochip0) - real or simulated."""
+    return gpiod.Chip(path)
+
+def chip_name(gpiochip):
+    return gpiochip.get_info().name
+
+def is_rising(event):
+    return event.event_type == gpiod.EdgeEvent.Type.RISING_EDGE
+
+def is_active(value):
+    return value == Value.ACTIVE
+
+def line_settings(**kwargs):
+    """Input settings for edge events (both edges)."""
+    return gpiod.LineSettings(direction=Direction.INPUT,
+                              edge_detection=Edge.BOTH,
+                              event_clock=getattr(Clock, GPIO_EVENT_CLOCK),
+                              **kwargs)
+
+
+class GpioEventLoop():
+    """Serve the edge events of any number of inputs (buttons, rotary
+    encoders, on any chip) from a single epoll loop - the number of threads
+    doesn't depend on the number of inputs.
+
+    Inputs provide a line request (request) and process_events(events), run
+    with the edge events read in bulk from the request. process_events is run
+    from the loop, so (like callbacks) it should be short; timers (eg. "held"
+    buttons) run on the shared scheduler (pymedia_buffer_event.SCHEDULER).
+    """
+    def __init__(self):
+        self._log = pymedia_logger.get_logger(__class__.__name__)
+        self._epoll = select.epoll()
+        self._inputs = {}
+
+    def add(self, gpio_input):
+        fd = gpio_input.request.fd
+        self._inputs[fd] = gpio_input
+        self._epoll.register(fd, select.EPOLLIN)
+        return gpio_input
+
+    def run(self):
+        """Loop - wait for and dispatch edge events.
+
+        Blocking - should be run in a thread if the caller does other things.
+        """
+        sd_notify()
+        try:
+            while True:
+                for fd, _ in self._epoll.poll():
+                    gpio_input = self._inputs[fd]
+                    events = gpio_input.request.read_edge_events(
+                            GPIO_EVENT_BUFFER)
+                    try:
+                        gpio_input.process_events(events)
+                    except Exception as ex:     # pylint: disable=broad-except
+                        self._log.exception("%s: %s", gpio_input, ex)
+        except KeyboardInterrupt:
+            return
+
+
 class GpioBase():
-    """Generic libgpiod class."""
-    def __init__(self,
-                 gpiochip,
-                 pin,
-                 gpio_type,
-                 consumer,
-                 default_value=0,
-                 pullup=False,
-                 ):
+    """Generic libgpiod (v2 API) class - a single line request."""
+    def __init__(self, gpiochip, pin, settings, consumer):
         self._log = pymedia_logger.get_logger(__class__.__name__,
-                                              f"[{gpiochip.name()}:{pin}]")
+                                              f"[{chip_name(gpiochip)}:{pin}]")
         self._log.debug("Initializing")
+        self._pin = pin
+        self._active_low = settings.active_low
 
         try:
-            self._line = gpiochip.get_line(pin)
-
-            if gpio_type == gpiod.LINE_REQ_DIR_OUT:
-                self._line.request(consumer=consumer, type=gpio_type,
-                                   default_val=default_value)
-            else:
-                self._line.request(consumer=consumer, type=gpio_type)
-                if default_value:
-                    self._log.warning("Not setting default_val for inputs")
-
-            self._line.get_value()  # make sure this works
+            self.request = gpiochip.request_lines(
+                    config={pin: settings}, consumer=consumer,
+                    event_buffer_size=GPIO_EVENT_BUFFER)
+            self.request.get_value(pin)     # make sure this works
         except Exception as ex:
             self._log.error(ex)
             raise SystemExit from ex
 
-        self._pullup = pullup
-
     def get_value(self):
-        """Get current value, unmodified."""
+        """Get current (physical) value, unmodified."""
+        return int(self.get_bool_state() ^ self._active_low)
+
+    def get_bool_state(self):
+        """Get current digital state (boolean), inversed if pullup=True."""
         try:
-            return self._line.get_value()
+            return is_active(self.request.get_value(self._pin))
         except Exception as ex:
             self._log.error(ex)
             raise SystemExit from ex
 
-    def get_bool_state(self):
-        """Get current digital state (boolean), inversed if pullup=True."""
-        return bool(self.get_value()) ^ self._pullup
-
 
 class DigitalInputPinEvent(GpioBase):
-    """Event/interrupt based digital input class."""
+    """Event/interrupt based digital input class - see GpioEventLoop.
+
+    Debounced by the kernel (debounce_delay). With cb_held, cb_pressed is run
+    when the input is released before held_time; otherwise when it's
+    activated. cb_held is run from the shared scheduler thread.
+    """
     def __init__(self,
                  gpiochip,
                  pin,
@@ -75,11 +149,15 @@ class DigitalInputPinEvent(GpioBase):
                  held_time=HELD_TIME,
                  consumer="pymedia"
                  ):
-        super().__init__(gpiochip, pin, gpiod.LINE_REQ_EV_BOTH_EDGES, consumer,
-                         pullup=pullup)
+        # with a pull up, the line is active low ('1' at rest)
+        super().__init__(gpiochip, pin,
+                         line_settings(active_low=pullup,
+                                       debounce_period=timedelta(
+                                           seconds=debounce_delay)),
+                         consumer)
 
         self._log = pymedia_logger.get_logger(__class__.__name__,
-                                              f"[{gpiochip.name()}:{pin}]")
+                                              f"[{chip_name(gpiochip)}:{pin}]")
         if not cb_pressed and not cb_held:
             raise Exception("no pressed/held callback defined !")
 
@@ -89,129 +167,77 @@ class DigitalInputPinEvent(GpioBase):
         self._cb_held_args = cb_held_args
 
         self._held_time = held_time
-
-        self.th_wait = threading.Thread(target=self._wait_input,
-                                        args=(debounce_delay,))
-        self.th_wait.daemon = True
-        self._cb_held_thread_ev = threading.Event()
-
-        self._cb_held_complete = False
-
-    def _run_cb_held_timer(self):
-        """Start a "input held" callback timer."""
+        self._held_lock = threading.Lock()
+        self._held_timer = None
         self._cb_held_complete = False
-        cancel = self._cb_held_thread_ev.wait(self._held_time)
-        # run callback if the task wasn't "cancelled" ; the input shouldn't be
-        # released by the time the timer expires
-        if self.get_bool_state() and not cancel:
-            self._log.debug("running callback_held")
+        self._active = self.get_bool_state()
+
+    def _run_cb_held(self):
+        """"input held" timer expired (run by the scheduler)."""
+        with self._held_lock:
+            if self._held_timer is None:
+                self._log.debug("input was released while waiting - won't"
+                                " run callback")
+                return
+            self._held_timer = None
             self._cb_held_complete = True
-            self._cb_held(*self._cb_held_args)
-        else:
-            self._log.debug("input was released while waiting or thread was"
-                          " cancelled - won't run callback")
-
-    def _wait_input(self, debounce_delay):
-        """Loop / run callbacks on pin change (interrupt based).
-
-        Blocking - should be run in a thread.
-        """
-        last_valid_event_time = 0
-        last_event = None
-
-        cb_pressed_thread = None
-        cb_held_thread = None
-
-        while True:
-            ev_line = self._line.event_wait(sec=1)
-            if not ev_line:
-                continue
-
-            event = self._line.event_read()
-
-            # with a pull down, falling edge->0, rising->1 (ie. '0' at rest)
-            # values are reversed with a pull up (ie. '1' at rest)
-            if event.type == gpiod.LineEvent.FALLING_EDGE:
-                activated = False ^ self._pullup
-                self._log.debug("Falling Edge")
-            elif event.type == gpiod.LineEvent.RISING_EDGE:
-                activated = True ^ self._pullup
-                self._log.debug("Rising Edge")
-            else:
-                raise TypeError('Invalid event type')
-
-            # it shouldn't be possible to receive two consecutive event types
-            # (eg. "Falling edge" then "Falling edge" again) yet this often
-            # happens. HW or SW bug ?
-            if last_event == event.type:
+        self._log.debug("running callback_held")
+        self._cb_held(*self._cb_held_args)
+
+    def process_events(self, events):
+        for event in events:
+            activated = is_rising(event)
+            # shouldn't happen with kernel debouncing, but two consecutive
+            # event types were often received with software debouncing
+            if activated == self._active:
                 self._log.debug("Last event type was repeated - skipping")
                 continue
-            last_event = event.type
-
-            if time.time() - last_valid_event_time < debounce_delay:
-                self._log.debug("button event within %ss - ignoring",
-                             debounce_delay)
-                continue
-            last_valid_event_time = time.time()
-
-            run_cb_pressed = False
-            run_cb_held = False
+            self._active = activated
 
             if activated:
                 self._log.debug("input activated")
                 if self._cb_held:
-                    if cb_held_thread and cb_held_thread.is_alive():
-                        self._log.debug("cb_held thread already started -"
-                                      "bounce ?")
-                        continue
-                    run_cb_held = True
+                    with self._held_lock:
+                        self._cb_held_complete = False
+                        self._held_timer = SCHEDULER.call_later(
+                                self._held_time, self._run_cb_held)
                 elif self._cb_pressed:
-                    run_cb_pressed = True
+                    self._cb_pressed(*self._cb_pressed_args)
+                continue
 
-            else:
-                self._log.debug("input deactivated")
-                # cancel a cb_held task if running
-                if self._cb_held:
-                    if cb_held_thread and cb_held_thread.is_alive():
-                        self._log.debug("Cancelling cb_held thread")
-                        self._cb_held_thread_ev.set()
-                        self._cb_held_thread_ev.clear()
-
-                    if self._cb_pressed and not self._cb_held_complete:
-                        if cb_pressed_thread and cb_pressed_thread.is_alive():
-                            self._log.debug("cb_pressed thread already started")
-                        else:
-                            run_cb_pressed = True
-
-            if run_cb_pressed:
-                self._log.debug("Starting cb_pressed thread")
-                cb_pressed_thread = threading.Thread(target=self._cb_pressed,
-                                                     args=self._cb_pressed_args)
-                cb_pressed_thread.daemon = True
-                cb_pressed_thread.start()
-
-            if run_cb_held:
-                self._log.debug("Starting cb_held timer thread")
-                cb_held_thread = threading.Thread(
-                        target=self._run_cb_held_timer)
-                cb_held_thread.daemon = True
-                cb_held_thread.start()
+            self._log.debug("input deactivated")
+            if self._cb_held:
+                # cancel the cb_held timer if pending
+                with self._held_lock:
+                    if self._held_timer is not None:
+                        self._log.debug("Cancelling cb_held timer")
+                        SCHEDULER.cancel(self._held_timer)
+                        self._held_timer = None
+                    held_complete = self._cb_held_complete
+                if self._cb_pressed and not held_complete:
+                    self._log.debug("running callback_pressed")
+                    self._cb_pressed(*self._cb_pressed_args)
 
 
 class DigitalOutputPin(GpioBase):
     """Digital output class."""
     def __init__(self, gpiochip, pin, default_value=0,
                  consumer="pymedia"):
-        super().__init__(gpiochip, pin, gpiod.LINE_REQ_DIR_OUT, consumer,
-                         default_value=default_value)
+        super().__init__(gpiochip, pin,
+                         gpiod.LineSettings(
+                             direction=Direction.OUTPUT,
+                             output_value=(Value.ACTIVE if default_value
+                                           else Value.INACTIVE)),
+                         consumer)
 
         self._log = pymedia_logger.get_logger(__class__.__name__,
-                                              f"[{gpiochip.name()}:{pin}]")
+                                              f"[{chip_name(gpiochip)}:{pin}]")
 
     def set_value(self, value):
         """Set digital output."""
         try:
-            self._line.set_value(value)
+            self.request.set_value(self._pin,
+                                   Value.ACTIVE if value else Value.INACTIVE)
         except Exception as ex:
             self._log.error("Error: %s", ex)
             raise SystemExit from ex
@@ -0,0 +1,355 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+# Simulated libgpiod (v2 API) backend: the subset of gpiod used by pymedia_gpio
+# and pymedia_rotary_encoder (Chip, line requests with edge detection, kernel
+# debouncing and event buffers, active_low, outputs) on simulated chips, whose
+# input levels are driven with set_level() or replay() - see
+# tools/gpio_sim.py. Used instead of gpiod when PYMEDIA_GPIO_SIM is set.
+
+import collections
+import enum
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+import pymedia_logger
+from pymedia_buffer_event import SCHEDULER
+
+# ---------------------
+
+SIM_NUM_LINES = 32
+SIM_EVENT_BUFFER = 16           # per line, like the kernel default
+SIM_SPIN_TIME = 0.001           # seconds - replay() busy waits the last ms
+
+# ---------------------
+
+class Direction(enum.Enum):
+    AS_IS = 1
+    INPUT = 2
+    OUTPUT = 3
+
+class Edge(enum.Enum):
+    NONE = 1
+    RISING = 2
+    FALLING = 3
+    BOTH = 4
+
+class Bias(enum.Enum):
+    AS_IS = 1
+    UNKNOWN = 2
+    DISABLED = 3
+    PULL_UP = 4
+    PULL_DOWN = 5
+
+class Clock(enum.Enum):
+    MONOTONIC = 1
+    REALTIME = 2
+    HTE = 3
+
+class Value(enum.Enum):
+    INACTIVE = 0
+    ACTIVE = 1
+
+
+@dataclass
+class LineSettings:
+    direction: Direction = Direction.AS_IS
+    edge_detection: Edge = Edge.NONE
+    bias: Bias = Bias.AS_IS
+    active_low: bool = False
+    debounce_period: timedelta = timedelta()
+    event_clock: Clock = Clock.MONOTONIC
+    output_value: Value = Value.INACTIVE
+
+
+@dataclass
+class EdgeEvent:
+    class Type(enum.Enum):
+        RISING_EDGE = 1
+        FALLING_EDGE = 2
+
+    event_type: Type
+    timestamp_ns: int
+    line_offset: int
+    global_seqno: int
+    line_seqno: int
+
+
+@dataclass
+class ChipInfo:
+    name: str
+    label: str
+    num_lines: int
+
+
+class _SimChip():
+    """State of a simulated chip: physical line levels and requests."""
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.levels = [0] * SIM_NUM_LINES
+        self.requests = {}      # offset -> LineRequest
+        self.lock = threading.RLock()
+
+    def set_level(self, offset, level, timestamp_ns=None):
+        """Set the physical level of a line (eg. button/encoder contact)."""
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        with self.lock:
+            if self.levels[offset] == level:
+                return
+            self.levels[offset] = level
+            request = self.requests.get(offset)
+        if request is not None:
+            request.line_changed(offset, level, timestamp_ns)
+
+
+_CHIPS = {}
+_CHIPS_LOCK = threading.Lock()
+
+def sim_chip(path):
+    """Return the simulated chip path (created on first use)."""
+    with _CHIPS_LOCK:
+        if path not in _CHIPS:
+            _CHIPS[path] = _SimChip(path)
+        return _CHIPS[path]
+
+def set_level(path, offset, level):
+    sim_chip(path).set_level(offset, level)
+
+
+class Chip():
+    def __init__(self, path):
+        self.path = path
+        self._chip = sim_chip(path)
+
+    def get_info(self):
+        return ChipInfo(self._chip.name, "pymedia-sim", SIM_NUM_LINES)
+
+    def request_lines(self, config, consumer=None, event_buffer_size=None):
+        return LineRequest(self._chip, config, consumer, event_buffer_size)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class LineRequest():
+    """Simulated line request - the edge events are signaled on fd (a pipe)
+    so it can be used with select/epoll like a real request."""
+    def __init__(self, chip, config, consumer, event_buffer_size):
+        self._log = pymedia_logger.get_logger(__class__.__name__,
+                                              f"[{chip.name}]")
+        self._chip = chip
+        self.consumer = consumer
+        self._settings = {}
+        for offsets, settings in config.items():
+            if isinstance(offsets, int):
+                offsets = (offsets,)
+            for offset in offsets:
+                self._settings[offset] = settings or LineSettings()
+        self._buffer_size = (event_buffer_size
+                             or SIM_EVENT_BUFFER * len(self._settings))
+        self._events = collections.deque()
+        self._lock = threading.Lock()
+        self._rfd, self._wfd = os.pipe()
+        os.set_blocking(self._rfd, False)
+        self._debounce_timers = {}
+        self._seqno = 0
+        self._line_seqno = collections.Counter()
+        self.overflows = 0
+
+        with chip.lock:
+            busy = [offset for offset in self._settings
+                    if offset in chip.requests]
+            if busy:
+                raise OSError(f"{chip.name}: lines {busy} are busy")
+            for offset, settings in self._settings.items():
+                chip.requests[offset] = self
+                if settings.direction == Direction.OUTPUT:
+                    chip.levels[offset] = self._level(
+                            offset, settings.output_value)
+        self._reported = {offset: chip.levels[offset]
+                          for offset in self._settings}
+
+    @property
+    def fd(self):
+        return self._rfd
+
+    @property
+    def offsets(self):
+        return list(self._settings)
+
+    def _level(self, offset, value):
+        """Physical level of a (logical) value."""
+        return int(value == Value.ACTIVE) ^ self._settings[offset].active_low
+
+    def get_value(self, offset):
+        level = self._chip.levels[offset] ^ self._settings[offset].active_low
+        return Value.ACTIVE if level else Value.INACTIVE
+
+    def get_values(self, offsets=None):
+        return [self.get_value(offset)
+                for offset in (offsets or self._settings)]
+
+    def set_value(self, offset, value):
+        if self._settings[offset].direction != Direction.OUTPUT:
+            raise OSError(f"line {offset} isn't an output")
+        with self._chip.lock:
+            self._chip.levels[offset] = self._level(offset, value)
+
+    def read_edge_events(self, max_events=None):
+        with self._lock:
+            count = len(self._events)
+            if max_events:
+                count = min(count, max_events)
+            events = [self._events.popleft() for _ in range(count)]
+            if count:
+                os.read(self._rfd, count)
+        return events
+
+    def line_changed(self, offset, level, timestamp_ns):
+        """The physical level of a line changed (run by _SimChip)."""
+        settings = self._settings[offset]
+        if settings.edge_detection == Edge.NONE:
+            return
+        debounce = settings.debounce_period.total_seconds()
+        if not debounce:
+            self._edge(offset, level, timestamp_ns)
+            return
+        # like the kernel: report the level once it's been stable for the
+        # debounce period (so the event is delayed by the debounce period)
+        with self._lock:
+            timer = self._debounce_timers.get(offset)
+            if timer is not None:
+                SCHEDULER.cancel(timer)
+            self._debounce_timers[offset] = SCHEDULER.call_later(
+                    debounce, self._debounced, offset)
+
+    def _debounced(self, offset):
+        with self._lock:
+            self._debounce_timers.pop(offset, None)
+        self._edge(offset, self._chip.levels[offset], time.monotonic_ns())
+
+    def _edge(self, offset, level, timestamp_ns):
+        settings = self._settings[offset]
+        with self._lock:
+            if level == self._reported[offset]:
+                return
+            self._reported[offset] = level
+            rising = bool(level ^ settings.active_low)
+            if settings.edge_detection == (Edge.FALLING if rising
+                                           else Edge.RISING):
+                return
+            self._seqno += 1
+            self._line_seqno[offset] += 1
+            self._events.append(EdgeEvent(
+                    EdgeEvent.Type.RISING_EDGE if rising
+                    else EdgeEvent.Type.FALLING_EDGE,
+                    timestamp_ns, offset, self._seqno,
+                    self._line_seqno[offset]))
+            if len(self._events) > self._buffer_size:
+                # the kernel drops the oldest event; the fd is already
+                # readable
+                self._events.popleft()
+                self.overflows += 1
+                self._log.warning("event buffer overflow (line %d)", offset)
+                return
+            os.write(self._wfd, b'\0')
+
+    def release(self):
+        with self._chip.lock:
+            for offset in self._settings:
+                self._chip.requests.pop(offset, None)
+        os.close(self._rfd)
+        os.close(self._wfd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+# ---------------------
+
+# edge sequences: lists of (time in seconds, offset, level) tuples
+
+def _wait_until(deadline):
+    remaining = deadline - time.monotonic()
+    if remaining > SIM_SPIN_TIME:
+        time.sleep(remaining - SIM_SPIN_TIME)
+    while time.monotonic() < deadline:
+        pass
+
+def replay(path, sequence, start=None):
+    """Drive the lines of the simulated chip path with an edge sequence,
+    times relative to start (monotonic, default: now).
+
+    Blocking; return start.
+    """
+    chip = sim_chip(path)
+    if start is None:
+        start = time.monotonic()
+    for timestamp, offset, level in sorted(sequence, key=lambda e: e[0]):
+        _wait_until(start + timestamp)
+        chip.set_level(offset, level)
+    return start
+
+def load_sequence(path):
+    """Read an edge sequence file: 'time offset level' lines (see
+    tools/gpio_sim.py record)."""
+    sequence = []
+    with open(path, encoding="ascii") as seq_file:
+        for line in seq_file:
+            line = line.split('#')[0].split()
+            if line:
+                sequence.append((float(line[0]), int(line[1]), int(line[2])))
+    return sequence
+
+def bounce(timestamp, offset, level, bounces=0, bounce_time=0.002, rng=random):
+    """Transition to level at timestamp, with bounces (extra back and forth
+    transitions) within bounce_time."""
+    times = sorted(timestamp + rng.uniform(0, bounce_time)
+                   for _ in range(2 * bounces))
+    sequence = [(timestamp, offset, level)]
+    for index, bounce_timestamp in enumerate(times):
+        sequence.append((bounce_timestamp, offset,
+                         level if index % 2 else 1 - level))
+    return sequence
+
+def button_press(offset, start, duration, active_low=False, bounces=0,
+                 bounce_time=0.002, rng=random):
+    """A button press (and release) with bounces."""
+    pressed = 0 if active_low else 1
+    return (bounce(start, offset, pressed, bounces, bounce_time, rng)
+            + bounce(start + duration, offset, 1 - pressed, bounces,
+                     bounce_time, rng))
+
+def encoder_turn(pin1, pin2, start, detents, rate, bounces=0,
+                 bounce_time=0.0005, rng=random):
+    """Quadrature sequence of a (full step, resting at 11) rotary encoder:
+    detents (negative: counter clockwise) at rate detents/s.
+
+    CW: pin1 falls, pin2 falls, pin1 rises, pin2 rises. Bounces are added on
+    each transition (Gray code: only one pin changes at a time).
+    """
+    first, second = (pin1, pin2) if detents > 0 else (pin2, pin1)
+    period = 1 / rate
+    sequence = []
+    for detent in range(abs(detents)):
+        detent_start = start + detent * period
+        for step, (pin, level) in enumerate(((first, 0), (second, 0),
+                                             (first, 1), (second, 1))):
+            sequence += bounce(detent_start + step * period / 4, pin, level,
+                               bounces, min(bounce_time, period / 8), rng)
+    return sequence
@@ -0,0 +1,196 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import pymedia_logger
+from pymedia_utils import lazy_import
+
+# imported on first use - see lazy_import()
+board = lazy_import("board")
+busio = lazy_import("busio")
+adafruit_ssd1306 = lazy_import("adafruit_ssd1306")
+np = lazy_import("numpy")
+
+# ---------------------
+
+# transfer priorities (lower runs first)
+I2C_PRIORITY_HIGH = 0       # eg. volume/mute feedback
+I2C_PRIORITY_NORMAL = 1     # eg. live meter frames
+I2C_PRIORITY_LOW = 2        # eg. secondary/status displays
+
+I2C_SLOW_JOB_WAIT = 0.05    # seconds - log jobs that waited longer
+
+# ssd1306 commands
+SSD1306_SET_COL_ADDR = 0x21
+SSD1306_SET_PAGE_ADDR = 0x22
+SSD1306_SET_VCOM_DESEL = 0xDB
+
+# ---------------------
+
+class I2cBus():
+    """Serialize and prioritize transfers on a shared i2c bus.
+
+    A single thread owns the bus (busio isn't thread safe) and runs the queued
+    jobs by priority, FIFO within a priority. Large transfers should be split
+    into several jobs (eg. one per display page) so that higher priority jobs
+    don't wait for a whole transfer to complete.
+    """
+    def __init__(self, scl='SCL', sda='SDA'):
+        self._log = pymedia_logger.get_logger(__class__.__name__)
+        self._scl = scl
+        self._sda = sda
+        self._i2c = None
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def i2c(self):
+        """Return the busio.I2C instance - only call from a bus job."""
+        if self._i2c is None:
+            self._log.debug("initializing i2c bus (%s/%s)", self._scl,
+                            self._sda)
+            self._i2c = busio.I2C(getattr(board, self._scl),
+                                  getattr(board, self._sda))
+        return self._i2c
+
+    def submit(self, priority, func, *args):
+        """Queue func(*args) to run on the bus thread; return a Future."""
+        future = Future()
+        self._queue.put((priority, next(self._seq), time.monotonic(), future,
+                         func, args))
+        return future
+
+    def call(self, priority, func, *args):
+        """Run func(*args) on the bus thread and return its result."""
+        return self.submit(priority, func, *args).result()
+
+    def _run(self):
+        while True:
+            priority, _, queued, future, func, args = self._queue.get()
+            wait = time.monotonic() - queued
+            if wait > I2C_SLOW_JOB_WAIT:
+                self._log.debug("%s() waited %.3fs (priority %d)",
+                                func.__name__, wait, priority)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args))
+            except Exception as ex:     # pylint: disable=broad-except
+                self._log.error("%s(): %s", func.__name__, ex)
+                future.set_exception(ex)
+
+
+class Ssd1306Panel():
+    """A SSD1306 display on a shared I2cBus, with its own frame cache.
+
+    Frames are sent page by page (8 pixel rows), and only the pages that have
+    changed since they were last sent; page transfers are queued on the bus
+    with the panel priority. A page that is already queued isn't queued again:
+    the latest frame content is sent when the job runs.
+    """
+    def __init__(self, bus, address, width=128, height=64,
+                 priority=I2C_PRIORITY_NORMAL, contrast=0, name=""):
+        self._log = pymedia_logger.get_logger(__class__.__name__,
+                                              f"[{name or hex(address)}]")
+        self.name = name
+        self.width = width
+        self.height = height
+        self.priority = priority
+        self._bus = bus
+        self._address = address
+        self._contrast = contrast
+        self._disp = None
+        self._lock = threading.Lock()
+        self._nb_pages = height // 8
+        self._frame = [bytes(width)] * self._nb_pages
+        self._sent = [None] * self._nb_pages   # None: unknown content
+        self._pending = set()
+
+    def _device(self):
+        """Return the ssd1306 device, initialized on first use (bus thread)."""
+        if self._disp is None:
+            self._log.debug("initializing display")
+            self._disp = adafruit_ssd1306.SSD1306_I2C(
+                    self.width, self.height, self._bus.i2c(),
+                    addr=self._address)
+            self._disp.contrast(self._contrast)
+            # init clears the display RAM
+            self._sent = [bytes(self.width)] * self._nb_pages
+        return self._disp
+
+    def to_pages(self, image):
+        """Convert a mode '1' PIL image to ssd1306 pages (list of bytes).
+
+        Each page byte is a column of 8 pixels, LSB at the top.
+        """
+        pixels = np.asarray(image, dtype=bool).reshape(
+                self._nb_pages, 8, self.width)
+        pages = np.packbits(pixels.transpose(0, 2, 1), axis=2,
+                            bitorder='little')
+        return [page.tobytes() for page in pages]
+
+    def show(self, image, priority=None):
+        """Queue the transfer of the pages that changed; return the futures."""
+        return self.show_pages(self.to_pages(image), priority)
+
+    def blank(self, priority=None):
+        return self.show_pages([bytes(self.width)] * self._nb_pages, priority)
+
+    def show_pages(self, pages, priority=None):
+        if priority is None:
+            priority = self.priority
+        with self._lock:
+            self._frame = pages
+            changed = [index for index, page in enumerate(pages)
+                       if page != self._sent[index]
+                       and index not in self._pending]
+            self._pending.update(changed)
+        if changed:
+            self._log.debug("queuing pages %s (priority %d)", changed,
+                            priority)
+        return [self._bus.submit(priority, self._send_page, index)
+                for index in changed]
+
+    def _send_page(self, index):
+        disp = self._device()
+        with self._lock:
+            self._pending.discard(index)
+            data = self._frame[index]
+            if data == self._sent[index]:
+                return
+            self._sent[index] = data
+        try:
+            for cmd in (SSD1306_SET_COL_ADDR, 0, self.width - 1,
+                        SSD1306_SET_PAGE_ADDR, index, index):
+                disp.write_cmd(cmd)
+            with disp.i2c_device:
+                disp.i2c_device.write(b'\x40' + data)
+        except Exception:
+            # not sent: the page is sent again with the next frame
+            with self._lock:
+                if self._sent[index] is data:
+                    self._sent[index] = None
+            raise
+
+    def set_power(self, power, contrast, vcomh):
+        """Queue power on/off and contrast changes (high priority)."""
+        return self._bus.submit(I2C_PRIORITY_HIGH, self._set_power, power,
+                                contrast, vcomh)
+
+    def _set_power(self, power, contrast, vcomh):
+        disp = self._device()
+        if not power:
+            disp.poweroff()
+            return
+        disp.poweron()
+        disp.contrast(contrast)
+        disp.write_cmd(SSD1306_SET_VCOM_DESEL)
+        disp.write_cmd(vcomh)
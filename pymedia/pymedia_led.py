@@ -0,0 +1,235 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+import math
+import os
+import threading
+import time
+
+import redis
+
+import pymedia_logger
+from pymedia_buffer_event import SCHEDULER
+from pymedia_cdsp import redis_cdsp_ping
+
+# ---------------------
+
+# led patterns - rendered by hardware PWM (PwmOutput) or switched on/off
+# (GpioOutput: levels >= 0.5 are "on", breathe becomes a slow blink)
+LED_PATTERNS = {
+    'off': {'type': 'solid', 'level': 0},
+    'on': {'type': 'solid', 'level': 1},
+    'blink': {'type': 'blink', 'on': 0.2, 'off': 4},
+    'mute': {'type': 'blink', 'on': 0.6, 'off': 0.6},
+    'breathe': {'type': 'breathe', 'period': 4, 'min': 0.02},
+    # played once: one flash per config index (1 based), then the state
+    # pattern is restored
+    'flash': {'type': 'flash', 'on': 0.15, 'off': 0.3, 'pause': 0.8},
+}
+
+# CamillaDSP state -> pattern
+LED_STATES = {
+    'off': 'blink',
+    'standby': 'breathe',
+    'muted': 'mute',
+    'on': 'on',
+}
+
+LED_PWM_FREQUENCY = 1000    # Hz
+LED_PWM_STEP = 0.05         # seconds - breathe update interval
+LED_GAMMA = 2.2             # perceived brightness
+# CamillaDSP is considered off when CDSP:last_alive is older (must be greater
+# than the update interval in standby - see pymedia_cdsp)
+LED_ALIVE_MAX_AGE = 40      # seconds
+LED_PUBSUBS = ('CDSP:EVENT',)
+
+# ---------------------
+
+def render(pattern, pwm, count=1):
+    """Return the (level, duration) steps of a pattern; the last duration of
+    solid patterns is None."""
+    kind = pattern['type']
+    if kind == 'solid':
+        return [(pattern['level'], None)]
+    if kind == 'blink':
+        return [(1, pattern['on']), (0, pattern['off'])]
+    if kind == 'breathe':
+        if not pwm:
+            return [(1, pattern['period'] / 2), (0, pattern['period'] / 2)]
+        nb_steps = max(2, round(pattern['period'] / LED_PWM_STEP))
+        return [(pattern['min'] + (1 - pattern['min'])
+                 * (0.5 - 0.5 * math.cos(2 * math.pi * step / nb_steps))
+                 ** LED_GAMMA, pattern['period'] / nb_steps)
+                for step in range(nb_steps)]
+    if kind == 'flash':
+        return ([(1, pattern['on']), (0, pattern['off'])] * count
+                + [(0, pattern['pause'])])
+    raise ValueError(f"unknown led pattern type '{kind}'")
+
+
+class GpioOutput():
+    """Led on a digital output (eg. pymedia_gpio.DigitalOutputPin)."""
+    pwm = False
+
+    def __init__(self, pin):
+        self._pin = pin
+
+    def set(self, level):
+        self._pin.set_value(int(level >= 0.5))
+
+
+class PwmOutput():
+    """Led on a hardware PWM channel (sysfs)."""
+    pwm = True
+
+    def __init__(self, chip, channel, frequency=LED_PWM_FREQUENCY):
+        path = f"/sys/class/pwm/pwmchip{chip}"
+        self._path = f"{path}/pwm{channel}"
+        if not os.path.isdir(self._path):
+            self._write(f"{path}/export", channel)
+        self._period = int(1e9 / frequency)
+        self._write(f"{self._path}/duty_cycle", 0)
+        self._write(f"{self._path}/period", self._period)
+        self._write(f"{self._path}/enable", 1)
+        # kept open - updated every LED_PWM_STEP when breathing
+        # pylint: disable=consider-using-with
+        self._duty_cycle = open(f"{self._path}/duty_cycle", "w",
+                                encoding="ascii")
+
+    @staticmethod
+    def _write(path, value):
+        with open(path, "w", encoding="ascii") as sysfs:
+            sysfs.write(str(value))
+
+    def set(self, level):
+        self._duty_cycle.seek(0)
+        self._duty_cycle.write(str(int(level * self._period)))
+        self._duty_cycle.flush()
+
+
+class Led():
+    """Play patterns on a led output - timed by the shared scheduler, so any
+    number of leds adds no threads."""
+    def __init__(self, output, label=""):
+        self._log = pymedia_logger.get_logger(__class__.__name__, label)
+        self._output = output
+        self._lock = threading.Lock()
+        self._pattern = None
+        self._steps = []
+        self._step = 0
+        self._once = False
+        self._timer = None
+
+    def set_pattern(self, name):
+        """Play pattern name (repeated) - right away, unless a one-shot
+        pattern is playing (it's played when it ends)."""
+        with self._lock:
+            self._pattern = name
+            if not self._once:
+                self._play(render(LED_PATTERNS[name], self._output.pwm))
+
+    def flash(self, count):
+        """Flash count times (eg. config index), then restore the pattern."""
+        with self._lock:
+            self._once = True
+            self._play(render(LED_PATTERNS['flash'], self._output.pwm, count))
+
+    def _play(self, steps):
+        self._log.debug("playing %d steps", len(steps))
+        if self._timer is not None:
+            SCHEDULER.cancel(self._timer)
+        self._steps = steps
+        self._step = 0
+        self._apply()
+
+    def _apply(self):
+        level, duration = self._steps[self._step]
+        self._output.set(level)
+        self._timer = (SCHEDULER.call_later(duration, self._next)
+                       if duration is not None else None)
+
+    def _next(self):
+        with self._lock:
+            self._step += 1
+            if self._step < len(self._steps):
+                self._apply()
+            elif self._once:
+                self._once = False
+                self._play(render(LED_PATTERNS[self._pattern or 'off'],
+                                  self._output.pwm))
+            else:
+                self._step = 0
+                self._apply()
+
+
+class StatusLeds():
+    """Show CamillaDSP status (off/standby/muted/on, config index flash code)
+    on leds, driven by CDSP events - plus a liveness deadline (last_alive +
+    LED_ALIVE_MAX_AGE) to notice a crashed cdsp.py without polling.
+    """
+    def __init__(self, _redis, leds):
+        self._log = pymedia_logger.get_logger(__class__.__name__)
+        self._redis = _redis
+        self._leds = leds
+        self._lock = threading.Lock()
+        self._state = None
+        self._config_index = None
+        self._alive_timer = None
+
+    def state(self):
+        if not redis_cdsp_ping(self._redis, max_age=LED_ALIVE_MAX_AGE):
+            return 'off'
+        if self._redis.get_s("CDSP:standby"):
+            return 'standby'
+        if self._redis.get_s("CDSP:mute"):
+            return 'muted'
+        return 'on'
+
+    def update(self):
+        """Re-evaluate the state (after an event or the liveness deadline)."""
+        with self._lock:
+            state = self.state()
+            if state != self._state:
+                self._log.info("state: %s", state)
+                self._state = state
+                for led in self._leds:
+                    led.set_pattern(LED_STATES[state])
+
+            config_index = (self._redis.get_s("CDSP:config_index")
+                            if state != 'off' else None)
+            if (config_index is not None and self._config_index is not None
+                    and config_index != self._config_index):
+                for led in self._leds:
+                    led.flash(config_index + 1)
+            if config_index is not None:
+                self._config_index = config_index
+
+            if self._alive_timer is not None:
+                SCHEDULER.cancel(self._alive_timer)
+                self._alive_timer = None
+            if state != 'off':
+                last_alive = self._redis.get_s("CDSP:last_alive") or 0
+                self._alive_timer = SCHEDULER.call_later(
+                        max(last_alive + LED_ALIVE_MAX_AGE - time.time(), 0)
+                        + 0.1, self.update)
+
+    def wait_events(self):
+        """Wait for redis events and update the leds on each event (blocking
+        - no timeout/polling)."""
+        pubsub = self._redis.redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(LED_PUBSUBS)
+        except redis.exceptions.RedisError as ex:
+            self._log.error(ex)
+            raise SystemExit from ex
+        self.update()
+        try:
+            for message in pubsub.listen():
+                if message['type'] != 'message':
+                    continue
+                self._log.debug("received message %s", message)
+                self.update()
+        except redis.exceptions.RedisError as ex:
+            self._log.error(ex)
+            raise SystemExit from ex
@@ -2,51 +2,254 @@
 # pylint: disable=missing-class-docstring
 # pylint: disable=missing-function-docstring
 
+import datetime
+import json
+import threading
 import time
 
-# LMS
-import requests
-import lmsquery
-
 import pymedia_logger
-from pymedia_utils import SimpleThreads
+from pymedia_utils import SimpleThreads, lazy_import
 from pymedia_cdsp import redis_cdsp_ping
+from pymedia_lms_cli import LMS_CLI_PORT, CliClient, CliNotConnected
+from pymedia_volsync import VolumeSync, parse_version
+
+# LMS (imported on first use)
+requests = lazy_import("requests")
+lmsquery = lazy_import("lmsquery")
+
+# ---------------------
+
+LMS_ALARM_WARM_UP = 5               # seconds - get CDSP ready before an alarm
+LMS_ALARM_CHECK_INTERVAL = 600      # seconds - re-compute the next alarm
+LMS_ALARM_RETRY_INTERVAL = 60       # seconds - retry querying the alarms
+# the player stats are updated from LMS events (see monitor_lms_events.py);
+# the status is only queried to reconcile them, at these intervals
+LMS_RECONCILE_INTERVAL = 60         # seconds
+LMS_STANDBY_UPDATE_INTERVAL = 300   # seconds - same, CDSP in standby
+# player status query: current track only, with artist (a), album (l),
+# duration (d) tags - the title is always returned
+LMS_STATUS_QUERY = ("status", "-", 1, "tags:adl")
+# stats updated without sending a 'stats' event (change on every update, or
+# displayed from CDSP events)
+LMS_STATS_NO_EVENT = ('time', 'volume')
+# hash: stat -> time of its last update from an LMS event (written before the
+# stat, see monitor_lms_events.player_stats_delta()): the status query result
+# doesn't overwrite newer stats
+LMS_STATS_UPDATED_KEY = "PLAYER:stats_updated"
+
+# ---------------------
+
+def next_alarm(alarms, after=None):
+    """Return the timestamp of the first alarm in alarms (LMS 'alarms' query
+    'alarms_loop' items) after the datetime after (default: now), or None.
+
+    Unlike LMSQuery.get_next_alarm(), alarms on the following days are taken
+    into account (eg. the next morning alarm, in the evening).
+    """
+    after = after or datetime.datetime.now()
+    midnight = after.replace(hour=0, minute=0, second=0, microsecond=0)
+    next_time = None
+    for alarm in alarms:
+        if str(alarm.get('enabled', 1)) == "0":
+            continue
+        days = str(alarm.get('dow', "")).split(',')
+        for day in range(8):
+            date = midnight + datetime.timedelta(days=day)
+            # LMS: 0 is sunday
+            if str((date.weekday() + 1) % 7) not in days:
+                continue
+            alarm_time = date + datetime.timedelta(seconds=int(alarm['time']))
+            if alarm_time > after:
+                if next_time is None or alarm_time < next_time:
+                    next_time = alarm_time
+                break
+    return next_time.timestamp() if next_time else None
+
+def parse_status(status):
+    """Return the player stats from an LMS 'status' query result
+    (LMS_STATUS_QUERY), or None if the player isn't known/connected.
+
+    sample (abridged):
+    {'player_name': 'juke', 'power': 1, 'mode': 'play', 'mixer volume': 52,
+     'time': 83.2, 'duration': 245.4, 'playlist_loop': [{'title': 'So What',
+     'artist': 'Miles Davis', 'album': 'Kind of Blue', 'duration': 245.4}]}
+    """
+    # a known but disconnected player (eg. squeezelite stopped) still has a
+    # status, with player_connected 0
+    if (not status or 'mode' not in status
+            or not int(status.get('player_connected', 1))):
+        return None
+    track = (status.get('playlist_loop') or [{}])[0]
+    return {
+            'player_name': status.get('player_name', ''),
+            'isplaying': status['mode'] == 'play',
+            'power': bool(int(status.get('power', 0))),
+            'volume': abs(int(float(status.get('mixer volume', 0)))),
+            'artist': track.get('artist', ''),
+            'album': track.get('album', ''),
+            # remote streams without metadata: title in current_title
+            'title': track.get('title') or status.get('current_title', ''),
+            'duration': float(track.get('duration')
+                              or status.get('duration') or 0),
+            'time': float(status.get('time') or 0),
+            }
+
+def is_idempotent(args):
+    """Return True if running the player command args twice is harmless:
+    absolute settings ('mixer volume 50', 'power 1', 'pause 0')."""
+    args = [str(arg) for arg in args]
+    if len(args) == 3 and args[:2] == ["mixer", "volume"]:
+        return args[2][:1] not in "+-"
+    return len(args) == 2 and args[0] in ("power", "pause") and args[1] in (
+            "0", "1")
 
 # ---------------------
 
 # https://github.com/elParaguayo/LMS-CLI-Documentation/blob/master/LMS-CLI.md
 
 class Lms():
-    def __init__(self, server, playerid, _redis, update_interval=10):
+    """LMS player: commands are sent over a persistent CLI connection
+    (cli_port; None: JSON-RPC only), falling back to JSON-RPC (LMSQuery) if
+    it's down (see command()); queries (status, alarms) use JSON-RPC."""
+    def __init__(self, server, playerid, _redis, update_interval=10,
+                 cli_port=LMS_CLI_PORT):
         self._log = pymedia_logger.get_logger(__class__.__name__)
         self._server = server
-        self._lmsquery = lmsquery.LMSQuery(server)
+        self._lmsquery = None   # see lmsq()
+        self._cli = CliClient(server, cli_port) if cli_port else None
         self._playerid = playerid
         self._redis = _redis
+        self._volsync = VolumeSync(_redis, 'lms')
         self._stats = {
                 'player_name' : '',
                 'artist' : '',
+                'album' : '',
                 'title' : '',
                 'isplaying' : False,
                 'power' : False,
+                'volume' : 0,
+                'duration' : 0,
+                'time' : 0,
                 }
+        # alarms cache - refreshed on start and on 'refresh_alarms' actions
+        # (LMS alarm/prefs events, see monitor_lms_events.py)
+        self._alarms = []
+        self._alarms_stale = True
+        self._alarm_warmed_up = 0
+        self._alarm_cond = threading.Condition()
         self.threads = SimpleThreads()
         self.threads.add_target(self.update_loop, update_interval)
+        self.threads.add_target(self.alarm_loop)
         self.threads.add_thread(self._redis.t_wait_action(self.action))
+        if self._cli:
+            self.threads.add_target(self._cli.run)
+        self._update_lock = threading.Lock()
         self._updating = False
+        self._update_pending = False
+        self._last_update = 0
+
+    def lmsq(self):
+        """Return the LMSQuery instance, created on first use."""
+        if self._lmsquery is None:
+            self._lmsquery = lmsquery.LMSQuery(self._server)
+        return self._lmsquery
+
+    def command(self, player_id, *args):
+        """Run a player command (like LMSQuery.query()) - over the CLI
+        connection, or JSON-RPC if it's down.
+
+        If the command was sent but its response is missing (timeout,
+        connection lost), it may have been run: it's only sent again over
+        JSON-RPC if it's idempotent (eg. not 'playlist index +1'); otherwise
+        the error is logged and None is returned.
+        """
+        if self._cli:
+            try:
+                return self._cli.query(player_id, *args)
+            except CliNotConnected as ex:
+                self._log.info("CLI: %s - using JSON-RPC", ex)
+            except (ConnectionError, TimeoutError) as ex:
+                if not is_idempotent(args):
+                    self._log.error("CLI: %s - '%s' may not have been run"
+                                    " (not retried)", ex,
+                                    " ".join(str(arg) for arg in args))
+                    return None
+                self._log.info("CLI: %s - retrying with JSON-RPC", ex)
+        return self.lmsq().query(player_id, *args)
 
     def is_playing(self):
-        """Return player 'isplaying' status."""
-        return self._stats['isplaying']
+        """Return player 'isplaying' status (updated by LMS events too)."""
+        return bool(self._redis.get("isplaying"))
 
     def update_loop(self, update_interval):
-        """Loop - Update stats every update_interval seconds.
+        """Loop - Set alive every update_interval seconds, and reconcile the
+        stats every LMS_RECONCILE_INTERVAL seconds.
 
         Blocking, should be executed as a thread.
         """
         while True:
             time.sleep(update_interval)
-            self.update()
+            self._redis.set_alive()
+            # LMS events update the stats (see monitor_lms_events.py)
+            if (time.monotonic() - self._last_update
+                    >= (LMS_STANDBY_UPDATE_INTERVAL
+                        if self._redis.get_s("CDSP:standby")
+                        else LMS_RECONCILE_INTERVAL)):
+                self.update()
+
+    def alarm_loop(self):
+        """Loop - get CamillaDSP ready LMS_ALARM_WARM_UP seconds before the
+        next player alarm.
+
+        The alarms are queried only when stale; the next alarm is re-computed
+        from the cache when notified, and every LMS_ALARM_CHECK_INTERVAL.
+
+        Blocking, should be executed as a thread.
+        """
+        while True:
+            if self._alarms_stale:
+                self.refresh_alarms()
+            with self._alarm_cond:
+                alarm = next_alarm(self._alarms, datetime.datetime.fromtimestamp(
+                        max(time.time(), self._alarm_warmed_up)))
+                timeout = (LMS_ALARM_RETRY_INTERVAL if self._alarms_stale
+                           else LMS_ALARM_CHECK_INTERVAL)
+                if alarm:
+                    timeout = min(timeout,
+                                  alarm - LMS_ALARM_WARM_UP - time.time())
+                if timeout > 0:
+                    self._alarm_cond.wait(timeout)
+                    continue
+                self._alarm_warmed_up = alarm
+            self.warm_up(alarm)
+
+    def refresh_alarms(self):
+        """Query the player alarms and update the cache."""
+        try:
+            alarms = self.lmsq().get_alarms(self._playerid)
+        except (requests.Timeout, requests.exceptions.ConnectionError,
+                KeyError, ValueError) as ex:
+            self._log.warning("Couldn't get alarms: %s", ex)
+            return
+        with self._alarm_cond:
+            self._alarms = alarms.get('alarms_loop', []) if alarms else []
+            self._alarms_stale = False
+        self._log.info("%d alarm(s) enabled", len(self._alarms))
+
+    def refresh_alarms_action(self, _):
+        """Mark the alarms cache as stale and wake up alarm_loop()."""
+        with self._alarm_cond:
+            self._alarms_stale = True
+            self._alarm_cond.notify_all()
+
+    def warm_up(self, alarm):
+        """Load the config, unmute and wake up the sub before an alarm."""
+        if self.is_playing():
+            self._log.debug("Already playing - no warm-up")
+            return
+        self._log.info("Alarm at %s - warming up",
+                       time.strftime("%H:%M:%S", time.localtime(alarm)))
+        self._redis.send_action('CDSP', "warm_up")
 
     def action(self, action=""):
         """Run user actions.
@@ -54,13 +257,13 @@ class Lms():
         This function is usually called by a loop waiting for user actions
         published (sent) via redis.
         """
-        if not self._lmsquery:
-            self._log.info("lms query isn't defined; player not running ?")
-            return
-
-        if "volume_perc:" in action:
+        # 'volume_perc:50'
+        # 'volume_perc:52.08:v17' (versioned change from CDSP - see
+        # pymedia_volsync)
+        if action.startswith("volume_perc:"):
+            a_split = action.split(':')
             try:
-                vol_perc = float(action.split('volume_perc:')[1])
+                vol_perc = float(a_split[1])
             except ValueError as ex:
                 self._log.error(ex)
                 return
@@ -69,25 +272,36 @@ class Lms():
                 self._log.error("Volume is outside range: %d", vol_perc)
                 return
 
-            func_action = self._lmsquery.set_volume
-            func_action_args = (vol_perc,)
+            # LMS volumes are integers; no stats update (the volume is
+            # updated by the LMS mixer event)
+            vol_perc = round(vol_perc)
+            try:
+                self._volsync.apply(parse_version((a_split + [None])[2]),
+                                    vol_perc, self.command, self._playerid,
+                                    "mixer", "volume", vol_perc)
+            except (requests.Timeout,
+                    requests.exceptions.ConnectionError) as ex:
+                self._log.warning(ex)
+            return
 
         else:
             func_action, func_action_args = {
                     "update": [self.noop_action, ()],
-                    "previous_song": [self._lmsquery.previous_song, ()],
-                    "next_song": [self._lmsquery.next_song, ()],
-                    "play": [self._lmsquery.query, ("button", "play")],
-                    "stop": [self._lmsquery.query, ("button", "stop")],
-                    "pause": [self._lmsquery.query, ("pause", 1)],
-                    "unpause": [self._lmsquery.query, ("pause", 0)],
-                    "toggle_pause": [self._lmsquery.query, ("pause",)],
-                    "off": [self._lmsquery.query, ("power", 0)],
-                    "on": [self._lmsquery.query, ("power", 1)],
-                    "random_albums": [self._lmsquery.query, ("randomplay",
-                                                            "albums")],
-                    "random_tracks": [self._lmsquery.query, ("randomplay",
-                                                            "tracks")]
+                    "refresh_alarms": [self.refresh_alarms_action, ()],
+                    "previous_song": [self.command, ("playlist", "index",
+                                                     "-1")],
+                    "next_song": [self.command, ("playlist", "index", "+1")],
+                    "play": [self.command, ("button", "play")],
+                    "stop": [self.command, ("button", "stop")],
+                    "pause": [self.command, ("pause", 1)],
+                    "unpause": [self.command, ("pause", 0)],
+                    "toggle_pause": [self.command, ("pause",)],
+                    "off": [self.command, ("power", 0)],
+                    "on": [self.command, ("power", 1)],
+                    "random_albums": [self.command, ("randomplay",
+                                                     "albums")],
+                    "random_tracks": [self.command, ("randomplay",
+                                                     "tracks")]
                     }.get(action, [None, None])
 
         if not func_action:
@@ -109,69 +323,93 @@ class Lms():
         pass
 
     def update(self):
-        """Update stats and update redis if they've changed."""
-        self._log.debug("updating info")
+        """Update stats and update redis if they've changed.
 
-        if self._updating:
-            self._log.debug("another thread is updating player data - noop")
-            return
+        If another thread is updating, the update is run again once it's
+        done (eg. a new song during an update: its artist isn't lost).
+        """
+        with self._update_lock:
+            if self._updating:
+                self._log.debug("another thread is updating player data"
+                                " - pending")
+                self._update_pending = True
+                return
+            self._updating = True
 
-        self._updating = True
+        while True:
+            self._update()
+            with self._update_lock:
+                if not self._update_pending:
+                    self._updating = False
+                    return
+                self._update_pending = False
+
+    def _update(self):
+        self._log.debug("updating info")
+        self._last_update = time.monotonic()
 
         self._redis.set_alive()
 
         if not redis_cdsp_ping(self._redis, max_age=10):
             # no use to refresh stuff if cdsp isn't on
             self._log.debug("CDSP isn't running - won't refresh")
-            self._updating = False
             return
 
-        prev_stats = self._stats.copy()
+        # compared with redis: the stats are also updated by LMS events
+        prev_stats = {key: self._redis.get(key) for key in self._stats}
 
+        # a single request: player status with the current track
+        query_start = time.time()
         try:
-            # https://stackoverflow.com/questions/8653516/python-list-of-dictionaries-search
-            player = next((item for item in self._lmsquery.get_players()
-                           if item["playerid"] == self._playerid), None)
+            stats = parse_status(self.lmsq().query(self._playerid,
+                                                   *LMS_STATUS_QUERY))
         except (requests.Timeout, requests.exceptions.ConnectionError) as ex:
             self._log.debug("Connection error: %s", ex)
-            self._updating = False
+            return
+        except (KeyError, TypeError, ValueError) as ex:
+            self._log.error(ex)
             return
 
-        if not player:
+        if not stats:
             # debug loglevel to avoid flooding logs when the player - eg.
             # squeezelite isn't running
             self._log.debug("Player not found")
-            self._updating = False
-            return
-
-        try:
-            self._stats['player_name'] = player["name"]
-            self._stats['isplaying'] = bool(player["isplaying"])
-            self._stats['power'] = bool(player["power"])
-
-            if self._stats['isplaying']:
-                self._stats['artist'] = (
-                        self._lmsquery.get_current_artist(self._playerid))
-                self._stats['album'] = (
-                        self._lmsquery.get_current_album(self._playerid))
-                self._stats['title'] = (
-                        self._lmsquery.get_current_title(self._playerid))
-        except KeyError as ex:
-            self._log.error(ex)
-            self._updating = False
-            return
-        except (requests.Timeout, requests.exceptions.ConnectionError) as ex:
-            self._log.debug("Connection error: %s", ex)
-            self._updating = False
             return
 
         # update redis even if stats haven't changed; it fixes rare corner case
         # where redis player keys and lms stats{} aren't synchronized
-        self._redis.update_stats(self._stats)
+        written = self._write_stats(stats, query_start)
+        self._stats.update(written)
 
-        if prev_stats != self._stats:
+        if any(prev_stats[key] != value for key, value in written.items()
+               if key not in LMS_STATS_NO_EVENT):
             self._log.debug("stats have changed - updating redis")
-            self._log.debug(self._stats)
+            self._log.debug(written)
             self._redis.publish_event("stats")
 
-        self._updating = False
+    def _write_stats(self, stats, query_start):
+        """Write the stats not updated by LMS events since query_start (the
+        query result is older); return them.
+
+        Atomic with respect to the events: the transaction is retried if
+        LMS_STATS_UPDATED_KEY changes meanwhile.
+        """
+        prefix = self._redis.pubsub_name
+        written = {}
+
+        def write(pipe):
+            updated = pipe.hgetall(LMS_STATS_UPDATED_KEY)
+            written.clear()
+            written.update({key: value for key, value in stats.items()
+                            if float(updated.get(key.encode(), 0))
+                            <= query_start})
+            pipe.multi()
+            for key, value in written.items():
+                pipe.set(f"{prefix}:{key}", json.dumps(value))
+            pipe.set(f"{prefix}:last_stats_update", json.dumps(time.time()))
+
+        self._redis.redis.transaction(write, LMS_STATS_UPDATED_KEY)
+        if len(written) < len(stats):
+            self._log.debug("stats updated by LMS events during the query"
+                            " (kept): %s", sorted(set(stats) - set(written)))
+        return written
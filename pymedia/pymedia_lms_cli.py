@@ -0,0 +1,256 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+import collections
+import socket
+import threading
+from urllib.parse import quote, unquote
+
+import pymedia_logger
+
+# ---------------------
+
+# https://github.com/elParaguayo/LMS-CLI-Documentation/blob/master/LMS-CLI.md
+LMS_CLI_PORT = 9090
+LMS_CLI_TIMEOUT = 10            # seconds - MUST be greater than ping intervals
+LMS_CLI_COMMAND_TIMEOUT = 1     # seconds - max response time (CliClient)
+LMS_CLI_RECV_SIZE = 65536
+LMS_CLI_MAX_LINE = 65536        # bytes - longer (partial) lines are dropped
+# reconnection delay: doubled after each failed attempt, up to the max.
+LMS_CLI_BACKOFF_MIN = 0.5       # seconds
+LMS_CLI_BACKOFF_MAX = 30        # seconds
+
+# ---------------------
+
+class CliNotConnected(ConnectionError):
+    """The request wasn't sent (no connection): it can be sent another way
+    without being run twice."""
+
+
+class LineBuffer():
+    """Frame a byte stream into lines: a read may hold several lines, and
+    a line may be split across reads (kept until it's complete)."""
+    def __init__(self, max_line=LMS_CLI_MAX_LINE):
+        self._log = pymedia_logger.get_logger(__class__.__name__)
+        self._max_line = max_line
+        self._partial = b""
+
+    def feed(self, data):
+        """Return the lines completed by data (str, without terminator;
+        empty lines are skipped)."""
+        *lines, self._partial = (self._partial + data).split(b"\n")
+        if len(self._partial) > self._max_line:
+            self._log.warning("line longer than %d bytes - dropped",
+                              self._max_line)
+            self._partial = b""
+        return [line.rstrip(b"\r").decode("UTF-8", errors="replace")
+                for line in lines if line.strip()]
+
+    def reset(self):
+        self._partial = b""
+
+
+class CliConnection():
+    """Persistent LMS CLI connection.
+
+    lines() yields the received lines; the connection is re-established
+    (with exponential backoff) when it's lost or times out, and
+    on_connect(connection) is run after each connection - eg. to
+    (re)subscribe to events. With timeout=None, an idle connection is kept
+    (no receive timeout).
+    """
+    def __init__(self, server, port=LMS_CLI_PORT, on_connect=None,
+                 timeout=LMS_CLI_TIMEOUT, backoff_min=LMS_CLI_BACKOFF_MIN,
+                 backoff_max=LMS_CLI_BACKOFF_MAX):
+        self._log = pymedia_logger.get_logger(__class__.__name__,
+                                              f"{server}:{port}")
+        self._address = (server, port)
+        self._on_connect = on_connect
+        self._timeout = timeout
+        self._backoff = (backoff_min, backoff_max)
+        self._delay = backoff_min
+        self._sock = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self.connections = 0
+
+    def _connect(self):
+        """Connect (retry until it works); return the socket, or None if
+        the connection was closed meanwhile."""
+        while not self._closed.is_set():
+            try:
+                sock = socket.create_connection(
+                        self._address,
+                        timeout=self._timeout or LMS_CLI_TIMEOUT)
+                sock.settimeout(self._timeout)
+                # small command lines: don't wait to coalesce them
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError as ex:
+                self._log.warning("Couldn't connect: %s - retrying in %gs",
+                                  ex, self._delay)
+                self._closed.wait(self._delay)
+                self._delay = min(2 * self._delay, self._backoff[1])
+                continue
+            with self._lock:
+                self._sock = sock
+            self.connections += 1
+            self._log.info("Connected")
+            if self._on_connect:
+                self._on_connect(self)
+            return sock
+        return None
+
+    def _disconnect(self, sock):
+        with self._lock:
+            if self._sock is sock:
+                self._sock = None
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def lines(self):
+        """Yield the received lines until close() - blocking, reconnects as
+        needed."""
+        buffer = LineBuffer()
+        while True:
+            sock = self._connect()
+            if sock is None:
+                return
+            buffer.reset()
+            try:
+                while True:
+                    data = sock.recv(LMS_CLI_RECV_SIZE)
+                    if not data:
+                        raise ConnectionError("connection closed")
+                    lines = buffer.feed(data)
+                    if lines:
+                        # the connection works: reset the backoff
+                        self._delay = self._backoff[0]
+                    yield from lines
+            except OSError as ex:
+                if self._closed.is_set():
+                    return
+                self._log.warning("%s - reconnecting in %gs", ex,
+                                  self._delay)
+            finally:
+                self._disconnect(sock)
+            self._closed.wait(self._delay)
+            self._delay = min(2 * self._delay, self._backoff[1])
+
+    def send(self, line):
+        """Send a command line; return False if not connected."""
+        with self._lock:
+            if self._sock is None:
+                return False
+            try:
+                self._sock.sendall(f"{line}\n".encode("UTF-8"))
+            except OSError as ex:
+                self._log.warning("Couldn't send '%s': %s", line, ex)
+                return False
+        return True
+
+    def reconnect(self):
+        """Drop the connection (eg. a response is missing) - lines()
+        reconnects."""
+        with self._lock:
+            if self._sock is not None:
+                try:
+                    # unblock recv()
+                    self._sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def close(self):
+        self._closed.set()
+        self.reconnect()
+
+
+class _Request():
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.response = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class CliClient():
+    """LMS commands/queries over a persistent CLI connection.
+
+    Requests are pipelined: they're sent right away, without waiting for
+    the responses to the previous ones. LMS answers the commands of a
+    connection in order, with one line each (the command echoed, '?'
+    replaced by the values), so responses are matched to the requests in
+    order.
+    """
+    def __init__(self, server, port=LMS_CLI_PORT,
+                 timeout=LMS_CLI_COMMAND_TIMEOUT):
+        self._log = pymedia_logger.get_logger(__class__.__name__)
+        self._timeout = timeout
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._conn = CliConnection(server, port, on_connect=self._connected,
+                                   timeout=None)
+
+    def run(self):
+        """Loop - receive the responses.
+
+        Blocking, should be executed as a thread.
+        """
+        for line in self._conn.lines():
+            self._response(line)
+
+    def _connected(self, _):
+        # the responses to the requests sent on a previous connection are
+        # lost
+        with self._lock:
+            while self._pending:
+                request = self._pending.popleft()
+                request.error = ConnectionError("connection lost")
+                request.done.set()
+
+    def _response(self, line):
+        tokens = line.split(" ")
+        with self._lock:
+            if not self._pending or tokens[0] != self._pending[0].tokens[0]:
+                self._log.debug("unexpected line '%s' - skipped", line)
+                return
+            request = self._pending.popleft()
+        request.response = [unquote(token) for token in tokens]
+        request.done.set()
+
+    def send(self, player_id, *args):
+        """Send a request without waiting for the response (see wait());
+        raise CliNotConnected if not connected."""
+        tokens = [quote(str(arg), safe="")
+                  for arg in ((player_id,) if player_id else ()) + args]
+        request = _Request(tokens)
+        # sent and queued atomically: the queue has the order of the
+        # requests on the connection
+        with self._lock:
+            if not self._conn.send(" ".join(tokens)):
+                raise CliNotConnected("not connected")
+            self._pending.append(request)
+        return request
+
+    def wait(self, request):
+        """Return the response to request (unquoted tokens); raise
+        TimeoutError or ConnectionError - the request may have been run."""
+        if not request.done.wait(self._timeout):
+            # the connection is out of sync or dead
+            self._log.warning("no response to '%s' - reconnecting",
+                              " ".join(request.tokens))
+            self._conn.reconnect()
+            raise TimeoutError(f"no response within {self._timeout}s")
+        if request.error:
+            raise request.error
+        return request.response
+
+    def query(self, player_id, *args):
+        """Run a command/query (like LMSQuery.query()) and return the
+        response tokens."""
+        return self.wait(self.send(player_id, *args))
+
+    def close(self):
+        self._conn.close()
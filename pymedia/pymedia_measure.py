@@ -0,0 +1,412 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+import copy
+import threading
+import wave
+
+import pymedia_logger
+from pymedia_freqresp import filter_response, log_freqs, peaking_db
+from pymedia_utils import lazy_import
+
+np = lazy_import("numpy")
+yaml = lazy_import("yaml")
+
+logger = pymedia_logger.get_logger(__name__)
+
+# ---------------------
+
+MEASURE_SWEEP_DURATION = 5          # seconds
+MEASURE_SWEEP_FREQS = (10, 22000)   # Hz - the end is capped at ~nyquist
+MEASURE_SWEEP_LEVEL = -12           # dBFS
+MEASURE_SWEEP_FADE = 0.05           # seconds - fade in/out
+MEASURE_TAIL = 1                    # seconds recorded after the sweep
+MEASURE_REGULARIZATION = -60        # dB, relative to the sweep spectrum peak
+MEASURE_IR_WINDOW = (0.005, 0.3)    # seconds before/after the IR peak
+MEASURE_SMOOTHING = 6               # 1/N octave smoothing
+MEASURE_POINTS = 256
+
+EQ_FILTERS = 10
+EQ_FREQ_RANGE = (20, 20000)         # Hz - fit range
+EQ_GAIN_RANGE = (-12, 6)            # dB - avoid large boosts
+EQ_Q_RANGE = (0.5, 15)
+EQ_ITERATIONS = 40
+EQ_MIN_IMPROVEMENT = 0.01           # dB² - stop adding filters below that
+
+# ---------------------
+# wav files
+
+def read_wav(path):
+    """Read a PCM wav file; return (float32 array (frames, channels), rate)."""
+    with wave.open(path, 'rb') as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        data = wav.readframes(wav.getnframes())
+    if width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        samples = (raw[:, 0].astype(np.int32) | raw[:, 1].astype(np.int32) << 8
+                   | raw[:, 2].astype(np.int8).astype(np.int32) << 16)
+    elif width in (2, 4):
+        samples = np.frombuffer(data, dtype=f'<i{width}')
+    else:
+        raise ValueError(f"{path}: unsupported sample width {width}")
+    samples = samples.reshape(-1, channels).astype(np.float32)
+    return samples / 2**(8 * width - 1), rate
+
+def write_wav(path, samples, rate, width=2):
+    """Write a float array (frames[, channels]) in [-1, 1] to a 16 or 32 bit
+    PCM wav file."""
+    if width not in (2, 4):
+        raise ValueError(f"unsupported sample width {width}")
+    samples = np.asarray(samples, dtype=np.float64)
+    if samples.ndim == 1:
+        samples = samples[:, np.newaxis]
+    full_scale = 2**(8 * width - 1)
+    data = np.round(np.clip(samples, -1, 1 - 1 / full_scale) * full_scale)
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(samples.shape[1])
+        wav.setsampwidth(width)
+        wav.setframerate(rate)
+        wav.writeframes(data.astype(f'<i{width}').tobytes())
+
+# ---------------------
+# sweeps, impulse and frequency responses
+
+def log_sweep(rate, duration=MEASURE_SWEEP_DURATION,
+              freqs=MEASURE_SWEEP_FREQS, level=MEASURE_SWEEP_LEVEL):
+    """Exponential (log) sine sweep, with short fade in/out."""
+    f_start, f_end = freqs[0], min(freqs[1], 0.95 * rate / 2)
+    times = np.arange(int(duration * rate)) / rate
+    ratio = np.log(f_end / f_start)
+    sweep = np.sin(2 * np.pi * f_start * duration / ratio
+                   * (np.exp(times * ratio / duration) - 1))
+    fade = int(MEASURE_SWEEP_FADE * rate)
+    ramp = 0.5 - 0.5 * np.cos(np.pi * np.arange(fade) / fade)
+    sweep[:fade] *= ramp
+    sweep[-fade:] *= ramp[::-1]
+    return (10**(level / 20) * sweep).astype(np.float32)
+
+def deconvolve(recording, sweep, regularization=MEASURE_REGULARIZATION):
+    """Impulse response(s) of a recorded sweep, by regularized FFT division.
+
+    recording may be (frames,) or (frames, channels); the IR has the same
+    number of channels. Harmonic distortion products end up at negative times
+    (ie. at the end of the IR) and are removed by window_ir().
+    """
+    recording = np.asarray(recording, dtype=np.float64)
+    size = 1 << int(len(recording) + len(sweep) - 1).bit_length()
+    spec_s = np.fft.rfft(sweep, size)
+    spec_r = np.fft.rfft(recording, size, axis=0)
+    power = np.abs(spec_s)**2
+    eps = power.max() * 10**(regularization / 10)
+    inverse = np.conj(spec_s) / (power + eps)
+    if spec_r.ndim == 2:
+        inverse = inverse[:, np.newaxis]
+    return np.fft.irfft(spec_r * inverse, size, axis=0)
+
+def window_ir(impulse, rate, window=MEASURE_IR_WINDOW):
+    """Window an impulse response around its peak (half Hann fade in/out);
+    return (windowed IR, peak index in impulse)."""
+    peak = int(np.argmax(np.abs(impulse)))
+    before, after = int(window[0] * rate), int(window[1] * rate)
+    start = max(peak - before, 0)
+    segment = np.array(impulse[start:peak + after])
+    fade_in = peak - start
+    if fade_in:
+        segment[:fade_in] *= 0.5 - 0.5 * np.cos(
+                np.pi * np.arange(fade_in) / fade_in)
+    fade_out = (len(segment) - fade_in) // 4
+    if fade_out:
+        segment[-fade_out:] *= 0.5 + 0.5 * np.cos(
+                np.pi * np.arange(fade_out) / fade_out)
+    return segment, peak
+
+def smoothed_response(impulse, rate, freqs, fraction=MEASURE_SMOOTHING):
+    """Magnitude (dB) of an IR at freqs, with 1/fraction octave (power)
+    smoothing - all bands at once with a cumulative sum."""
+    size = max(1 << int(len(impulse) - 1).bit_length(), 1 << 16)
+    power = np.abs(np.fft.rfft(impulse, size))**2
+    cumsum = np.concatenate(([0], np.cumsum(power)))
+    bin_hz = rate / size
+    half = 2**(1 / (2 * fraction))
+    lo_bin = np.clip(np.round(freqs / half / bin_hz), 0, len(power) - 1)
+    hi_bin = np.clip(np.round(freqs * half / bin_hz), lo_bin + 1, len(power))
+    lo_bin, hi_bin = lo_bin.astype(int), hi_bin.astype(int)
+    mean = (cumsum[hi_bin] - cumsum[lo_bin]) / (hi_bin - lo_bin)
+    return 10 * np.log10(np.maximum(mean, 1e-30))
+
+def measured_response(sweep, recording, rate, freqs, channel=0):
+    """Smoothed magnitude (dB) of one channel of a recorded sweep."""
+    recording = np.asarray(recording)
+    if recording.ndim == 2:
+        recording = recording[:, channel]
+    impulse, _ = window_ir(deconvolve(recording, sweep), rate)
+    return smoothed_response(impulse, rate, freqs)
+
+def read_target(path, freqs):
+    """Read a target curve ('freq dB' lines, REW house curve format) and
+    interpolate it (log frequency) at freqs."""
+    points = []
+    with open(path, encoding="utf-8") as target_file:
+        for line in target_file:
+            fields = line.replace(',', ' ').split()
+            try:
+                points.append((float(fields[0]), float(fields[1])))
+            except (IndexError, ValueError):
+                continue    # comments, headers
+    if not points:
+        raise ValueError(f"{path}: no target points found")
+    points.sort()
+    target_freqs, target_db = zip(*points)
+    return np.interp(np.log(freqs), np.log(target_freqs), target_db)
+
+# ---------------------
+# playing and recording (live measurements)
+
+def play_and_record(playback, capture, samples, tail=MEASURE_TAIL):
+    """Play samples on a PcmPlayback while recording from a PcmCapture.
+
+    Return the recording (float32 array (frames, channels)), or None on error.
+    Both devices are opened and closed here.
+    """
+    if not capture.open():
+        return None
+    if not playback.open():
+        capture.close()
+        return None
+    blocks = []
+    stop = threading.Event()
+
+    def record():
+        while not stop.is_set():
+            block = capture.read()
+            if block is None:
+                break
+            blocks.append(block)
+
+    thread = threading.Thread(target=record)
+    thread.daemon = True
+    thread.start()
+    played = playback.write(samples)
+    # silence, so that the end of the sweep (and the room decay) is recorded
+    playback.write(np.zeros((int(tail * playback.rate), playback.channels)))
+    stop.set()
+    thread.join()
+    playback.close()
+    capture.close()
+    if not played or not blocks:
+        return None
+    return np.concatenate(blocks)
+
+# ---------------------
+# EQ fitting
+
+def _fit_cost(residual):
+    return float(np.mean(residual**2))
+
+def _eq_db(freqs, params, samplerate):
+    """Summed magnitude (dB) of sets of Peaking filters; params has shape
+    (..., filters, 3) - freq, gain, q."""
+    return peaking_db(freqs, params[..., 0], params[..., 1], params[..., 2],
+                      samplerate).sum(axis=-2)
+
+def _clip_params(params, freq_range):
+    params[..., 0] = np.clip(params[..., 0], *freq_range)
+    params[..., 1] = np.clip(params[..., 1], *EQ_GAIN_RANGE)
+    params[..., 2] = np.clip(params[..., 2], *EQ_Q_RANGE)
+    return params
+
+def fit_peaking(freqs, correction, samplerate, nb_filters=EQ_FILTERS,
+                freq_range=EQ_FREQ_RANGE):
+    """Fit Peaking filters to a correction curve (dB at freqs).
+
+    - greedy: filters are added one at a time, the best of a grid of
+      (freq, q) candidates (evaluated at once) reducing the residual the most
+    - refinement: all the filters are then adjusted together with
+      Levenberg-Marquardt, the jacobian being evaluated as a single batch of
+      perturbed parameter sets
+
+    Return a list of (freq, gain, q) tuples, sorted by frequency.
+    """
+    in_range = (freqs >= freq_range[0]) & (freqs <= freq_range[1])
+    fit_freqs = freqs[in_range]
+    target = np.asarray(correction)[in_range]
+
+    # greedy initialization
+    cand_freqs = np.geomspace(*freq_range, 96)
+    cand_q = np.geomspace(*EQ_Q_RANGE, 12)
+    cand_f, cand_q = (grid.ravel() for grid in np.meshgrid(cand_freqs, cand_q))
+    params = np.empty((0, 3))
+    residual = target.copy()
+    for _ in range(nb_filters):
+        cand_gain = np.clip(np.interp(np.log(cand_f), np.log(fit_freqs),
+                                      residual), *EQ_GAIN_RANGE)
+        responses = peaking_db(fit_freqs, cand_f, cand_gain, cand_q,
+                               samplerate)
+        costs = np.mean((residual - responses)**2, axis=1)
+        best = int(np.argmin(costs))
+        if _fit_cost(residual) - costs[best] < EQ_MIN_IMPROVEMENT:
+            break
+        params = np.vstack((params, (cand_f[best], cand_gain[best],
+                                     cand_q[best])))
+        residual = residual - responses[best]
+
+    if not len(params):
+        return []
+
+    # refinement - parameters are optimized in (log freq, gain, log q) space
+    def to_params(values):
+        values = values.reshape(values.shape[:-1] + (-1, 3))
+        return _clip_params(np.stack((np.exp(values[..., 0]), values[..., 1],
+                                      np.exp(values[..., 2])), axis=-1),
+                            freq_range)
+
+    values = np.stack((np.log(params[:, 0]), params[:, 1],
+                       np.log(params[:, 2])), axis=-1).ravel()
+    steps = np.tile((0.01, 0.05, 0.01), len(params))
+    damping = 1e-2
+    residual = target - _eq_db(fit_freqs, to_params(values), samplerate)
+    cost = _fit_cost(residual)
+    for _ in range(EQ_ITERATIONS):
+        batch = values + np.diag(steps)
+        jacobian = ((_eq_db(fit_freqs, to_params(batch), samplerate)
+                     - (target - residual)) / steps[:, np.newaxis]).T
+        normal = jacobian.T @ jacobian
+        delta = np.linalg.solve(
+                normal + damping * np.diag(np.diag(normal) + 1e-9),
+                jacobian.T @ residual)
+        new_values = values + delta
+        new_residual = target - _eq_db(fit_freqs, to_params(new_values),
+                                       samplerate)
+        new_cost = _fit_cost(new_residual)
+        if new_cost < cost:
+            converged = cost - new_cost < 1e-4
+            values, residual, cost = new_values, new_residual, new_cost
+            damping = max(damping / 10, 1e-6)
+            if converged:
+                break
+        else:
+            damping *= 10
+    logger.debug("EQ fit: %d filters, rms error %.2fdB", len(params),
+                 cost**0.5)
+    return sorted(tuple(float(value) for value in filt)
+                  for filt in to_params(values))
+
+# ---------------------
+# configs
+
+def _prefixed(name, prefix):
+    return name == prefix or name.startswith(prefix + " ")
+
+def eq_response_db(config, prefix, channel, freqs):
+    """Magnitude (dB) of the filters named 'prefix*' in the pipeline steps of
+    channel (eg. the existing EQ, to remove from a measurement)."""
+    samplerate = config['devices']['samplerate']
+    filters = config.get('filters') or {}
+    response = np.ones(len(freqs), dtype=complex)
+    for step in config.get('pipeline') or []:
+        if step['type'] != 'Filter' or channel not in step.get(
+                'channels', [step.get('channel')]):
+            continue
+        for name in step['names']:
+            if _prefixed(name, prefix):
+                response *= filter_response(filters[name], freqs, samplerate)
+    return 20 * np.log10(np.abs(response))
+
+def patch_config(config, prefix, channels, peaking_filters):
+    """Return a copy of config with the filters named 'prefix*' replaced by
+    peaking_filters ((freq, gain, q) tuples) - see replace_filters().
+
+    New filters are named 'prefix 0', 'prefix 1', ...
+    """
+    return replace_filters(config, prefix, channels, {
+        f"{prefix} {index}": {
+            'type': 'Biquad',
+            'parameters': {
+                'type': 'Peaking',
+                'freq': round(freq, 1),
+                'gain': round(gain, 1),
+                'q': round(q_factor, 2),
+                },
+            }
+        for index, (freq, gain, q_factor) in enumerate(peaking_filters)})
+
+def replace_filters(config, prefix, channels, new_filters):
+    """Return a copy of config with the filters named 'prefix*' replaced by
+    new_filters (dict name: definition) in the pipeline steps of channels.
+
+    New filters are inserted where the previous ones were (or appended to the
+    steps).
+    """
+    config = copy.deepcopy(config)
+    filters = config.setdefault('filters', {})
+    for name in [name for name in filters if _prefixed(name, prefix)]:
+        del filters[name]
+    filters.update(new_filters)
+    new_names = list(new_filters)
+
+    # channel indexes are re-used after mixers: patch a single step per
+    # channel - the one referencing 'prefix*' filters, or the first one
+    steps = [step for step in config.get('pipeline') or []
+             if step['type'] == 'Filter']
+    targets = []
+    for channel in channels:
+        channel_steps = [step for step in steps if channel in step.get(
+            'channels', [step.get('channel')])]
+        if not channel_steps:
+            raise ValueError(f"no pipeline filter step for channel {channel}")
+        targets.append(next((step for step in channel_steps
+                             if any(_prefixed(name, prefix)
+                                    for name in step['names'])),
+                            channel_steps[0]))
+
+    for step in steps:
+        names = step['names']
+        positions = [index for index, name in enumerate(names)
+                     if _prefixed(name, prefix)]
+        names = [name for name in names if not _prefixed(name, prefix)]
+        if any(step is target for target in targets):
+            position = positions[0] if positions else len(names)
+            names = names[:position] + new_names + names[position:]
+        step['names'] = names
+    return config
+
+def write_config(path, config):
+    """Write a config file (note: yaml comments aren't preserved)."""
+    with open(path, 'w', encoding="utf-8") as config_file:
+        yaml.safe_dump(config, config_file, sort_keys=False)
+
+def fit_config(config, sweep, recording, rate, prefix, channels,
+               target_path=None, nb_filters=EQ_FILTERS,
+               freq_range=EQ_FREQ_RANGE, rec_channel=0):
+    """Measure/fit/patch: return (patched config, filters, details dict).
+
+    The recording is assumed to be made with config active: the response of
+    its 'prefix*' filters is removed from the measurement before fitting.
+    """
+    samplerate = config['devices']['samplerate']
+    freqs = log_freqs(rate, MEASURE_POINTS)
+    measured = measured_response(sweep, recording, rate, freqs, rec_channel)
+    raw = measured - eq_response_db(config, prefix, channels[0], freqs)
+    target = (read_target(target_path, freqs) if target_path
+              else np.zeros(len(freqs)))
+    in_range = (freqs >= freq_range[0]) & (freqs <= freq_range[1])
+    # level matching: a correction can't fix the overall level
+    raw += np.mean(target[in_range] - raw[in_range])
+    filters = fit_peaking(freqs, target - raw, samplerate, nb_filters,
+                          freq_range)
+    corrected = raw + _eq_db(freqs, np.array(filters).reshape(-1, 3),
+                             samplerate)
+    details = {
+            'freqs': freqs,
+            'raw': raw,
+            'target': target,
+            'corrected': corrected,
+            'rms_error_before': float(np.sqrt(np.mean(
+                (raw - target)[in_range]**2))),
+            'rms_error_after': float(np.sqrt(np.mean(
+                (corrected - target)[in_range]**2))),
+            }
+    return patch_config(config, prefix, channels, filters), filters, details
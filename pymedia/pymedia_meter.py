@@ -0,0 +1,318 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+import collections
+import math
+import time
+
+from pymedia_freqresp import biquads_response
+from pymedia_utils import lazy_import
+
+np = lazy_import("numpy")
+
+# ---------------------
+
+METER_MIN_DB = -90.0
+METER_PEAK_HOLD = 1.5       # seconds
+METER_PEAK_DECAY = 20.0     # dB/s, once the hold time has expired
+METER_BAR_DECAY = 40.0      # dB/s, bar ballistics (fast attack, slow release)
+
+# ITU-R BS.1770 loudness
+LOUDNESS_BLOCK = 0.1            # seconds - gating blocks overlap by 75%
+LOUDNESS_IR_LENGTH = 0.2        # seconds - K-weighting impulse response
+                                # (truncated: the tail is below -120dB)
+LOUDNESS_MOMENTARY = 4          # blocks (400ms)
+LOUDNESS_SHORT_TERM = 30        # blocks (3s)
+LOUDNESS_ABS_GATE = -70.0       # LUFS
+LOUDNESS_REL_GATE = -10.0       # LU
+LOUDNESS_HIST_RANGE = (-70.0, 10.0)
+LOUDNESS_HIST_STEP = 0.05       # LU - integrated loudness histogram
+LOUDNESS_PEAK_HOLD = 60         # seconds - sample peak held (see peak)
+
+# 1/3 octave nominal centre frequencies (IEC 61260 / ISO 266)
+THIRD_OCTAVE_CENTERS = (
+        25, 31.5, 40, 50, 63, 80, 100, 125, 160, 200, 250, 315, 400, 500,
+        630, 800, 1000, 1250, 1600, 2000, 2500, 3150, 4000, 5000, 6300, 8000,
+        10000, 12500, 16000, 20000,
+        )
+
+# ---------------------
+
+def to_db(values, min_db=METER_MIN_DB):
+    """Convert linear amplitudes to dBFS, clipped to min_db."""
+    with np.errstate(divide='ignore'):
+        return np.maximum(20 * np.log10(values), min_db)
+
+
+class LevelMeter():
+    """Per-channel RMS/peak levels with bar ballistics and peak hold.
+
+    Everything is computed on whole (frames, channels) blocks; the per-frame
+    cost doesn't depend on the number of channels.
+    """
+    def __init__(self, channels, min_db=METER_MIN_DB,
+                 peak_hold=METER_PEAK_HOLD, peak_decay=METER_PEAK_DECAY,
+                 bar_decay=METER_BAR_DECAY):
+        self.channels = np.asarray(channels)
+        self._min_db = min_db
+        self._peak_hold = peak_hold
+        self._peak_decay = peak_decay
+        self._bar_decay = bar_decay
+        nb_channels = len(self.channels)
+        self.rms = np.full(nb_channels, min_db)
+        self.peak = np.full(nb_channels, min_db)
+        self.bar = np.full(nb_channels, min_db)
+        self.peak_hold = np.full(nb_channels, min_db)
+        self._peak_hold_time = np.zeros(nb_channels)
+        self._last_update = None
+
+    def process(self, block, now=None):
+        """Update levels with a (frames, channels) block."""
+        if now is None:
+            now = time.monotonic()
+        elapsed = 0 if self._last_update is None else now - self._last_update
+        self._last_update = now
+
+        if block.shape[0]:
+            samples = block[:, self.channels]
+            self.rms = to_db(np.sqrt(np.mean(np.square(samples), axis=0)),
+                             self._min_db)
+            self.peak = to_db(np.max(np.abs(samples), axis=0), self._min_db)
+
+        # bar: immediate attack, linear (in dB) release
+        self.bar = np.maximum(self.rms, self.bar - self._bar_decay * elapsed)
+
+        # peak hold: reset on new peaks, decay once the hold time is over
+        new_peak = self.peak >= self.peak_hold
+        self._peak_hold_time[new_peak] = now
+        decaying = (now - self._peak_hold_time) > self._peak_hold
+        self.peak_hold = np.where(
+                new_peak, self.peak,
+                np.where(decaying,
+                         np.maximum(self.peak_hold
+                                    - self._peak_decay * elapsed,
+                                    self._min_db),
+                         self.peak_hold))
+
+    def reset(self):
+        for values in (self.rms, self.peak, self.bar, self.peak_hold):
+            values.fill(self._min_db)
+        self._last_update = None
+
+
+class OctaveSpectrum():
+    """1/3 octave band levels (dBFS) computed with an FFT.
+
+    The window and the FFT bin -> band mapping are computed once for a given
+    (rate, fft_size); process() is then a window multiply, an rfft, a cumulative
+    sum of the power spectrum and two fancy-indexing lookups.
+    """
+    def __init__(self, rate, fft_size=2048, centers=THIRD_OCTAVE_CENTERS,
+                 min_db=METER_MIN_DB, bar_decay=METER_BAR_DECAY):
+        self.rate = rate
+        self.fft_size = fft_size
+        self._min_db = min_db
+        self._bar_decay = bar_decay
+        self._window = np.hanning(fft_size).astype(np.float32)
+        # scale so that a full scale sine reads 0dBFS once the power of its
+        # bins is summed (amplitude scaling / equivalent noise bandwidth)
+        self._power_scale = 4.0 / (fft_size * np.sum(np.square(self._window)))
+        self._history = np.zeros(fft_size, dtype=np.float32)
+
+        freqs = np.fft.rfftfreq(fft_size, 1 / rate)
+        centers = np.asarray([c for c in centers if c < rate / 2])
+        bin_lo = np.searchsorted(freqs, centers * 2**(-1/6))
+        bin_hi = np.searchsorted(freqs, centers * 2**(1/6))
+        # low bands may be narrower than a FFT bin: use the bin closest to the
+        # band centre
+        empty = bin_hi <= bin_lo
+        bin_lo[empty] = np.rint(centers[empty] / (rate / fft_size))
+        bin_hi[empty] = bin_lo[empty] + 1
+        self.centers = centers
+        self._bin_lo = np.minimum(bin_lo, len(freqs))
+        self._bin_hi = np.minimum(bin_hi, len(freqs))
+        self.levels = np.full(len(centers), min_db)
+        self.bar = np.full(len(centers), min_db)
+        self._last_update = None
+
+    def process(self, block, channels=None, now=None):
+        """Update band levels with the mono downmix of a (frames, ch) block.
+
+        The FFT runs on the last fft_size frames received, so blocks may be
+        shorter than fft_size (eg. one block per display frame).
+        """
+        if now is None:
+            now = time.monotonic()
+        elapsed = 0 if self._last_update is None else now - self._last_update
+        self._last_update = now
+
+        if block.shape[0]:
+            samples = block if channels is None else block[:, channels]
+            mono = np.mean(samples, axis=1)
+            self._history = np.concatenate(
+                    (self._history, mono))[-self.fft_size:]
+            spectrum = np.fft.rfft(self._history * self._window)
+            cumulated = np.concatenate(
+                    ([0.0], np.cumsum(np.square(np.abs(spectrum))
+                                      * self._power_scale)))
+            band_power = cumulated[self._bin_hi] - cumulated[self._bin_lo]
+            self.levels = to_db(np.sqrt(band_power), self._min_db)
+
+        self.bar = np.maximum(self.levels,
+                              self.bar - self._bar_decay * elapsed)
+
+    def reset(self):
+        self._history.fill(0)
+        self.levels.fill(self._min_db)
+        self.bar.fill(self._min_db)
+        self._last_update = None
+
+
+def k_weighting(samplerate):
+    """ITU-R BS.1770 K-weighting biquads (shelf, high-pass) at samplerate:
+    (b0, b1, b2, a1, a2) tuples - the ITU 48kHz coefficients, re-derived
+    from their analog prototype for other rates."""
+    k = math.tan(math.pi * 1681.974450955533 / samplerate)
+    q_factor = 0.7071752369554196
+    v_h = 10**(3.999843853973347 / 20)
+    v_b = v_h**0.4996667741545416
+    a_0 = 1 + k / q_factor + k * k
+    shelf = ((v_h + v_b * k / q_factor + k * k) / a_0,
+             2 * (k * k - v_h) / a_0,
+             (v_h - v_b * k / q_factor + k * k) / a_0,
+             2 * (k * k - 1) / a_0,
+             (1 - k / q_factor + k * k) / a_0)
+    k = math.tan(math.pi * 38.13547087602444 / samplerate)
+    q_factor = 0.5003270373238773
+    a_0 = 1 + k / q_factor + k * k
+    highpass = (1.0, -2.0, 1.0,
+                2 * (k * k - 1) / a_0,
+                (1 - k / q_factor + k * k) / a_0)
+    return shelf, highpass
+
+
+class LoudnessMeter():
+    """Streaming ITU-R BS.1770 loudness (LUFS): momentary (400ms),
+    short-term (3s) and integrated (gated) loudness.
+
+    The K-weighting filter is applied to the stream by FFT convolution with
+    its impulse response (LOUDNESS_IR_LENGTH), overlap-add: the filter tail
+    of each block received is carried over to the next one, so the result is
+    the one of the biquads filtering the stream - without a per-sample loop.
+    Gating blocks (400ms, 75% overlap) are sums of 4 100ms blocks. The
+    integrated loudness uses a histogram of the gating blocks
+    (LOUDNESS_HIST_STEP), so memory doesn't grow with the program length.
+
+    peak is the sample peak (dBFS) of the last LOUDNESS_PEAK_HOLD seconds.
+    """
+    def __init__(self, rate, channels=(0, 1), weights=None):
+        self.rate = rate
+        self.channels = np.asarray(channels)
+        self.block_size = int(round(rate * LOUDNESS_BLOCK))
+        self._channel_weights = np.asarray(
+                weights if weights is not None else [1.0] * len(channels))
+        # impulse response from the frequency response, on a grid long
+        # enough for time aliasing to be negligible
+        ir_length = int(round(rate * LOUDNESS_IR_LENGTH))
+        fft_size = 1 << (4 * ir_length - 1).bit_length()
+        self._ir = np.fft.irfft(biquads_response(
+                k_weighting(rate), np.fft.rfftfreq(fft_size, 1 / rate),
+                rate), fft_size)[:ir_length]
+        self._ir_spectrum = {}      # fft size: rfft of the impulse response
+        nb_bins = int(round((LOUDNESS_HIST_RANGE[1] - LOUDNESS_HIST_RANGE[0])
+                            / LOUDNESS_HIST_STEP))
+        self._hist_count = np.zeros(nb_bins)
+        self._hist_power = np.zeros(nb_bins)
+        self.reset()
+
+    def reset(self):
+        self._pending = np.zeros((0, len(self.channels)))
+        self._tail = np.zeros((len(self._ir) - 1, len(self.channels)))
+        self._blocks = np.zeros(0)
+        self._hist_count.fill(0)
+        self._hist_power.fill(0)
+        self._peaks = collections.deque()   # (time, block sample peak)
+        self.momentary = self.short_term = self.integrated = -math.inf
+        self.peak = -math.inf
+
+    @staticmethod
+    def _lufs(power):
+        with np.errstate(divide='ignore'):
+            return -0.691 + 10 * np.log10(power)
+
+    def _filter(self, samples):
+        """K-weight (frames, channels) samples, continuing the previous
+        ones."""
+        nb_frames = len(samples)
+        fft_size = 1 << (nb_frames + len(self._ir) - 2).bit_length()
+        ir_spectrum = self._ir_spectrum.get(fft_size)
+        if ir_spectrum is None:
+            # blocks read from the capture device have a fixed size: cached
+            ir_spectrum = np.fft.rfft(self._ir, fft_size)[:, np.newaxis]
+            self._ir_spectrum[fft_size] = ir_spectrum
+        filtered = np.fft.irfft(np.fft.rfft(samples, fft_size, axis=0)
+                                * ir_spectrum, fft_size, axis=0)
+        filtered = filtered[:nb_frames + len(self._tail)]
+        # overlap-add the tail of the previous samples
+        filtered[:len(self._tail)] += self._tail
+        self._tail = filtered[nb_frames:].copy()
+        return filtered[:nb_frames]
+
+    def process(self, block):
+        """Update the loudness values with a (frames, channels) block."""
+        samples = block[:, self.channels].astype(float)
+        self._update_peak(samples)
+        samples = np.concatenate((self._pending, self._filter(samples)))
+        nb_blocks = len(samples) // self.block_size
+        self._pending = samples[nb_blocks * self.block_size:]
+        if not nb_blocks:
+            return
+        blocks = samples[:nb_blocks * self.block_size].reshape(
+                nb_blocks, self.block_size, -1)
+        power = np.mean(np.square(blocks), axis=1) @ self._channel_weights
+
+        history = np.concatenate((self._blocks, power))
+        # gating blocks ending on each new block
+        if len(history) >= LOUDNESS_MOMENTARY:
+            sums = np.cumsum(np.concatenate(([0.0], history)))
+            ends = np.arange(max(len(self._blocks), LOUDNESS_MOMENTARY - 1),
+                             len(history)) + 1
+            gating = (sums[ends] - sums[ends - LOUDNESS_MOMENTARY]
+                      ) / LOUDNESS_MOMENTARY
+            self._add_gating_blocks(gating)
+            self.momentary = float(self._lufs(gating[-1]))
+        self._blocks = history[-LOUDNESS_SHORT_TERM:]
+        if len(self._blocks) >= LOUDNESS_SHORT_TERM:
+            self.short_term = float(self._lufs(np.mean(self._blocks)))
+
+    def _update_peak(self, samples, now=None):
+        now = time.monotonic() if now is None else now
+        if len(samples):
+            self._peaks.append((now, float(np.max(np.abs(samples)))))
+        while self._peaks and now - self._peaks[0][0] > LOUDNESS_PEAK_HOLD:
+            self._peaks.popleft()
+        peak = max((peak for _, peak in self._peaks), default=0.0)
+        with np.errstate(divide='ignore'):
+            self.peak = float(20 * np.log10(peak))
+
+    def _add_gating_blocks(self, gating):
+        loudness = self._lufs(gating)
+        kept = loudness > LOUDNESS_ABS_GATE
+        if not np.any(kept):
+            return
+        index = np.clip(((loudness[kept] - LOUDNESS_HIST_RANGE[0])
+                         / LOUDNESS_HIST_STEP).astype(int),
+                        0, len(self._hist_count) - 1)
+        np.add.at(self._hist_count, index, 1)
+        np.add.at(self._hist_power, index, gating[kept])
+        # relative gate: 10 LU below the (absolute gated) mean power
+        threshold = (self._lufs(self._hist_power.sum()
+                                / self._hist_count.sum())
+                     + LOUDNESS_REL_GATE)
+        start = max(int((threshold - LOUDNESS_HIST_RANGE[0])
+                        / LOUDNESS_HIST_STEP), 0)
+        count = self._hist_count[start:].sum()
+        if count:
+            self.integrated = float(self._lufs(
+                    self._hist_power[start:].sum() / count))
@@ -0,0 +1,202 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+import pymedia_logger
+from pymedia_utils import lazy_import
+
+np = lazy_import("numpy")
+alsaaudio = lazy_import("alsaaudio")
+
+# ---------------------
+
+# CamillaDSP sample format -> (alsaaudio format, numpy dtype, full scale)
+#
+# S24LE3 (packed 3 bytes) isn't supported (not used in our configs, and would
+# require unpacking samples).
+PCM_FORMATS = {
+        'S16LE': ('PCM_FORMAT_S16_LE', '<i2', 2**15),
+        'S24LE': ('PCM_FORMAT_S24_LE', '<i4', 2**23),
+        'S32LE': ('PCM_FORMAT_S32_LE', '<i4', 2**31),
+        'FLOAT32LE': ('PCM_FORMAT_FLOAT_LE', '<f4', 1.0),
+        'FLOAT64LE': ('PCM_FORMAT_FLOAT64_LE', '<f8', 1.0),
+        }
+
+# ---------------------
+
+def to_pcm_bytes(samples, sample_format):
+    """Convert a float array in [-1, 1] to PCM data in sample_format
+    (interleaved if samples has shape (frames, channels))."""
+    _, dtype, full_scale = PCM_FORMATS[sample_format]
+    samples = np.asarray(samples, dtype=np.float64)
+    if full_scale != 1.0:
+        samples = np.round(np.clip(samples, -1, 1 - 1 / full_scale)
+                           * full_scale)
+    return samples.astype(dtype).tobytes()
+
+
+class PcmCapture():
+    """Capture blocks of samples from an alsa PCM as float32 numpy arrays.
+
+    Used to "tap" the loopback capture side, eg. for metering; the device must
+    allow several readers (see the dsnoop Loopback*_1_snoop PCMs in
+    /etc/asound.conf), otherwise opening fails when CamillaDSP already captures
+    from it.
+    """
+    def __init__(self, device, channels, rate, sample_format='S16LE',
+                 period_size=1024):
+        self._log = pymedia_logger.get_logger(__class__.__name__,
+                                              f"[{device}]")
+        try:
+            (self._alsa_format, self._dtype, self._full_scale) = (
+                    PCM_FORMATS[sample_format])
+        except KeyError as ex:
+            raise ValueError(f"unsupported format '{sample_format}'") from ex
+        self.device = device
+        self.channels = channels
+        self.rate = rate
+        self.sample_format = sample_format
+        self.period_size = period_size
+        self._pcm = None
+
+    def open(self):
+        """Open the capture device; return False on error."""
+        try:
+            self._pcm = alsaaudio.PCM(
+                    type=alsaaudio.PCM_CAPTURE,
+                    mode=alsaaudio.PCM_NORMAL,
+                    device=self.device,
+                    channels=self.channels,
+                    rate=self.rate,
+                    format=getattr(alsaaudio, self._alsa_format),
+                    periodsize=self.period_size,
+                    )
+        except alsaaudio.ALSAAudioError as ex:
+            self._log.warning("Couldn't open capture device: %s", ex)
+            self._pcm = None
+            return False
+        self._log.debug("opened - %d channels @ %dHz, period %d",
+                        self.channels, self.rate, self.period_size)
+        return True
+
+    def close(self):
+        if self._pcm:
+            self._pcm.close()
+            self._pcm = None
+
+    def is_open(self):
+        return self._pcm is not None
+
+    def read(self):
+        """Read a block (blocking).
+
+        Return a float32 array of shape (frames, channels) scaled to [-1, 1],
+        an empty array on overrun, or None if the device isn't usable.
+        """
+        if not self._pcm:
+            return None
+        try:
+            length, data = self._pcm.read()
+        except alsaaudio.ALSAAudioError as ex:
+            self._log.warning("read error: %s", ex)
+            self.close()
+            return None
+        if length <= 0:
+            self._log.debug("overrun (%d)", length)
+            return np.empty((0, self.channels), dtype=np.float32)
+        samples = np.frombuffer(data, dtype=self._dtype,
+                                count=length * self.channels)
+        samples = samples.reshape(length, self.channels).astype(np.float32)
+        if self._full_scale != 1.0:
+            samples *= 1.0 / self._full_scale
+        return samples
+
+
+class PcmPlayback():
+    """Play float numpy arrays on an alsa PCM, converted to sample_format.
+
+    Eg. to play test signals through the loopbacks, in the format CamillaDSP
+    captures (see CDSP:capture).
+    """
+    def __init__(self, device, channels, rate, sample_format='S16LE',
+                 period_size=1024):
+        self._log = pymedia_logger.get_logger(__class__.__name__,
+                                              f"[{device}]")
+        try:
+            (self._alsa_format, self._dtype, self._full_scale) = (
+                    PCM_FORMATS[sample_format])
+        except KeyError as ex:
+            raise ValueError(f"unsupported format '{sample_format}'") from ex
+        self.device = device
+        self.channels = channels
+        self.rate = rate
+        self.sample_format = sample_format
+        self.period_size = period_size
+        self._pcm = None
+
+    def open(self):
+        """Open the playback device; return False on error."""
+        try:
+            self._pcm = alsaaudio.PCM(
+                    type=alsaaudio.PCM_PLAYBACK,
+                    mode=alsaaudio.PCM_NORMAL,
+                    device=self.device,
+                    channels=self.channels,
+                    rate=self.rate,
+                    format=getattr(alsaaudio, self._alsa_format),
+                    periodsize=self.period_size,
+                    )
+        except alsaaudio.ALSAAudioError as ex:
+            self._log.warning("Couldn't open playback device: %s", ex)
+            self._pcm = None
+            return False
+        self._log.debug("opened - %d channels @ %dHz, period %d",
+                        self.channels, self.rate, self.period_size)
+        return True
+
+    def close(self):
+        if self._pcm:
+            self._pcm.close()
+            self._pcm = None
+
+    def is_open(self):
+        return self._pcm is not None
+
+    def to_bytes(self, samples):
+        """Convert a float array of shape (frames, channels) in [-1, 1] to
+        interleaved PCM data."""
+        return to_pcm_bytes(np.asarray(samples).reshape(-1, self.channels),
+                            self.sample_format)
+
+    def write(self, data, cancel=None):
+        """Play data (bytes - see to_bytes(), or a float array), period by
+        period (blocking).
+
+        Stop early if the cancel threading.Event is set; return False on error
+        or if cancelled.
+        """
+        if not self._pcm:
+            return False
+        if not isinstance(data, bytes):
+            data = self.to_bytes(data)
+        frame_size = self.channels * np.dtype(self._dtype).itemsize
+        chunk_size = self.period_size * frame_size
+        try:
+            for offset in range(0, len(data), chunk_size):
+                if cancel is not None and cancel.is_set():
+                    self._log.debug("cancelled")
+                    return False
+                self._pcm.write(data[offset:offset + chunk_size])
+        except alsaaudio.ALSAAudioError as ex:
+            self._log.warning("write error: %s", ex)
+            self.close()
+            return False
+        return True
+
+    def drain(self):
+        """Wait until all the written frames are played."""
+        if self._pcm and hasattr(self._pcm, 'drain'):   # pyalsaaudio >= 0.10
+            try:
+                self._pcm.drain()
+            except alsaaudio.ALSAAudioError as ex:
+                self._log.warning("drain error: %s", ex)
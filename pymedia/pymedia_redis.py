@@ -7,6 +7,7 @@ import threading
 import json
 import redis
 import pymedia_logger
+from pymedia_utils import sd_notify
 
 # ---------------------
 
@@ -61,16 +62,21 @@ class RedisHelper():
             self._log.error(ex)
             raise SystemExit from ex
 
-    def t_wait_action(self, func, *args, **kwargs):
+    def t_wait_action(self, func, *args, notify_ready=True, **kwargs):
         """Create and return a thread to wait_message()."""
         self._log.debug("Creating wait_action thread")
+        kwargs['notify_ready'] = notify_ready
         thread = threading.Thread(target=self.wait_action,
                                   args=(func, *args), kwargs=kwargs)
         thread.daemon = True
         return thread
 
-    def wait_action(self, func, *args, **kwargs):
-        """Wait for messages and run user provided function in thread."""
+    def wait_action(self, func, *args, notify_ready=True, **kwargs):
+        """Wait for messages and run user provided function in thread.
+
+        With notify_ready=True, notify systemd that the program is ready once
+        subscribed (ie. when actions can be handled).
+        """
         self._log.debug("Waiting for messages (actions)")
         try:
             pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
@@ -79,6 +85,8 @@ class RedisHelper():
             self._log.error("Could not subscribe to %s: %s",
                            self.pubsub_action_name, ex)
             raise SystemExit from ex
+        if notify_ready:
+            sd_notify()
         try:
             while True:
                 message = pubsub.get_message(timeout=1)
@@ -5,9 +5,21 @@
 # pylint: disable=missing-function-docstring
 
 import threading
-import gpiod
+import time
 
 import pymedia_logger
+from pymedia_gpio import (GpioEventLoop, chip_name, is_active, is_rising,
+                          line_settings)
+
+# ---------------------
+
+# acceleration curve: (velocity in detents/s, volume steps per detent) points,
+# linearly interpolated - slow turns keep 1 step per detent
+ROTARY_ACCEL_CURVE = ((8, 1), (20, 2), (35, 4), (50, 8))
+ROTARY_ACCEL_SMOOTHING = 0.5    # velocity EMA weight of the last interval
+ROTARY_ACCEL_RESET = 0.25       # seconds without detent resetting velocity
+
+# ---------------------
 
 # Software debouncing based on
 # https://github.com/buxtronix/arduino/tree/master/libraries/Rotary
@@ -42,13 +54,64 @@ ttable = [
     ]
 
 
+class Acceleration():
+    """Velocity dependent steps per detent.
+
+    Velocity is estimated from the detent timestamps (EMA of the instantaneous
+    rate); it's reset after a pause of more than reset seconds or on a
+    direction change, so that the first detents of a turn are always 1 step.
+    """
+    def __init__(self, curve=ROTARY_ACCEL_CURVE,
+                 smoothing=ROTARY_ACCEL_SMOOTHING, reset=ROTARY_ACCEL_RESET):
+        self._curve = sorted(curve)
+        self._smoothing = smoothing
+        self._reset = reset
+        self._last_time = None
+        self._last_direction = None
+        self.velocity = 0
+
+    def multiplier(self, velocity):
+        """Steps per detent at velocity (detents/s), from the curve."""
+        prev_v, prev_m = 0, 1
+        for curve_v, curve_m in self._curve:
+            if velocity <= curve_v:
+                if curve_v == prev_v:
+                    return curve_m
+                return (prev_m + (curve_m - prev_m) * (velocity - prev_v)
+                        / (curve_v - prev_v))
+            prev_v, prev_m = curve_v, curve_m
+        return prev_m
+
+    def steps(self, timestamp, direction):
+        """Return the number of steps for a detent at timestamp (seconds)."""
+        if (self._last_time is None or direction != self._last_direction
+                or timestamp - self._last_time > self._reset
+                or timestamp <= self._last_time):
+            self.velocity = 0
+        else:
+            rate = 1 / (timestamp - self._last_time)
+            if self.velocity:
+                self.velocity += self._smoothing * (rate - self.velocity)
+            else:
+                self.velocity = rate
+        self._last_time = timestamp
+        self._last_direction = direction
+        return max(1, round(self.multiplier(self.velocity)))
+
+
 class RotaryEncoder():
-    """Manage a rotary encoder with libgpiod."""
+    """Manage a rotary encoder with libgpiod (v2 API) - see
+    pymedia_gpio.GpioEventLoop.
+
+    Each detent changes the value by 1 step - or more with acceleration (an
+    Acceleration instance), based on the (kernel) event timestamps.
+    """
 
     def __init__(self, gpiochip, pin1, pin2, callback, invert=False,
-                 threaded_callback=False):
-        self._log = pymedia_logger.get_logger(__class__.__name__)
-        self._gpiochip = gpiochip
+                 threaded_callback=False, acceleration=None,
+                 consumer="pymedia"):
+        self._log = pymedia_logger.get_logger(
+                __class__.__name__, f"[{chip_name(gpiochip)}:{pin1},{pin2}]")
         self._pin1 = pin1
         self._pin2 = pin2
         self._value = 0
@@ -57,44 +120,33 @@ class RotaryEncoder():
         self._invert = invert
         self._callback = callback
         self._threaded_callback = threaded_callback
+        self._acceleration = acceleration
+
+        # no kernel debouncing: the state machine takes care of bounces
+        self.request = gpiochip.request_lines(
+                config={(pin1, pin2): line_settings()}, consumer=consumer)
+        self._val = {pin: int(is_active(self.request.get_value(pin)))
+                     for pin in (pin1, pin2)}
 
     def value(self):
         return self._value
 
     def wait_events(self):
-        """Wait and process pin1/pin2 changes (interrupts).
+        """Wait and process pin1/pin2 changes (interrupts) - for a rotary
+        encoder alone; use a shared GpioEventLoop otherwise.
 
         Should be run in a thread if this script does other (blocking) things.
         """
-        lines = self._gpiochip.get_lines([self._pin1, self._pin2])
-        lines.request(consumer="wait_events", type=gpiod.LINE_REQ_EV_BOTH_EDGES)
-
-        val = {}
-        val[self._pin1] = 0
-        val[self._pin2] = 0
-
-        try:
-            while True:
-                ev_lines = lines.event_wait(sec=1)
-                if not ev_lines:
-                    continue
-
-                valid_event = False
-                for line in ev_lines:
-                    event = line.event_read()
-                    if event.type == gpiod.LineEvent.RISING_EDGE:
-                        val[event.source.offset()] = 1
-                        valid_event = True
-                    elif event.type == gpiod.LineEvent.FALLING_EDGE:
-                        val[event.source.offset()] = 0
-                        valid_event = True
-                    else:
-                        raise TypeError('Invalid event type')
-
-                if valid_event:
-                    self._process(val[self._pin1], val[self._pin2])
-        except KeyboardInterrupt:
-            return
+        loop = GpioEventLoop()
+        loop.add(self)
+        loop.run()
+
+    def process_events(self, events):
+        """Process edge events (read in bulk by GpioEventLoop)."""
+        for event in events:
+            self._val[event.line_offset] = int(is_rising(event))
+            self._process(self._val[self._pin1], self._val[self._pin2],
+                          event.timestamp_ns / 1e9)
 
     def _run_callback(self):
         """Run self._callback function (optionally in a thread)."""
@@ -111,7 +163,7 @@ class RotaryEncoder():
                 self._callback(self._value, direction)
 
 
-    def _process(self, pin1_val, pin2_val):
+    def _process(self, pin1_val, pin2_val, timestamp=None):
         pinstate = (pin1_val << 1) | pin2_val
 
         if self._invert:
@@ -120,12 +172,21 @@ class RotaryEncoder():
         self._pinstate = ttable[self._pinstate & 0xf][pinstate]
         direction = self._pinstate & 0x30
 
+        if direction not in (DIR_CW, DIR_CCW):
+            return
+
+        steps = 1
+        if self._acceleration is not None:
+            if timestamp is None:
+                timestamp = time.monotonic()
+            steps = self._acceleration.steps(timestamp, direction)
+
         prev_value = self._value
         if direction == DIR_CW:
-            self._value += 1
+            self._value += steps
             self._direction = DIR_CW
-        elif direction == DIR_CCW:
-            self._value += -1
+        else:
+            self._value -= steps
             self._direction = DIR_CCW
 
         if prev_value != self._value:
@@ -0,0 +1,222 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+import os
+import re
+import threading
+import time
+
+import pymedia_logger
+from pymedia_pcm import PcmCapture
+from pymedia_utils import lazy_import
+
+np = lazy_import("numpy")
+
+# ---------------------
+
+# loopback playback side status - written by the kernel, cheap to read. A
+# player (squeezelite, pipewire, ...) writing to the loopback makes it RUNNING
+SOURCE_STATUS = "/proc/asound/{card}/pcm0p/sub0/status"
+SOURCE_HW_PARAMS = "/proc/asound/{card}/pcm0p/sub0/hw_params"
+SOURCE_DEVICE_RE = re.compile(r'^(Loopback\d+)_1_snoop(?:_\d+)?$')
+# per-rate capture devices (dsnoop PCMs with their own pinned rate, see
+# /etc/asound.conf): eg. Loopback1_1_snoop_48000
+SOURCE_RATE_DEVICE = "{device}_{rate}"
+ALSA_CONFIG_FILES = ("/etc/asound.conf", "~/.asoundrc")
+SOURCE_CHECK_INTERVAL = 0.1     # seconds - status polling of idle loopbacks
+SOURCE_BLOCK = 0.05             # seconds - level measurement block
+SOURCE_CHANNELS = (0, 1)        # channel 2 is the LFE tone (see lfe_tone.py)
+SOURCE_THRESHOLD = -60          # dBFS - RMS level considered as signal
+SOURCE_ATTACK = 0.2             # seconds of signal before a source is active
+SOURCE_RELEASE = 15             # seconds of silence before it's inactive
+SOURCE_LATENCY_STATS = 20       # number of decision latencies kept
+
+# ---------------------
+
+def loopback_card(device):
+    """Return the loopback card of a capture device (eg. Loopback0_1_snoop ->
+    Loopback0), or None."""
+    match = SOURCE_DEVICE_RE.match(device or "")
+    return match.group(1) if match else None
+
+def pcm_rate(card):
+    """Return the sample rate the playback side of a loopback card was opened
+    with by the player, or None if it's closed."""
+    try:
+        with open(SOURCE_HW_PARAMS.format(card=card),
+                  encoding="ascii") as hw_params:
+            for line in hw_params:
+                # rate: 44100 (44100/1)
+                if line.startswith("rate:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def pcm_defined(name):
+    """Return True if the PCM name is defined in the ALSA config files."""
+    pattern = re.compile(rf'^\s*pcm\.{re.escape(name)}\s*{{', re.MULTILINE)
+    for path in ALSA_CONFIG_FILES:
+        try:
+            with open(os.path.expanduser(path), encoding="utf-8") as conf:
+                if pattern.search(conf.read()):
+                    return True
+        except OSError:
+            pass
+    return False
+
+def rate_device(device, rate):
+    """Return the capture device of a loopback at rate: the per-rate device
+    (eg. Loopback1_1_snoop_48000) if it's defined, otherwise device - whose
+    rate mustn't be pinned then."""
+    name = SOURCE_RATE_DEVICE.format(device=device, rate=rate)
+    return name if pcm_defined(name) else device
+
+def pcm_running(card):
+    """Return True if the playback side of a loopback card is running."""
+    try:
+        with open(SOURCE_STATUS.format(card=card), encoding="ascii") as status:
+            return "RUNNING" in status.readline()
+    except OSError:
+        return False
+
+
+class Source():
+    """Signal presence on a loopback, with hysteresis.
+
+    active becomes True after SOURCE_ATTACK seconds of signal on
+    SOURCE_CHANNELS, and False after SOURCE_RELEASE seconds without signal (or
+    as soon as the loopback playback stops).
+    """
+    def __init__(self, index, priority, capture, threshold=SOURCE_THRESHOLD,
+                 attack=SOURCE_ATTACK, release=SOURCE_RELEASE):
+        self.index = index
+        self.priority = priority
+        self.card = loopback_card(capture['device'])
+        if not self.card:
+            raise ValueError(f"{capture['device']} isn't a loopback")
+        self._capture_params = capture
+        self.capture = self._pcm_capture(capture['device'],
+                                         capture['samplerate'])
+        self._threshold = threshold
+        self._attack = attack
+        self._release = release
+        self.active = False
+        self.signal_start = None    # start of the current signal
+        self.running_start = None   # time the loopback started running
+        self._last_signal = 0
+
+    def _pcm_capture(self, device, rate):
+        return PcmCapture(device, self._capture_params['channels'], rate,
+                          self._capture_params['format'],
+                          int(SOURCE_BLOCK * rate))
+
+    def follow_rate(self, rate):
+        """Capture at the rate the player opened the loopback with (see
+        rate_device()) - the capture must be closed."""
+        if rate is None or rate == self.capture.rate:
+            return
+        device = self._capture_params['device']
+        if rate != self._capture_params['samplerate']:
+            device = rate_device(device, rate)
+        self.capture = self._pcm_capture(device, rate)
+
+    def update(self, signal, now):
+        """Update the state; return True if the source became active."""
+        if signal:
+            self._last_signal = now
+            if self.signal_start is None:
+                self.signal_start = now
+            if not self.active and now - self.signal_start >= self._attack:
+                self.active = True
+                return True
+        else:
+            self.signal_start = None
+            if self.active and now - self._last_signal >= self._release:
+                self.active = False
+        return False
+
+    def stop(self):
+        """The loopback playback has stopped."""
+        self.capture.close()
+        self.active = False
+        self.signal_start = self.running_start = None
+
+    def level(self, block):
+        """RMS level (dBFS) of the loudest SOURCE_CHANNELS channel."""
+        if not block.shape[0]:
+            return -np.inf
+        rms = np.sqrt(np.mean(np.square(block[:, SOURCE_CHANNELS]), axis=0))
+        with np.errstate(divide='ignore'):
+            return float(20 * np.log10(np.max(rms)))
+
+    def has_signal(self, block):
+        return self.level(block) >= self._threshold
+
+
+class SourceDetector():
+    """Detect which loopback sources are playing - run source_loop(source)
+    in a thread per source.
+
+    Idle loopbacks cost a /proc read every SOURCE_CHECK_INTERVAL; the capture
+    side (dsnoop - CamillaDSP may be reading it too) is only opened and
+    metered while the loopback is running. cb_active(source) is run when a
+    source becomes active; the decision latency (from the start of the signal
+    - and of the loopback - to the callback) is logged and kept in
+    latencies.
+    """
+    def __init__(self, sources, cb_active):
+        self._log = pymedia_logger.get_logger(__class__.__name__)
+        self.sources = sources
+        self._cb_active = cb_active
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def source_loop(self, source):
+        """Loop - monitor a source.
+
+        Blocking, executed from within a thread.
+        """
+        while True:
+            if not pcm_running(source.card):
+                if source.running_start is not None:
+                    self._log.debug("%s stopped", source.card)
+                    source.stop()
+                time.sleep(SOURCE_CHECK_INTERVAL)
+                continue
+
+            now = time.monotonic()
+            if source.running_start is None:
+                self._log.debug("%s running", source.card)
+                source.running_start = now
+            if not source.capture.is_open():
+                source.follow_rate(pcm_rate(source.card))
+            if not source.capture.is_open() and not source.capture.open():
+                time.sleep(SOURCE_CHECK_INTERVAL)
+                continue
+            # paced by the capture device
+            block = source.capture.read()
+            if block is None:
+                continue
+            now = time.monotonic()
+            if source.update(source.has_signal(block), now):
+                self._activated(source, now)
+
+    def _activated(self, source, now):
+        latency = now - source.signal_start
+        with self._lock:
+            self.latencies.append(latency)
+            del self.latencies[:-SOURCE_LATENCY_STATS]
+            median = float(np.median(self.latencies))
+        self._log.info("%s active (config %d, priority %d) - decision in"
+                       " %.0fms after signal, %.0fms after start (median"
+                       " %.0fms)", source.card, source.index, source.priority,
+                       1000 * latency, 1000 * (now - source.running_start),
+                       1000 * median)
+        self._cb_active(source)
+
+    def get(self, index):
+        """Return the source of config index, or None."""
+        return next((source for source in self.sources
+                     if source.index == index), None)
@@ -2,6 +2,10 @@
 # pylint: disable=missing-class-docstring
 # pylint: disable=missing-function-docstring
 
+import importlib.util
+import os
+import socket
+import sys
 import threading
 import time
 
@@ -9,6 +13,67 @@ import pymedia_logger
 
 # ---------------------
 
+class _LazyModule():
+    """Module proxy importing the module on first attribute access - see
+    lazy_import().
+
+    Thread safe: unlike importlib.util.LazyLoader, a thread accessing the
+    module while another one is importing it waits for the import to
+    complete (instead of seeing a partially initialized module).
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'>"
+
+
+def lazy_import(name):
+    """Return module name, actually imported on first attribute access.
+
+    Used for heavy modules (PIL, camilladsp, numpy, ...) to speed up startup,
+    as some aren't needed right away - or at all (eg. most programs import
+    pymedia_cdsp only for redis_cdsp_ping()).
+    Note: module level constants must not access the module's attributes,
+    otherwise it's imported right away.
+    """
+    try:
+        return sys.modules[name]
+    except KeyError:
+        pass
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    return _LazyModule(name)
+
+def sd_notify(state="READY=1"):
+    """Send a notification to systemd (see sd_notify(3)) - Type=notify units.
+
+    No-op when not started by systemd (NOTIFY_SOCKET isn't set).
+    """
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return
+    if address.startswith('@'):     # abstract namespace socket
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode())
+    except OSError as ex:
+        pymedia_logger.get_logger(__name__).warning(
+                "Couldn't notify systemd (%s): %s", state, ex)
+
+# ---------------------
+
 class SimpleThreads():
     """Manage (add/start/join) a list of threads."""
     def __init__(self):
@@ -45,72 +110,69 @@ class SimpleThreads():
         self._joined = True
 
 
-class AutoOff():
-    """AutoOff timer."""
-    def __init__(
-            self,
-            func_condrun,
-            func_test,
-            func_shutdown,
-            _redis,
-            timeout,
-            label="",
-            check_interval=30,
-            start = True,
-            func_condrun_args=(),
-            func_test_args=(),
-            func_shutdown_args=(),
-        ):
-        self._log = pymedia_logger.get_logger(__class__.__name__)
-        self._func_condrun = func_condrun
-        self._func_test = func_test
-        self._func_shutdown = func_shutdown
-        self._redis = _redis
-        self._timeout = timeout
-        self._check_interval = check_interval
-        self.label = label
+class IdleTimer():
+    """Run callbacks after periods of inactivity.
+
+    stages is a list of (timeout, callback) tuples, timeouts in seconds and in
+    increasing order; each callback is run once when there hasn't been any
+    activity() for its timeout. cb_wake is run on the first activity() after a
+    stage has run.
+
+    Event driven: the thread sleeps until the next stage deadline (or
+    indefinitely once all stages have run), there's no polling.
+    """
+    def __init__(self, stages, cb_wake=None, label="", start=True):
+        self._log = pymedia_logger.get_logger(__class__.__name__, label)
+        self._stages = [stage for stage in stages if stage[0]]
+        self._cb_wake = cb_wake
+        self._cond = threading.Condition()
+        self._last_activity = time.monotonic()
+        self._next_stage = 0
         self.run = threading.Thread(target=self._run)
-        self._func_condrun_args = func_condrun_args
-        self._func_test_args = func_test_args
-        self._func_shutdown_args = func_shutdown_args
+        self.run.daemon = True
 
         if start:
-            self.run.daemon = True
             self.run.start()
 
-    # blocking function - should be run in an executor
+    def activity(self):
+        """Signal activity: re-arm the timer, run cb_wake if needed."""
+        with self._cond:
+            self._last_activity = time.monotonic()
+            woken = self._next_stage > 0
+            self._next_stage = 0
+            self._cond.notify()
+        if woken:
+            self._log.debug("activity - waking up")
+            if self._cb_wake:
+                self._cb_wake()
+
+    def idle(self):
+        """Run the remaining stages right away (eg. system standby)."""
+        with self._cond:
+            self._last_activity = float('-inf')
+            self._cond.notify()
+
+    def stage(self):
+        """Return the number of stages that have run (0: not idle)."""
+        return self._next_stage
+
     def _run(self):
-        end_time = None
-        prev_state = False
-        self._log.debug(
-            "setting up auto %s off task. check_interval:%ds timeout:%dm",
-            self.label,
-            self._check_interval,
-            self._timeout,
-        )
-        self._log.debug(
-            " functions: condrun:%s() test:%s() off:%s()",
-            self._func_condrun.__name__,
-            self._func_test.__name__,
-            self._func_shutdown.__name__,
-        )
-        while True:
-            state = self._func_condrun(*self._func_condrun_args)
-            if state:
-                if self._func_test(*self._func_test_args) or not prev_state:
-                    self._log.debug("(re)setting end time (%s)", self.label)
-                    end_time = time.monotonic() + self._timeout * 60.0
-                elif end_time:
-                    if time.monotonic() >= end_time:
-                        self._log.info("auto off time after %f minutes (%s)",
-                                     self._timeout, self.label)
-                        self._func_shutdown(*self._func_shutdown_args)
-                        self._redis.publish_event("auto off")
-                    else:
-                        self._log.debug(
-                            "%.1f seconds remaining before auto %s off",
-                            end_time - time.monotonic(),
-                            self.label,
-                        )
-            prev_state = state
-            time.sleep(self._check_interval)
+        with self._cond:
+            while True:
+                if self._next_stage >= len(self._stages):
+                    self._cond.wait()
+                    continue
+                timeout, callback = self._stages[self._next_stage]
+                remaining = self._last_activity + timeout - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                self._next_stage += 1
+                self._log.debug("idle for %ss - running %s()", timeout,
+                                callback.__name__)
+                # don't block activity() while running the callback
+                self._cond.release()
+                try:
+                    callback()
+                finally:
+                    self._cond.acquire()
@@ -0,0 +1,165 @@
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+import json
+import threading
+import time
+
+import pymedia_logger
+
+# ---------------------
+
+# Volume synchronization between its sources (rotary encoder, LMS, ALSA mixer,
+# CDSP actions) - CamillaDSP (pymedia_cdsp) is the authority:
+#
+# - sources tag the volume actions they send with their origin, eg.
+#   'volume_perc:50:lms', 'volume_incr:2:encoder'
+# - each change applied by CDSP gets a new version (monotonically increasing,
+#   redis INCR) and is published with its origin in CDSP:volume_sync
+# - CDSP forwards the change to the player ('volume_perc:52.08:v17') unless
+#   the player is the origin - a source never gets its own change back
+# - the player applies only versions newer than the last one it has applied
+#   (actions are run in threads: they may be processed out of order), and
+#   records the value it sets as an expected echo (see VolumeSync.apply());
+#   if the version counter has gone back (redis restarted/flushed), versions
+#   start over
+# - the LMS event listener drops events matching an expected echo (consumed
+#   once) instead of sending them back to CDSP. Some sets have no echo (eg.
+#   the volume was already at that value): echoes expire after
+#   VOLSYNC_ECHO_TTL, and an event that doesn't match clears the echoes it
+#   overtook - a stale echo can't swallow a later change to the same value
+#
+# -> no time windows (events aren't ignored for n seconds after a change) and
+# no redundant round trips.
+
+VOLSYNC_ORIGINS = ('cdsp', 'encoder', 'lms', 'alsa')
+VOLSYNC_STATE_KEY = "CDSP:volume_sync"
+VOLSYNC_VERSION_KEY = "CDSP:volume_version"
+VOLSYNC_ECHOES_KEY = "CDSP:volume_echoes:{origin}"
+VOLSYNC_MAX_ECHOES = 8          # expected echoes kept per origin
+VOLSYNC_ECHO_TTL = 3            # seconds - max delay of an echo
+# volumes (%) within are the same - eg. ALSA mixer steps
+VOLSYNC_TOLERANCE = 1
+
+# ---------------------
+
+def parse_origin(field):
+    """Return the origin of an action field, or None."""
+    return field if field in VOLSYNC_ORIGINS else None
+
+def parse_version(field):
+    """Return the version of an action field ('v17'), or None."""
+    if field and field.startswith('v') and field[1:].isdigit():
+        return int(field[1:])
+    return None
+
+
+class VolumeSync():
+    """Origin tagged, versioned volume state (see above) for origin."""
+    def __init__(self, _redis, origin, tolerance=VOLSYNC_TOLERANCE):
+        self._log = pymedia_logger.get_logger(__class__.__name__, origin)
+        self._redis = _redis
+        self.origin = origin
+        self._tolerance = tolerance
+        self._echoes_key = VOLSYNC_ECHOES_KEY.format(origin=origin)
+        self._version = 0
+        self._lock = threading.Lock()
+
+    # CDSP
+
+    def publish(self, perc, origin):
+        """Publish a volume change applied by CDSP; return its version."""
+        version = self._redis.redis.incr(VOLSYNC_VERSION_KEY)
+        self._redis.set_s(VOLSYNC_STATE_KEY, {'version': version,
+                                              'origin': origin,
+                                              'perc': perc})
+        self._log.debug("v%d: %s%% (%s)", version, perc, origin)
+        return version
+
+    # sources
+
+    def state(self):
+        """Return the current {'version', 'origin', 'perc'}, or None."""
+        return self._redis.get_s(VOLSYNC_STATE_KEY)
+
+    def is_current(self, perc):
+        """Return True if perc is the current volume (no change to send)."""
+        state = self.state()
+        return bool(state) and abs(state['perc'] - perc) <= self._tolerance
+
+    def is_echo(self, perc):
+        """Return True (and consume it) if perc is an expected echo of a
+        change applied by this origin.
+
+        Events come in order: the echoes expected before the matching one
+        had no event, they're dropped with the expired ones - and all of
+        them if perc doesn't match (None: clear the echoes, eg. relative
+        change).
+        """
+        result = []
+
+        def consume(pipe):
+            now = time.time()
+            echoes = [json.loads(echo)
+                      for echo in pipe.lrange(self._echoes_key, 0, -1)]
+            echoes = [echo for echo in echoes if echo[1] > now]
+            index = next((index for index, echo in enumerate(echoes)
+                          if perc is not None and echo[0] == round(perc)),
+                         None)
+            result.append(index is not None)
+            pipe.multi()
+            pipe.delete(self._echoes_key)
+            if index is not None and echoes[index + 1:]:
+                pipe.rpush(self._echoes_key, *(json.dumps(echo)
+                                               for echo in echoes[index + 1:]))
+
+        # atomic: echoes may be added meanwhile (see expect_echo())
+        self._redis.redis.transaction(consume, self._echoes_key)
+        return result[-1]
+
+    # sinks
+
+    def apply(self, version, perc, func, *args):
+        """Run func(*args) to set perc if version is newer than the last
+        applied one (None: unversioned change, always applied); return True
+        if it was run.
+
+        Serialized, so the device also gets the changes in order.
+        """
+        with self._lock:
+            if version is not None:
+                if version <= self._version and not self._counter_reset():
+                    self._log.debug("dropping v%d (applied: v%d)", version,
+                                    self._version)
+                    return False
+                self._version = version
+            # before the change: its event may be received before func()
+            # returns
+            echo = self.expect_echo(perc)
+            try:
+                func(*args)
+            except Exception:
+                self._redis.redis.lrem(self._echoes_key, -1, echo)
+                raise
+            return True
+
+    def _counter_reset(self):
+        """Return True if the version counter is below the last applied
+        version: redis was restarted or flushed, versions start over."""
+        counter = int(self._redis.redis.get(VOLSYNC_VERSION_KEY) or 0)
+        if counter >= self._version:
+            return False
+        self._log.info("version counter reset (v%d, applied: v%d)", counter,
+                       self._version)
+        return True
+
+    def expect_echo(self, perc):
+        """Record perc as set by this origin (its event is an echo, within
+        VOLSYNC_ECHO_TTL); return the recorded echo."""
+        echo = json.dumps([round(perc), time.time() + VOLSYNC_ECHO_TTL])
+        pipe = self._redis.redis.pipeline()
+        pipe.rpush(self._echoes_key, echo)
+        pipe.ltrim(self._echoes_key, -VOLSYNC_MAX_ECHOES, -1)
+        pipe.execute()
+        return echo
@@ -4,10 +4,8 @@
 # pylint: disable=missing-class-docstring
 # pylint: disable=missing-function-docstring
 
-from time import time
-import gpiod
-
 import pymedia_buffer_event
+from pymedia_gpio import open_chip
 import pymedia_redis
 import pymedia_rotary_encoder
 
@@ -17,20 +15,22 @@ from pymedia_const import REDIS_SERVER, REDIS_PORT, REDIS_DB
 
 ROTARY_ENCODER_DISCARD_TIME_WINDOW = 0.1
 ROTARY_ENCODER_MAX_AGE = 0.15
+# during a continuous turn, send the aggregated volume change every 50ms
+ROTARY_ENCODER_TIME_SLICE = 0.05
 
 # ----------------
 
 def cdsp_set_volume(_1, _2, incr, _redis):
-    """Send (publish) volume up/down actions for CamillaDSP."""
-    _redis.send_action('CDSP', f"volume_incr:{incr}")
-    _redis.set("last_volume_event", time())
+    """Send (publish) volume up/down actions for CamillaDSP - tagged with
+    the 'encoder' origin (see pymedia_volsync)."""
+    _redis.send_action('CDSP', f"volume_incr:{incr}:encoder")
 
 
 # ----------------
 
 if __name__ == '__main__':
 
-    gpiochip0 = gpiod.Chip("gpiochip0")
+    gpiochip0 = open_chip("/dev/gpiochip0")
 
     redis = pymedia_redis.RedisHelper(REDIS_SERVER, REDIS_PORT, REDIS_DB,
                                       'ROTARY_ENCODER')
@@ -38,11 +38,12 @@ if __name__ == '__main__':
     vol_event = pymedia_buffer_event.ProcessEvent(cdsp_set_volume,
                                       ROTARY_ENCODER_DISCARD_TIME_WINDOW,
                                       ROTARY_ENCODER_MAX_AGE,
+                                      max_wait=ROTARY_ENCODER_TIME_SLICE,
                                       cb_args=(redis,))
 
 
-    r_enc = pymedia_rotary_encoder.RotaryEncoder(gpiochip0, 16, 15,
-                                             callback=vol_event.event,
-                                             threaded_callback=True)
+    r_enc = pymedia_rotary_encoder.RotaryEncoder(
+            gpiochip0, 16, 15, callback=vol_event.event,
+            acceleration=pymedia_rotary_encoder.Acceleration())
 
     r_enc.wait_events()
@@ -6,8 +6,8 @@
 
 # a standalone CamillaDSP "remote volume" (no redis, no display, etc.)
 
-import gpiod
-
+import pymedia_buffer_event
+from pymedia_gpio import open_chip
 import pymedia_rotary_encoder
 import pymedia_cdsp
 
@@ -15,6 +15,8 @@ import pymedia_cdsp
 
 ROTARY_ENCODER_DISCARD_TIME_WINDOW = 0.1
 ROTARY_ENCODER_MAX_AGE = 0.15
+# during a continuous turn, send the aggregated volume change every 50ms
+ROTARY_ENCODER_TIME_SLICE = 0.05
 
 CDSP_CFG = {
         'server': 'localhost',
@@ -37,16 +39,16 @@ if __name__ == '__main__':
 
     CDSP = pymedia_cdsp.CDsp(CDSP_CFG)
 
-    gpiochip0 = gpiod.Chip("gpiochip0")
+    gpiochip0 = open_chip("/dev/gpiochip0")
 
-    vol_event = pymedia_rotary_encoder.ProcessEvent(cdsp_set_volume,
+    vol_event = pymedia_buffer_event.ProcessEvent(cdsp_set_volume,
                                             ROTARY_ENCODER_DISCARD_TIME_WINDOW,
-                                            ROTARY_ENCODER_MAX_AGE)
+                                            ROTARY_ENCODER_MAX_AGE,
+                                            max_wait=ROTARY_ENCODER_TIME_SLICE)
 
-    gpiochip0 = gpiod.Chip("gpiochip0")
-    r_enc = pymedia_rotary_encoder.RotaryEncoder(gpiochip0, 16, 15,
-                                             callback=vol_event.event,
-                                             threaded_callback=True)
+    r_enc = pymedia_rotary_encoder.RotaryEncoder(
+            gpiochip0, 16, 15, callback=vol_event.event,
+            acceleration=pymedia_rotary_encoder.Acceleration())
 
     # for simplicity add rotary encoder wait_events() loop to CDSP's list of
     # threads
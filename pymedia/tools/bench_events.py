@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+# Benchmark pymedia_buffer_event.ProcessEvent with synthetic bursts of events
+# at 1kHz (eg. a fast spinning rotary encoder, ALSA mixer event storms): CPU
+# usage, max number of threads and correctness of the delivered values (the
+# sum of the delivered increments must be the net change, and the last
+# delivered value the final one).
+#
+# The previous implementation (blocking event(), one thread per event) is
+# benchmarked from a copy: PreviousProcessEvent.
+#
+# usage: ./tools/bench_events.py [bursts] [events per burst]
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+import pymedia_logger
+from pymedia_buffer_event import ProcessEvent
+
+BURSTS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+EVENTS = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+EVENT_INTERVAL = 0.001          # 1kHz
+PAUSE = 0.5                     # seconds between bursts
+
+# ---------------------
+
+class PreviousProcessEvent():
+    """pymedia_buffer_event.ProcessEvent before the scheduler (unchanged)."""
+    def __init__(self, callback, discard_time_window=0.1, max_age=0.15,
+                 cb_args=()):
+        self._log = pymedia_logger.get_logger(__class__.__name__)
+        self._discard_time_window = discard_time_window
+        self._max_age = max_age
+        self._cur_event_id = 0
+        self._last_event_time = 0
+        self._last_event_value = None
+        self._callback = callback
+        self._callback_args = cb_args
+
+    def event(self, value, direction=0):
+        """Blocking (time.sleep()) so should be executed as a thread."""
+        self._cur_event_id += 1
+        event_id = self._cur_event_id
+        run_callback = False
+        if time.time() - self._last_event_time > self._max_age:
+            self._log.debug("thread id # %s: last event time was more than"
+                          " %fs ago - running",
+                          event_id, self._max_age)
+            run_callback = True
+        else:
+            self._log.debug("thread id # %s: an event happened less than %fs"
+                          " ago - waiting %fs to proceed", event_id,
+                          self._max_age,
+                          self._discard_time_window)
+            time.sleep(self._discard_time_window)
+            if event_id == self._cur_event_id:
+                self._log.debug("thread id # %s: no new event - running",
+                              event_id)
+                run_callback = True
+            else:
+                self._log.debug("thread id # %s: event id %s took over",
+                              event_id, self._cur_event_id)
+
+        if run_callback:
+
+            if self._last_event_value:
+                incr = value - self._last_event_value
+            else:
+                incr = direction
+
+            self._callback(value, direction, incr, *self._callback_args)
+            self._last_event_value = value
+            self._last_event_time = time.time()
+
+
+def run(name, process_event):
+    delivered = []
+
+    def callback(value, _direction, incr):
+        delivered.append((value, incr))
+
+    event = process_event(callback)
+    max_threads = threading.active_count()
+    value = 0
+    cpu_start = time.process_time()
+    start = time.monotonic()
+    for burst in range(BURSTS):
+        # alternate directions; the net change isn't 0
+        direction = 1 if burst % 3 else -1
+        next_event = time.monotonic()
+        for _ in range(EVENTS):
+            value += direction
+            event(value, direction)
+            max_threads = max(max_threads, threading.active_count())
+            next_event += EVENT_INTERVAL
+            time.sleep(max(next_event - time.monotonic(), 0))
+        time.sleep(PAUSE)
+    elapsed = time.monotonic() - start
+    cpu = time.process_time() - cpu_start
+
+    incr_sum = sum(incr for _, incr in delivered)
+    last = delivered[-1][0] if delivered else None
+    print(f"{name}: {BURSTS * EVENTS} events -> {len(delivered)} callbacks,"
+          f" cpu {100 * cpu / elapsed:.1f}%, max threads {max_threads},"
+          f" sum(incr) {incr_sum} / last value {last} (expected {value}):"
+          f" {'ok' if incr_sum == value and last == value else 'WRONG'}")
+
+
+if __name__ == '__main__':
+
+    def per_event_thread(callback):
+        """Previous implementation and usage: one thread per event
+        (threaded_callback=True)."""
+        process_event = PreviousProcessEvent(callback, 0.1, 0.15)
+
+        def event(value, direction):
+            thread = threading.Thread(target=process_event.event,
+                                      args=(value, direction))
+            thread.daemon = True
+            thread.start()
+        return event
+
+    def scheduler(callback):
+        """Current usage: non blocking event(), shared scheduler thread."""
+        return ProcessEvent(callback, 0.1, 0.15).event
+
+    def scheduler_max_wait(callback):
+        """Same, with a callback at least every 50ms during bursts."""
+        return ProcessEvent(callback, 0.1, 0.15, max_wait=0.05).event
+
+    run("previous, thread per event", per_event_thread)
+    run("scheduler", scheduler)
+    run("scheduler, max_wait", scheduler_max_wait)
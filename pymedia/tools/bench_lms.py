@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+# Benchmark the LMS player update (pymedia_lms.Lms.update()): the previous
+# implementation (serverstatus + artist/album/title queries: 4 JSON-RPC
+# requests per update) vs. a single tagged 'status' query.
+#
+# usage: ./tools/bench_lms.py [--updates N] [--delay ms]
+#        ./tools/bench_lms.py --server host --player player_id [--updates N]
+#
+# Without --server, a local fake LMS JSON-RPC server is started, which
+# answers each request after --delay ms (simulated server processing time)
+# and counts the requests.
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+import lmsquery
+from pymedia_lms import LMS_STATUS_QUERY, parse_status
+
+FAKE_PLAYER_ID = "00:11:22:33:44:55"
+FAKE_TRACK = {'title': "So What", 'artist': "Miles Davis",
+              'album': "Kind of Blue", 'duration': 545.4}
+
+# ---------------------
+
+class FakeLms(BaseHTTPRequestHandler):
+    """Minimal LMS JSON-RPC server (the queries used by Lms.update())."""
+    delay = 0
+    requests = 0
+    lock = threading.Lock()
+
+    def do_POST(self):     # pylint: disable=invalid-name
+        request = json.loads(self.rfile.read(
+                int(self.headers['Content-Length'])))
+        with self.lock:
+            FakeLms.requests += 1
+        time.sleep(self.delay)
+        body = json.dumps({'id': request['id'], 'method': 'slim.request',
+                           'params': request['params'],
+                           'result': self.result(request['params'][1])})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    @staticmethod
+    def result(command):
+        if command[0] == 'serverstatus':
+            return {'player count': 1,
+                    'players_loop': [{'playerid': FAKE_PLAYER_ID,
+                                      'name': "juke", 'isplaying': 1,
+                                      'power': 1}]}
+        if command[0] in ('artist', 'album', 'title'):
+            return {f"_{command[0]}": FAKE_TRACK[command[0]]}
+        if command[0] == 'status':
+            return {'player_name': "juke", 'player_connected': 1,
+                    'power': 1, 'mode': "play", 'mixer volume': 52,
+                    'time': 83.2, 'duration': FAKE_TRACK['duration'],
+                    'playlist_cur_index': "0", 'playlist_tracks': 9,
+                    'playlist_loop': [{'playlist index': 0, 'id': 1,
+                                       **FAKE_TRACK}]}
+        return {}
+
+    def log_message(self, *_):
+        pass
+
+
+def update_4_requests(lmsq, player_id):
+    """Previous Lms.update() queries."""
+    player = next((item for item in lmsq.get_players()
+                   if item["playerid"] == player_id), None)
+    stats = {'player_name': player["name"],
+             'isplaying': bool(player["isplaying"]),
+             'power': bool(player["power"])}
+    if stats['isplaying']:
+        stats['artist'] = lmsq.get_current_artist(player_id)
+        stats['album'] = lmsq.get_current_album(player_id)
+        stats['title'] = lmsq.get_current_title(player_id)
+    return stats
+
+def update_status(lmsq, player_id):
+    """Current Lms.update() query."""
+    return parse_status(lmsq.query(player_id, *LMS_STATUS_QUERY))
+
+def run(name, update, lmsq, player_id, updates):
+    requests_start = FakeLms.requests
+    update(lmsq, player_id)     # connect (keep-alive session)
+    times = []
+    for _ in range(updates):
+        start = time.perf_counter()
+        stats = update(lmsq, player_id)
+        times.append(time.perf_counter() - start)
+    nb_requests = (FakeLms.requests - requests_start) / (updates + 1)
+    print(f"{name}: {updates} updates, mean"
+          f" {1000 * statistics.mean(times):.2f}ms, p95"
+          f" {1000 * sorted(times)[int(0.95 * len(times))]:.2f}ms"
+          +(f", {nb_requests:g} requests/update" if nb_requests else ""))
+    print(f"  {stats}")
+
+# ---------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="LMS update benchmark")
+    parser.add_argument("--server", help="LMS server (default: fake server)")
+    parser.add_argument("--player", default=FAKE_PLAYER_ID, help="player id")
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=2,
+                        help="fake server processing time (ms)")
+    args = parser.parse_args()
+
+    if args.server:
+        lmsq = lmsquery.LMSQuery(args.server)
+    else:
+        FakeLms.delay = args.delay / 1000
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FakeLms)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        lmsq = lmsquery.LMSQuery("127.0.0.1", server.server_address[1])
+
+    run("serverstatus + artist/album/title", update_4_requests, lmsq,
+        args.player, args.updates)
+    run("tagged status", update_status, lmsq, args.player, args.updates)
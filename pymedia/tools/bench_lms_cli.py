@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+# Throughput/correctness test of the LMS CLI event listener
+# (monitor_lms_events.LmsCliVol, pymedia_lms_cli): a local fake CLI server
+# sends synthetic events (volume, pause, new songs with non-ASCII titles,
+# alarms, other players, ...) in random sized chunks - several events per
+# packet, events split across packets - and drops the connection once
+# (reconnect/resubscribe). The callbacks must match the events exactly.
+#
+# usage: ./tools/bench_lms_cli.py [--events N] [--max-chunk bytes]
+#
+# Run twice: without connection drop (throughput), and with a drop (the
+# reconnection delay is included in the elapsed time).
+
+import argparse
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from urllib.parse import quote
+
+os.environ.setdefault("LOGLEVEL", "WARNING")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from monitor_lms_events import LmsCliVol
+
+PLAYER_ID = "13:89:0e:c8:1d:a5"
+OTHER_PLAYER_ID = "aa:bb:cc:dd:ee:ff"
+TITLES = ("So What", "Café Noir – Été", "100% Pure", "A/B: C&D",
+          "東京 (Tokyo)")
+TIMEOUT = 30            # seconds
+
+# ---------------------
+
+def make_events(count, rng):
+    """Return (event lines, expected callbacks) - a line is quoted like the
+    LMS CLI does (each field)."""
+    player = quote(PLAYER_ID, safe="")
+    lines = []
+    expected = []
+    for index in range(count):
+        kind = rng.randrange(6)
+        if kind == 0:
+            vol = str(rng.randint(0, 100))
+            lines.append(f"{player} mixer volume {vol}")
+            expected += [('vol', vol), ('stats', {'volume': vol})]
+        elif kind == 1:
+            paused = rng.randint(0, 1)
+            lines.append(f"{player} playlist pause {paused}")
+            expected.append(('stats', {'isplaying': not paused}))
+        elif kind == 2:
+            title = rng.choice(TITLES)
+            lines.append(f"{player} playlist newsong {quote(title, safe='')}"
+                         f" {index}")
+            expected += [('stats', {'title': title, 'isplaying': True}),
+                         ('update', None)]
+        elif kind == 3:
+            lines.append(f"{player} alarm update id:{index:x} time:25200")
+            expected.append(('alarms', None))
+        elif kind == 4:
+            lines.append(f"{quote(OTHER_PLAYER_ID, safe='')} playlist pause 1")
+        else:
+            lines.append(f"{player} playlist jump {index}")
+            expected.append(('update', None))
+    return lines, expected
+
+
+class FakeCli():
+    """Fake LMS CLI server: sends the events once subscribed, in random
+    sized chunks; drops the first connection at drop_at (events)."""
+    def __init__(self, lines, max_chunk, drop_at, rng):
+        self._data = [f"{line}\n".encode() for line in lines]
+        self._max_chunk = max_chunk
+        self._drop_at = drop_at
+        self._rng = rng
+        self._sent = 0
+        self.subscribes = 0
+        self.chunks = 0
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while self._sent < len(self._data):
+            conn, _ = self._server.accept()
+            with conn:
+                # wait for the subscription
+                received = b""
+                while b"subscribe" not in received:
+                    received += conn.recv(4096)
+                self.subscribes += 1
+                # drain the pings
+                thread = threading.Thread(target=self.drain, args=(conn,))
+                thread.daemon = True
+                thread.start()
+                end = (self._drop_at if self._drop_at > self._sent
+                       else len(self._data))
+                data = b"".join(self._data[self._sent:end])
+                self._sent = end
+                pos = 0
+                while pos < len(data):
+                    size = self._rng.randint(1, self._max_chunk)
+                    conn.sendall(data[pos:pos + size])
+                    pos += size
+                    self.chunks += 1
+                if self._sent < len(self._data):
+                    # dropped: the client must reconnect and resubscribe
+                    continue
+                # keep the connection open until the client is done
+                time.sleep(TIMEOUT)
+
+    @staticmethod
+    def drain(conn):
+        try:
+            while conn.recv(4096):
+                pass
+        except OSError:
+            pass
+
+
+def run(args, drop):
+    rng = random.Random(args.seed)
+    lines, expected = make_events(args.events, rng)
+    # subscribe() requests an update on each connection
+    nb_callbacks = len(expected) + (2 if drop else 1)
+    received = []
+    done = threading.Event()
+
+    def callback(kind):
+        def _callback(*cb_args):
+            received.append((kind, cb_args[-1] if cb_args else None))
+            if len(received) >= nb_callbacks:
+                done.set()
+        return _callback
+
+    server = FakeCli(lines, args.max_chunk,
+                     args.events // 2 if drop else args.events, rng)
+    cpu_start = time.process_time()
+    start = time.monotonic()
+    lms_cli = LmsCliVol("127.0.0.1", server.port, PLAYER_ID,
+                        callback('vol'), (),
+                        callback('stats'), (),
+                        callback('update'), (),
+                        callback('alarms'), ())
+    done.wait(TIMEOUT)
+    elapsed = time.monotonic() - start
+    cpu = time.process_time() - cpu_start
+    lms_cli.cleanup()
+
+    # updates requested on (re)connection aren't part of the events
+    nb_updates = received.count(('update', None))
+    ok = ([item for item in received if item != ('update', None)]
+          == [item for item in expected if item != ('update', None)]
+          and nb_updates == expected.count(('update', None))
+          + server.subscribes)
+    print(f"{'drop' if drop else 'no drop'}: {args.events} events"
+          f" ({server.chunks} packets, {server.subscribes} subscription(s))"
+          f" -> {len(received)} callbacks in {1000 * elapsed:.0f}ms:"
+          f" {args.events / elapsed:.0f} events/s,"
+          f" cpu {1000 * cpu / args.events:.3f}ms/event:"
+          f" {'ok' if ok else 'WRONG'}")
+    return ok
+
+# ---------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="LMS CLI events test")
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--max-chunk", type=int, default=1500,
+                        help="max bytes per packet")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = [run(args, drop) for drop in (False, True)]
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+# Compare the latency of LMS player commands over JSON-RPC (LMSQuery: one
+# HTTP POST per command) and over the persistent CLI connection
+# (pymedia_lms_cli.CliClient), one command at a time and pipelined (all the
+# commands sent, then all the responses waited for).
+#
+# usage: ./tools/bench_lms_transport.py [--count N] [--delay ms]
+#                                       [--transport cli|jsonrpc|both]
+#        ./tools/bench_lms_transport.py --server host --player player_id
+#                                       [--command mixer volume ?]
+#
+# Without --server, local fake servers (JSON-RPC, see bench_lms.py, and CLI)
+# answer each command after --delay ms. The default command is a query, so
+# it's harmless on a real player.
+
+import argparse
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+import lmsquery
+from bench_lms import FAKE_PLAYER_ID, FakeLms
+from pymedia_lms_cli import CliClient, LineBuffer
+
+# ---------------------
+
+class FakeCli():
+    """Fake LMS CLI server: echoes each command line after delay, in order
+    (like LMS, one command at a time per connection)."""
+    def __init__(self, delay):
+        self._delay = delay
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            conn, _ = self._server.accept()
+            thread = threading.Thread(target=self.handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, conn):
+        buffer = LineBuffer()
+        with conn:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            while data := conn.recv(4096):
+                for line in buffer.feed(data):
+                    time.sleep(self._delay)
+                    conn.sendall(f"{line}\n".encode())
+
+
+def print_times(name, times):
+    print(f"{name}: {len(times)} commands in {1000 * sum(times):.1f}ms, mean"
+          f" {1000 * statistics.mean(times):.2f}ms, p95"
+          f" {1000 * sorted(times)[int(0.95 * len(times))]:.2f}ms")
+
+def run_sequential(name, query, player_id, command, count):
+    query(player_id, *command)      # connect
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        query(player_id, *command)
+        times.append(time.perf_counter() - start)
+    print_times(name, times)
+
+def run_pipelined(name, cli, player_id, command, count):
+    start = time.perf_counter()
+    requests = [cli.send(player_id, *command) for _ in range(count)]
+    for request in requests:
+        cli.wait(request)
+    total = time.perf_counter() - start
+    print(f"{name}: {count} commands in {1000 * total:.1f}ms,"
+          f" {1000 * total / count:.2f}ms/command")
+
+# ---------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="LMS transports latency")
+    parser.add_argument("--server", help="LMS server (default: fake servers)")
+    parser.add_argument("--player", default=FAKE_PLAYER_ID, help="player id")
+    parser.add_argument("--command", nargs="+",
+                        default=["mixer", "volume", "?"])
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.5,
+                        help="fake servers processing time (ms)")
+    parser.add_argument("--transport", choices=("cli", "jsonrpc", "both"),
+                        default="both")
+    args = parser.parse_args()
+
+    if args.server:
+        jsonrpc_address = (args.server,)
+        cli_address = (args.server,)
+    else:
+        FakeLms.delay = args.delay / 1000
+        if args.transport != "cli":
+            http_server = ThreadingHTTPServer(("127.0.0.1", 0), FakeLms)
+            thread = threading.Thread(target=http_server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            jsonrpc_address = ("127.0.0.1", http_server.server_address[1])
+        cli_address = ("127.0.0.1", FakeCli(args.delay / 1000).port)
+
+    if args.transport != "cli":
+        lmsq = lmsquery.LMSQuery(*jsonrpc_address)
+        run_sequential("JSON-RPC", lmsq.query, args.player, args.command,
+                       args.count)
+
+    if args.transport != "jsonrpc":
+        cli = CliClient(*cli_address)
+        thread = threading.Thread(target=cli.run)
+        thread.daemon = True
+        thread.start()
+        # wait for the connection
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                cli.query("", "version", "?")
+                break
+            except (ConnectionError, TimeoutError):
+                time.sleep(0.05)
+        run_sequential("CLI", cli.query, args.player, args.command,
+                       args.count)
+        run_pipelined("CLI pipelined", cli, args.player, args.command,
+                      args.count)
+        cli.close()
@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+# Measure the CPU cost of the display level meter / spectrum processing
+# (pymedia_meter) with synthetic blocks, for the rates/channels used by the
+# CamillaDSP configs. Rendering (PIL + i2c) isn't included - see the
+# "'meter' screen: ... fps, cpu ...%" log lines of display.py for that.
+#
+# usage: ./tools/bench_meter.py [fps] [seconds]
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from pymedia_meter import LevelMeter, OctaveSpectrum
+
+FPS = int(sys.argv[1]) if len(sys.argv) > 1 else 25
+DURATION = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+for rate, channels in ((44100, 3), (24000, 3), (96000, 4)):
+    frames = rate // FPS
+    rng = np.random.default_rng(0)
+    blocks = [rng.uniform(-0.5, 0.5, (frames, channels)).astype(np.float32)
+              for _ in range(16)]
+    meter = LevelMeter((0, 1))
+    spectrum = OctaveSpectrum(rate, 2048)
+
+    nb_frames = int(DURATION * FPS)
+    for name, func in (
+            ('meter', meter.process),
+            ('spectrum', lambda block: spectrum.process(block, (0, 1))),
+            ):
+        start = time.process_time()
+        for index in range(nb_frames):
+            func(blocks[index % len(blocks)])
+        cpu = time.process_time() - start
+        print(f"{rate}Hz {channels}ch {name:>8}: {1000 * cpu / nb_frames:.3f}"
+              f" ms/frame, {100 * cpu * FPS / nb_frames:.2f}% cpu @ {FPS}fps")
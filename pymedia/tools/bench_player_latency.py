@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+# Measure the time from pressing play/pause to the player stats the display
+# shows (PLAYER:isplaying, with a PLAYER:EVENT - the display redraws on the
+# event): play/pause is toggled on the player and the PLAYER:EVENT messages
+# are waited for until PLAYER:isplaying has the new state.
+#
+# usage: ./tools/bench_player_latency.py [--via cli|action] [--count N]
+#
+# --via cli: the command is sent to the LMS CLI (like another LMS client, eg.
+# a phone app) - the stats are updated by monitor_lms_events.py.
+# --via action: the command is sent as a PLAYER action (like gpios.py) - run
+# by lms.py.
+#
+# lms.py, monitor_lms_events.py and display.py (optional) must be running.
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import sys
+import time
+from urllib.parse import quote
+
+import redis
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+from pymedia_const import REDIS_SERVER, REDIS_PORT, REDIS_DB
+from monitor_lms_events import LMS_SERVER, LMS_SERVER_PORT, LMS_PLAYERID
+
+TIMEOUT = 30        # seconds - max latency
+
+# ---------------------
+
+def is_playing(_redis):
+    return bool(json.loads(_redis.get("PLAYER:isplaying") or "false"))
+
+def wait_state(_redis, pubsub, playing, start):
+    """Return the time PLAYER:isplaying was playing, or None."""
+    while time.monotonic() - start < TIMEOUT:
+        message = pubsub.get_message(timeout=TIMEOUT)
+        if (message and message['type'] == 'message'
+                and is_playing(_redis) == playing):
+            return time.monotonic()
+    return None
+
+# ---------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="player latency")
+    parser.add_argument("--via", choices=("cli", "action"), default="cli")
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=3,
+                        help="seconds between commands")
+    parser.add_argument("--server", default=LMS_SERVER)
+    parser.add_argument("--player", default=LMS_PLAYERID)
+    args = parser.parse_args()
+
+    _redis = redis.Redis(REDIS_SERVER, REDIS_PORT, REDIS_DB)
+    pubsub = _redis.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe("PLAYER:EVENT")
+    cli = None
+    if args.via == "cli":
+        cli = socket.create_connection((args.server, LMS_SERVER_PORT))
+        cli.settimeout(1)
+
+    latencies = []
+    for _ in range(args.count):
+        playing = not is_playing(_redis)
+        while pubsub.get_message():     # flush
+            pass
+        start = time.monotonic()
+        if cli:
+            cli.sendall(f"{quote(args.player)} pause {int(not playing)}\n"
+                        .encode())
+            cli.recv(4096)      # command echo
+        else:
+            _redis.publish("PLAYER:ACTION",
+                           "unpause" if playing else "pause")
+        end = wait_state(_redis, pubsub, playing, start)
+        if end is None:
+            print(f"{'play' if playing else 'pause'}: timeout")
+        else:
+            latencies.append(end - start)
+            print(f"{'play' if playing else 'pause'}:"
+                  f" {1000 * latencies[-1]:.1f}ms")
+        time.sleep(args.interval)
+
+    if latencies:
+        print(f"via {args.via}: {len(latencies)}/{args.count}, mean"
+              f" {1000 * statistics.mean(latencies):.1f}ms, max"
+              f" {1000 * max(latencies):.1f}ms")
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+# Measure pymedia programs startup time.
+#
+# - import time: run 'python3 -X importtime -c "import MODULE"' and report the
+#   total and the slowest (cumulative / self) imports
+#
+#   ./tools/bench_startup.py importtime display cdsp lms
+#
+# - time to ready: start a program with NOTIFY_SOCKET pointing to a local
+#   socket and measure the time until it sends READY=1 (ie. first frame for
+#   display.py, or first handled action for the others - see sd_notify())
+#
+#   ./tools/bench_startup.py ready display [display ...]
+#
+# Run from the pymedia directory, on the target (the programs need their
+# hardware / redis to be ready).
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import signal
+
+PYMEDIA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+READY_TIMEOUT = 30  # seconds
+TOP = 15
+
+# ---------------------
+
+def parse_importtime(stderr):
+    """Parse -X importtime output into a list of (self_us, cumul_us, depth,
+    module) tuples."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            self_us, cumul_us, name = line[len("import time:"):].split('|')
+            self_us = int(self_us)
+            cumul_us = int(cumul_us)
+        except ValueError:
+            continue    # header line
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((self_us, cumul_us, depth, name.strip()))
+    return imports
+
+def report_importtime(module):
+    proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=PYMEDIA_DIR, capture_output=True, text=True, check=False)
+    if proc.returncode:
+        print(f"{module}: import failed:\n{proc.stderr.splitlines()[-1]}")
+        return
+    imports = parse_importtime(proc.stderr)
+    # depth 0 = imported by "import module" ; the last entry is the module
+    total = sum(cumul for _, cumul, depth, _ in imports if depth == 0)
+    print(f"== {module}: {total / 1000:.1f}ms ({len(imports)} modules)")
+    print(f"{'cumulative':>12} {'self':>10}  module (top {TOP} cumulative,"
+          " depth <= 2)")
+    for self_us, cumul_us, depth, name in sorted(
+            (imp for imp in imports if imp[2] <= 2),
+            key=lambda imp: imp[1], reverse=True)[:TOP]:
+        print(f"{cumul_us / 1000:10.1f}ms {self_us / 1000:8.1f}ms "
+              f" {'  ' * depth}{name}")
+    print()
+
+def report_ready(program):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sock_path = os.path.join(tmpdir, "notify")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.bind(sock_path)
+            sock.settimeout(READY_TIMEOUT)
+            env = dict(os.environ, NOTIFY_SOCKET=sock_path)
+            start = time.monotonic()
+            with subprocess.Popen([sys.executable, f"{program}.py"],
+                                  cwd=PYMEDIA_DIR, env=env,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL) as proc:
+                try:
+                    while b"READY=1" not in sock.recv(4096):
+                        pass
+                except socket.timeout:
+                    print(f"{program}: not ready after {READY_TIMEOUT}s")
+                else:
+                    print(f"{program}: ready after "
+                          f"{(time.monotonic() - start) * 1000:.0f}ms")
+                proc.send_signal(signal.SIGINT)
+                try:
+                    proc.wait(timeout=6)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+# ---------------------
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ("importtime", "ready"):
+        print(f"usage: {sys.argv[0]} importtime|ready program [program ...]")
+        sys.exit(1)
+
+    for name in sys.argv[2:]:
+        if sys.argv[1] == "importtime":
+            report_importtime(name)
+        else:
+            report_ready(name)
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+# Sub/mains time alignment (see pymedia_align): estimate the sub/mains arrival
+# time offset and phase coherence around the crossover from measurements at
+# one or several positions, and propose a CamillaDSP Delay filter.
+#
+# Measure each position twice, sub only and mains only (eg. with
+# ./tools/cdsp_measure.py record and the sub/mains muted in a config copy);
+# files are paired in order.
+#
+#   ./tools/cdsp_align.py --sweep sweep.wav --sub sub_*.wav --mains mains_*.wav
+#       [--ref-channel 1] [--config config.yml [--out patched.yml]]
+#
+# Without --sweep, files are impulse responses. Playback/recording latency
+# varies between recordings: record an electrical loopback of the sweep on
+# another channel (--ref-channel) as timing reference, or use IRs sharing the
+# same time reference (eg. REW with a timing reference).
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+import pymedia_align
+from pymedia_freqresp import read_config
+from pymedia_measure import read_wav, write_config
+
+# ---------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="sub/mains time alignment")
+    parser.add_argument('--sub', nargs='+', required=True)
+    parser.add_argument('--mains', nargs='+', required=True)
+    parser.add_argument('--sweep')
+    parser.add_argument('--channel', type=int, default=0)
+    parser.add_argument('--ref-channel', type=int)
+    parser.add_argument('--crossover', type=float,
+                        help="Hz (default: from --config, or"
+                        f" {pymedia_align.ALIGN_CROSSOVER})")
+    parser.add_argument('--config')
+    parser.add_argument('--out', help="write a patched config")
+    parser.add_argument('--mains-channels', type=int, nargs='+',
+                        default=[0, 1])
+    parser.add_argument('--sub-channels', type=int, nargs='+', default=[4])
+    args = parser.parse_args()
+
+    if len(args.sub) != len(args.mains):
+        sys.exit("--sub and --mains must have the same number of files")
+
+    config = read_config(args.config) if args.config else None
+    crossover = args.crossover
+    if crossover is None:
+        crossover = (pymedia_align.crossover_freq(config) if config
+                     else pymedia_align.ALIGN_CROSSOVER)
+
+    sweep = read_wav(args.sweep)[0][:, 0] if args.sweep else None
+    start = time.perf_counter()
+    sub_irs, rate = pymedia_align.load_irs(args.sub, sweep, args.channel,
+                                           args.ref_channel)
+    mains_irs, _ = pymedia_align.load_irs(args.mains, sweep, args.channel,
+                                          args.ref_channel)
+    loaded = time.perf_counter()
+    result = pymedia_align.align(sub_irs, mains_irs, rate, crossover)
+    done = time.perf_counter()
+
+    print(f"crossover {crossover}Hz, {len(sub_irs)} position(s)")
+    print(f"{'position':>8} {'lag ms':>8} {'phase':>7} {'-> ':>7}"
+          f" {'eff.':>6} {'->':>6}")
+    for index in range(len(sub_irs)):
+        print(f"{index:8d} {result['lags'][index]:8.2f}"
+              f" {result['phase_before'][index]:6.0f}°"
+              f" {result['phase_after'][index]:6.0f}°"
+              f" {result['efficiency_before'][index]:6.3f}"
+              f" {result['efficiency_after'][index]:6.3f}")
+    delay = result['delay']
+    print(f"\nproposed: delay the {'mains' if delay > 0 else 'sub'} by"
+          f" {abs(delay):.2f}ms"
+          + (" and invert the sub polarity" if result['polarity'] < 0 else "")
+          + f" - mean efficiency {np.mean(result['efficiency_before']):.3f}"
+          f" -> {np.mean(result['efficiency_after']):.3f}")
+    print(f"\n  {pymedia_align.ALIGN_FILTER}:\n    type: Delay\n"
+          f"    parameters:\n      delay: {abs(delay):.3f}\n      unit: ms\n")
+    if result['polarity'] < 0:
+        print(f"  {pymedia_align.ALIGN_POLARITY_FILTER}:\n    type: Gain\n"
+              "    parameters:\n      gain: 0\n      inverted: true\n")
+    print(f"(load/deconvolve {1000 * (loaded - start):.0f}ms,"
+          f" analysis {1000 * (done - loaded):.0f}ms)")
+
+    if args.out:
+        if not config:
+            sys.exit("--out requires --config")
+        write_config(args.out, pymedia_align.delay_config(
+            config, delay, args.mains_channels, args.sub_channels,
+            polarity=result['polarity']))
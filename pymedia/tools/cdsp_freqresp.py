@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+# Compute the frequency response of CamillaDSP config files (see
+# pymedia_freqresp): print a summary of each active output (mono signal on
+# capture channels 0+1), and optionally export CSV / PNG (requires matplotlib)
+# files.
+#
+# usage: ./tools/cdsp_freqresp.py [--csv file] [--png file] [--volume dB]
+#                                 [--points N] config.yml [config.yml ...]
+#
+# With several configs, the same engine (and filter cache) is used: the log
+# shows how many filter responses were computed vs re-used.
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+import pymedia_freqresp
+
+SUMMARY_FREQS = (20, 30, 50, 80, 100, 150, 200, 500, 1000, 2000, 5000, 10000,
+                 20000)
+
+# ---------------------
+
+def print_summary(path, freqs, response):
+    mono = pymedia_freqresp.mono_response(response)
+    indexes = [index for index in np.searchsorted(freqs, SUMMARY_FREQS)
+               if index < len(freqs)]
+    print(f"== {path}")
+    print(f"{'Hz':>8}" + "".join(f"{freqs[index]:8.0f}" for index in indexes))
+    outputs = pymedia_freqresp.active_outputs(mono)
+    for out in outputs:
+        mag = pymedia_freqresp.magnitude_db(mono[out])
+        print(f"{'out ' + str(out):>8}"
+              + "".join(f"{mag[index]:8.1f}" for index in indexes))
+    mag = pymedia_freqresp.magnitude_db(np.sum(mono[outputs], axis=0))
+    print(f"{'sum':>8}" + "".join(f"{mag[index]:8.1f}" for index in indexes))
+
+def output_path(path, config_path, nb_configs):
+    """Add the config name to path if there are several configs."""
+    if nb_configs == 1:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}_{os.path.splitext(os.path.basename(config_path))[0]}{ext}"
+
+# ---------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+            description="CamillaDSP config frequency response")
+    parser.add_argument('configs', nargs='+')
+    parser.add_argument('--csv')
+    parser.add_argument('--png')
+    parser.add_argument('--volume', type=float,
+                        help="volume (dB) for Loudness filters (default: flat)")
+    parser.add_argument('--points', type=int,
+                        default=pymedia_freqresp.FREQRESP_POINTS)
+    args = parser.parse_args()
+
+    engines = {}
+    for config_path in args.configs:
+        config = pymedia_freqresp.read_config(config_path)
+        samplerate = config['devices']['samplerate']
+        if samplerate not in engines:
+            engines[samplerate] = pymedia_freqresp.FrequencyResponse(
+                    samplerate,
+                    pymedia_freqresp.log_freqs(samplerate, args.points),
+                    args.volume)
+        engine = engines[samplerate]
+
+        start = time.perf_counter()
+        response = engine.compute(config)
+        elapsed = time.perf_counter() - start
+
+        print_summary(config_path, engine.freqs, response)
+        print(f"{elapsed * 1000:.2f}ms - filters: {engine.stats['computed']}"
+              f" computed, {engine.stats['cached']} cached\n")
+
+        if args.csv:
+            pymedia_freqresp.export_csv(
+                    output_path(args.csv, config_path, len(args.configs)),
+                    engine.freqs, response)
+        if args.png:
+            pymedia_freqresp.export_png(
+                    output_path(args.png, config_path, len(args.configs)),
+                    engine.freqs, response, title=config_path)
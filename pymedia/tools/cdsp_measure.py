@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+# Measure the response of the system and fit a CamillaDSP EQ (see
+# pymedia_measure):
+#
+# - sweep: generate a log sweep wav file at the config capture sample rate
+#
+#   ./tools/cdsp_measure.py sweep config.yml sweep.wav
+#
+# - record: play the sweep through the loopback (CamillaDSP capture) and record
+#   from a measurement mic (live - alternatively play/record sweep.wav with any
+#   other tool)
+#
+#   ./tools/cdsp_measure.py record config.yml sweep.wav rec.wav \
+#       --playback Loopback0_0_c01 --channels L --capture hw:M4 \
+#       --capture-channels 2
+#
+# - fit: deconvolve the recording, fit peaking filters to a target curve and
+#   write a patched config where the filters named PREFIX* are replaced (works
+#   offline, with any recording of sweep.wav)
+#
+#   ./tools/cdsp_measure.py fit config.yml sweep.wav rec.wav patched.yml \
+#       --prefix "REW MAINS" --pipeline-channels 0 1 --range 100 15000 \
+#       [--target house_curve.txt] [--filters 10] [--csv fit.csv]
+#
+# Note: the patched config is re-written by the yaml module, so comments are
+# lost - use it as a reference / diff it against the original.
+
+import argparse
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+import pymedia_measure
+from pymedia_freqresp import capture_params, read_config
+
+# sweep channels on the 2 channels (L/R) loopback playback devices
+SWEEP_CHANNELS = {'L': (1, 0), 'R': (0, 1), 'LR': (1, 1)}
+
+# ---------------------
+
+def cmd_sweep(args, config):
+    rate = capture_params(config)['samplerate']
+    sweep = pymedia_measure.log_sweep(rate, args.duration)
+    pymedia_measure.write_wav(args.sweep, sweep, rate)
+    print(f"{args.sweep}: {args.duration}s @ {rate}Hz")
+
+def cmd_record(args, config):
+    # only required for live measurements (alsaaudio)
+    # pylint: disable=import-outside-toplevel
+    from pymedia_pcm import PcmCapture, PcmPlayback
+
+    params = capture_params(config)
+    sweep, rate = pymedia_measure.read_wav(args.sweep)
+    if rate != params['samplerate']:
+        sys.exit(f"sweep rate {rate} != config capture rate"
+                 f" {params['samplerate']}")
+    playback = PcmPlayback(args.playback, 2, rate, params['format'])
+    capture = PcmCapture(args.capture, args.capture_channels, rate,
+                         args.capture_format)
+    recording = pymedia_measure.play_and_record(
+            playback, capture,
+            sweep[:, :1] * np.array(SWEEP_CHANNELS[args.channels]))
+    if recording is None:
+        sys.exit("recording failed")
+    pymedia_measure.write_wav(args.recording, recording, rate, 4)
+    print(f"{args.recording}: {len(recording) / rate:.1f}s,"
+          f" peak {20 * np.log10(np.abs(recording).max() + 1e-12):.1f}dBFS")
+
+def cmd_fit(args, config):
+    sweep, rate = pymedia_measure.read_wav(args.sweep)
+    recording, rec_rate = pymedia_measure.read_wav(args.recording)
+    if rec_rate != rate:
+        sys.exit(f"recording rate {rec_rate} != sweep rate {rate}")
+    start = time.perf_counter()
+    patched, filters, details = pymedia_measure.fit_config(
+            config, sweep[:, 0], recording, rate, args.prefix,
+            args.pipeline_channels, args.target, args.filters,
+            tuple(args.range), args.rec_channel)
+    elapsed = time.perf_counter() - start
+    for index, (freq, gain, q_factor) in enumerate(filters):
+        print(f"{args.prefix} {index}: {freq:8.1f}Hz {gain:+6.1f}dB"
+              f" q {q_factor:5.2f}")
+    print(f"rms error {details['rms_error_before']:.2f}dB ->"
+          f" {details['rms_error_after']:.2f}dB ({elapsed:.2f}s)")
+    pymedia_measure.write_config(args.config_out, patched)
+    if args.csv:
+        with open(args.csv, 'w', newline='', encoding="utf-8") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(("freq", "raw", "target", "corrected"))
+            for row in zip(details['freqs'], details['raw'],
+                           details['target'], details['corrected']):
+                writer.writerow(f"{value:.2f}" for value in row)
+
+# ---------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+            description="measure and fit a CamillaDSP EQ")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sub = subparsers.add_parser('sweep')
+    sub.add_argument('config')
+    sub.add_argument('sweep')
+    sub.add_argument('--duration', type=float,
+                     default=pymedia_measure.MEASURE_SWEEP_DURATION)
+
+    sub = subparsers.add_parser('record')
+    sub.add_argument('config')
+    sub.add_argument('sweep')
+    sub.add_argument('recording')
+    sub.add_argument('--playback', default="Loopback0_0_c01")
+    sub.add_argument('--channels', choices=SWEEP_CHANNELS, default='LR')
+    sub.add_argument('--capture', required=True)
+    sub.add_argument('--capture-channels', type=int, default=1)
+    sub.add_argument('--capture-format', default='S32LE')
+
+    sub = subparsers.add_parser('fit')
+    sub.add_argument('config')
+    sub.add_argument('sweep')
+    sub.add_argument('recording')
+    sub.add_argument('config_out')
+    sub.add_argument('--prefix', required=True)
+    sub.add_argument('--pipeline-channels', type=int, nargs='+',
+                     required=True)
+    sub.add_argument('--rec-channel', type=int, default=0)
+    sub.add_argument('--target')
+    sub.add_argument('--filters', type=int,
+                     default=pymedia_measure.EQ_FILTERS)
+    sub.add_argument('--range', type=float, nargs=2,
+                     default=pymedia_measure.EQ_FREQ_RANGE)
+    sub.add_argument('--csv')
+
+    cmd_args = parser.parse_args()
+    {
+        'sweep': cmd_sweep,
+        'record': cmd_record,
+        'fit': cmd_fit,
+    }[cmd_args.command](cmd_args, read_config(cmd_args.config))
@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+
+# pylint: disable=missing-module-docstring
+# pylint: disable=missing-class-docstring
+# pylint: disable=missing-function-docstring
+
+# Exercise the GPIO input code (pymedia_gpio, pymedia_rotary_encoder) on
+# simulated chips (pymedia_gpio_sim): replay synthetic edge sequences with
+# bounce noise - or sequences recorded on real hardware - at precise timings,
+# and measure callback latency, missed/spurious presses and detents.
+#
+# usage: ./tools/gpio_sim.py buttons [--presses N] [--bounces N] ...
+#        ./tools/gpio_sim.py encoder [--turns N] [--rate detents/s]
+#                                    [--file recorded.txt] ...
+#        ./tools/gpio_sim.py record /dev/gpiochipN offset [offset ...]
+#
+# record (real hardware) prints the edge events of the given lines as 'time
+# offset level' lines, which can be replayed with encoder --file.
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+if sys.argv[1:2] != ["record"]:
+    os.environ["PYMEDIA_GPIO_SIM"] = "1"
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+import pymedia_gpio_sim
+from pymedia_gpio import (DigitalInputPinEvent, GpioEventLoop, is_rising,
+                          line_settings, open_chip)
+from pymedia_rotary_encoder import RotaryEncoder
+
+BUTTON_CHIP = "/dev/gpiochip2"      # see gpios.py
+BUTTON_PIN = 4
+ENCODER_CHIP = "/dev/gpiochip0"     # see rotary_encoder.py
+ENCODER_PINS = (16, 15)
+MATCH_WINDOW = 0.2                  # seconds - max callback latency
+
+# ---------------------
+
+def start_loop(gpio_input):
+    loop = GpioEventLoop()
+    loop.add(gpio_input)
+    thread = threading.Thread(target=loop.run)
+    thread.daemon = True
+    thread.start()
+
+def print_latencies(name, latencies):
+    if not latencies:
+        return
+    print(f"  {name} latency: mean {1000 * statistics.mean(latencies):.2f}ms,"
+          f" max {1000 * max(latencies):.2f}ms")
+
+def match(expected, calls):
+    """Match expected (type, time) and callback (type, time) lists in order;
+    return the latencies, missed and spurious callbacks."""
+    latencies = []
+    missed = 0
+    calls = list(calls)
+    for exp_type, exp_time in expected:
+        call = next((call for call in calls if call[0] == exp_type
+                     and exp_time <= call[1] <= exp_time + MATCH_WINDOW), None)
+        if call is None:
+            missed += 1
+            continue
+        calls.remove(call)
+        latencies.append(call[1] - exp_time)
+    return latencies, missed, len(calls)
+
+def run_buttons(args):
+    chip = open_chip(BUTTON_CHIP)
+    pymedia_gpio_sim.set_level(BUTTON_CHIP, BUTTON_PIN, 1)     # pull up
+    calls = []
+    button = DigitalInputPinEvent(
+            chip, BUTTON_PIN, pullup=True,
+            cb_pressed=lambda: calls.append(("pressed", time.monotonic())),
+            cb_held=lambda: calls.append(("held", time.monotonic())),
+            debounce_delay=args.debounce, held_time=args.held_time)
+    start_loop(button)
+
+    rng = random.Random(args.seed)
+    sequence = []
+    expected = []       # (callback type, time of the user action)
+    timestamp = 0.1
+    for press in range(args.presses):
+        held = press % 4 == 3
+        duration = (args.held_time + 0.3 if held
+                    else rng.uniform(2 * args.debounce, 0.3))
+        sequence += pymedia_gpio_sim.button_press(
+                BUTTON_PIN, timestamp, duration, active_low=True,
+                bounces=args.bounces, bounce_time=args.bounce_time, rng=rng)
+        expected.append(("held", timestamp + args.held_time) if held
+                        else ("pressed", timestamp + duration))
+        timestamp += duration + rng.uniform(0.1, 0.3)
+
+    start = pymedia_gpio_sim.replay(BUTTON_CHIP, sequence)
+    time.sleep(args.debounce + MATCH_WINDOW)
+
+    latencies, missed, spurious = match(
+            [(exp_type, start + exp_time) for exp_type, exp_time in expected],
+            calls)
+    print(f"buttons: {args.presses} presses ({len(sequence)} edges, bounces"
+          f" {args.bounces} within {1000 * args.bounce_time:.1f}ms, debounce"
+          f" {1000 * args.debounce:.0f}ms) -> {len(calls)} callbacks, missed"
+          f" {missed}, spurious {spurious}")
+    print_latencies("callback", latencies)
+
+def run_encoder(args):
+    chip = open_chip(ENCODER_CHIP)
+    pin1, pin2 = args.pins
+    for pin in args.pins:
+        pymedia_gpio_sim.set_level(ENCODER_CHIP, pin, 1)     # rest: 11
+    calls = []
+    encoder = RotaryEncoder(
+            chip, pin1, pin2,
+            callback=lambda value, _: calls.append(("detent",
+                                                    time.monotonic())))
+    start_loop(encoder)
+
+    expected = []       # time of the last edge of each detent
+    net = 0
+    if args.file:
+        sequence = pymedia_gpio_sim.load_sequence(args.file)
+        print(f"{args.file}: {len(sequence)} edges")
+    else:
+        rng = random.Random(args.seed)
+        sequence = []
+        timestamp = 0.1
+        period = 1 / args.rate
+        for turn in range(args.turns):
+            detents = rng.randint(3, 24) * (1 if turn % 3 else -1)
+            sequence += pymedia_gpio_sim.encoder_turn(
+                    pin1, pin2, timestamp, detents, args.rate,
+                    bounces=args.bounces, bounce_time=args.bounce_time,
+                    rng=rng)
+            expected += [timestamp + (detent + 0.75) * period
+                         for detent in range(abs(detents))]
+            net += detents
+            timestamp += abs(detents) * period + rng.uniform(0.1, 0.4)
+
+    start = pymedia_gpio_sim.replay(ENCODER_CHIP, sequence)
+    time.sleep(MATCH_WINDOW)
+
+    if args.file:
+        print(f"  {len(calls)} detents, value {encoder.value()}")
+        return
+    latencies, missed, spurious = match(
+            [("detent", start + exp_time) for exp_time in expected], calls)
+    print(f"encoder: {len(expected)} detents at {args.rate:g}/s"
+          f" ({len(sequence)} edges, bounces {args.bounces} within"
+          f" {1000 * args.bounce_time:.2f}ms) -> {len(calls)} callbacks,"
+          f" missed {missed}, spurious {spurious}, value {encoder.value()}"
+          f" (expected {net})")
+    print_latencies("callback", latencies)
+
+
+class Recorder():
+    """Print the edge events of lines (real hardware)."""
+    def __init__(self, chip, offsets):
+        self.request = chip.request_lines(
+                config={tuple(offsets): line_settings()}, consumer="gpio_sim")
+        self._start = None
+
+    def process_events(self, events):
+        for event in events:
+            if self._start is None:
+                self._start = event.timestamp_ns
+            print(f"{(event.timestamp_ns - self._start) / 1e9:.6f}"
+                  f" {event.line_offset} {int(is_rising(event))}", flush=True)
+
+# ---------------------
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="simulated GPIO inputs")
+    parser.add_argument("--seed", type=int, default=0)
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    buttons = subparsers.add_parser("buttons")
+    buttons.add_argument("--presses", type=int, default=20)
+    buttons.add_argument("--bounces", type=int, default=3)
+    buttons.add_argument("--bounce-time", type=float, default=0.005)
+    buttons.add_argument("--debounce", type=float, default=0.02)
+    buttons.add_argument("--held-time", type=float, default=1)
+
+    encoder_parser = subparsers.add_parser("encoder")
+    encoder_parser.add_argument("--turns", type=int, default=10)
+    encoder_parser.add_argument("--rate", type=float, default=20,
+                                help="detents/s")
+    encoder_parser.add_argument("--bounces", type=int, default=2)
+    encoder_parser.add_argument("--bounce-time", type=float, default=0.0005)
+    encoder_parser.add_argument("--pins", type=int, nargs=2,
+                                default=ENCODER_PINS)
+    encoder_parser.add_argument("--file", help="recorded edge sequence")
+
+    record = subparsers.add_parser("record")
+    record.add_argument("chip")
+    record.add_argument("offsets", type=int, nargs="+")
+
+    args = parser.parse_args()
+
+    if args.mode == "buttons":
+        run_buttons(args)
+    elif args.mode == "encoder":
+        run_encoder(args)
+    else:
+        loop = GpioEventLoop()
+        loop.add(Recorder(open_chip(args.chip), args.offsets))
+        loop.run()